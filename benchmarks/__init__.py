@@ -0,0 +1,5 @@
+"""
+Benchmarks for kpcli against generated databases of 1k, 10k and 100k entries
+
+    python -m benchmarks --sizes 1000 10000 --output results.json
+"""
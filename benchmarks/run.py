@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Time kpcli's database operations against generated databases and write the results as JSON.
+
+    python -m benchmarks --sizes 1000 10000 100000 --output results.json
+"""
+
+# standards
+import argparse
+from importlib import metadata
+import json
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from kpcli.comparator import KpDatabaseComparator
+from kpcli.connector import KpDatabaseConnector
+from kpcli.datastructures import KpConfig
+from kpcli.exporter import export_records
+from kpcli.output import RecordWriter
+
+from benchmarks.vaults import PASSWORD, get_or_generate_vault
+
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+DEFAULT_VAULT_DIR = Path(tempfile.gettempdir()) / "kpcli-benchmark-vaults"
+
+
+def timed(function, repeat):
+    """Run function `repeat` times, returning the timings in seconds"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return {
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "max": max(timings),
+        "repeat": repeat,
+    }
+
+
+def _import_rows(batch, count):
+    for index in range(count):
+        yield {
+            "group": f"imported/batch {batch}",
+            "title": f"imported entry {index}",
+            "username": "user",
+            "password": "pass",
+            "url": "",
+            "notes": "",
+        }
+
+
+def _export(connector):
+    """Export every entry as CSV, discarding the output"""
+    with RecordWriter("csv", ["title", "username", "password", "group"], write=len) as writer:
+        writer.write_all(export_records(connector))
+
+
+def benchmark_vault(filename, repeat=3):
+    """Time each operation against the database at filename"""
+    config = KpConfig(filename=filename, password=PASSWORD)
+    results = {}
+    results["open"] = timed(lambda: KpDatabaseConnector(config), repeat)
+
+    connector = KpDatabaseConnector(config)
+    results["find_entries"] = timed(lambda: connector.find_entries("entry 1"), repeat)
+    results["find_entries_in_group"] = timed(
+        lambda: connector.find_entries("group 3.1/entry"), repeat
+    )
+    # the first search builds the search index
+    results["search_entries_fuzzy"] = timed(
+        lambda: connector.search_entries("entyr 12"), repeat
+    )
+    # the first search builds the full-text index
+    results["search_text"] = timed(
+        lambda: list(connector.search_text("url:host12 OR username:user42")), repeat
+    )
+    results["list_group_names"] = timed(connector.list_group_names, repeat)
+    results["ls_entries"] = timed(lambda: list(connector.iter_group_entries()), repeat)
+    results["export_csv"] = timed(lambda: _export(connector), repeat)
+
+    # add to a copy, so the generated database can be reused
+    with tempfile.TemporaryDirectory() as tempdir:
+        copy_filename = Path(tempdir) / filename.name
+        shutil.copy(filename, copy_filename)
+        copy_connector = KpDatabaseConnector(KpConfig(filename=copy_filename, password=PASSWORD))
+        root = copy_connector.find_group("root")
+        counter = iter(range(repeat))
+        results["add_new_entry"] = timed(
+            lambda: copy_connector.add_new_entry(
+                root, f"benchmark entry {next(counter)}", "user", "pass", "", ""
+            ),
+            repeat,
+        )
+        # where the time goes in the last save
+        results["save_stages"] = copy_connector.save_timings[-1]
+        batches = iter(range(repeat))
+        results["import_1000_entries"] = timed(
+            lambda: copy_connector.import_entries(_import_rows(next(batches), 1000)),
+            repeat,
+        )
+
+    comparator = KpDatabaseComparator(config)
+    results["compare"] = timed(comparator.get_conflicting_data, repeat)
+    return results
+
+
+def _help_startup():
+    """Run `kpcli --help` in a new interpreter, as a command starts up"""
+    subprocess.run(
+        [sys.executable, "-m", "kpcli.cli", "--help"], stdout=subprocess.DEVNULL, check=True
+    )
+
+
+def _kpcli_version():
+    try:
+        return metadata.version("kpcli")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def run(sizes, vault_dir, copies, repeat):
+    results = {
+        "kpcli_version": _kpcli_version(),
+        "python_version": platform.python_version(),
+        "platform": platform.platform(),
+        "copies": copies,
+        # independent of the database size
+        "help_startup": timed(_help_startup, repeat),
+        "results": {},
+    }
+    for size in sizes:
+        print(f"Generating vault with {size} entries", file=sys.stderr)
+        filename = get_or_generate_vault(vault_dir, size, copies=copies)
+        print(f"Benchmarking {filename}", file=sys.stderr)
+        results["results"][str(size)] = benchmark_vault(filename, repeat=repeat)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Numbers of entries"
+    )
+    parser.add_argument(
+        "--vault-dir",
+        type=Path,
+        default=DEFAULT_VAULT_DIR,
+        help="Where generated databases are kept and reused from",
+    )
+    parser.add_argument(
+        "--copies", type=int, default=3, help="Number of conflicting copies to compare"
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of each operation")
+    parser.add_argument("--output", type=Path, help="JSON file to write (default: stdout)")
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.vault_dir, args.copies, args.repeat)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
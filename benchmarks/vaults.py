@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""Generate large KeePass databases, and conflicting copies of them, for benchmarking."""
+
+# standards
+from pathlib import Path
+import random
+import shutil
+
+# third parties
+from pykeepass import PyKeePass, create_database
+
+
+PASSWORD = "benchmark"
+
+
+def group_names(depth, branching):
+    """
+    Paths (as lists of names) of a tree of groups, `depth` levels deep with `branching`
+    subgroups per group, in the order they should be created
+    """
+    paths = [[]]
+    level = [[]]
+    for level_number in range(depth):
+        level = [
+            [*parent, f"group {level_number}.{index}"]
+            for parent in level
+            for index in range(branching)
+        ]
+        paths.extend(level)
+    return paths
+
+
+def generate_vault(filename, entry_count, depth=4, branching=4, seed=0):
+    """
+    Create a database at filename with entry_count entries spread evenly over a tree of
+    groups.  Entries are numbered, so the same arguments always generate the same entries.
+    """
+    rng = random.Random(seed)
+    db = create_database(str(filename), password=PASSWORD)
+    groups = {(): db.root_group}
+    for path in group_names(depth, branching):
+        if path:
+            groups[tuple(path)] = db.add_group(groups[tuple(path[:-1])], path[-1])
+    group_list = list(groups.values())
+    for index in range(entry_count):
+        group = group_list[index % len(group_list)]
+        db.add_entry(
+            group,
+            title=f"entry {index}",
+            username=f"user{index}@example.com",
+            password="".join(rng.choice("abcdefghijklmnop0123456789") for _ in range(16)),
+            url=f"https://host{index % 997}.example.com",
+            notes=f"notes for entry {index}",
+        )
+    db.save()
+    return filename
+
+
+def generate_conflicting_copy(
+    filename, copy_filename, changed=0.01, removed=0.005, added=0.005, seed=1
+):
+    """
+    Copy a database and make it diverge: change the password of a fraction of its entries,
+    remove a fraction, and add new entries
+    """
+    rng = random.Random(seed)
+    shutil.copy(filename, copy_filename)
+    db = PyKeePass(str(copy_filename), password=PASSWORD)
+    entries = db.entries
+    entry_count = len(entries)
+    sample = rng.sample(entries, int(entry_count * (changed + removed)))
+    changed_count = int(entry_count * changed)
+    for entry in sample[:changed_count]:
+        entry.password = f"changed {rng.random()}"
+    for entry in sample[changed_count:]:
+        db.delete_entry(entry)
+    for index in range(int(entry_count * added)):
+        db.add_entry(db.root_group, f"added entry {index}", "user", "pass")
+    db.save()
+    return copy_filename
+
+
+def get_or_generate_vault(directory, entry_count, copies=0, **kwargs):
+    """
+    Return the path to a generated database with entry_count entries and the requested
+    number of conflicting copies, generating them if they don't already exist in directory
+    """
+    # compare finds copies by filename stem, so each size gets its own directory
+    directory = Path(directory) / str(entry_count)
+    directory.mkdir(parents=True, exist_ok=True)
+    filename = directory / "vault.kdbx"
+    if not filename.exists():
+        generate_vault(filename, entry_count, **kwargs)
+    for copy_number in range(copies):
+        copy_filename = directory / f"vault_conflicting_copy_{copy_number}.kdbx"
+        if not copy_filename.exists():
+            generate_conflicting_copy(filename, copy_filename, seed=copy_number)
+    return filename
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+Keep an unlocked KeePassX database resident between kpcli invocations.
+
+The agent holds an opened KpDatabaseConnector and serves connector calls over a
+Unix socket in the user's ~/.kp directory.  It exits after an idle timeout.
+"""
+
+# standards
+import json
+import logging
+import os
+from os import environ
+from pathlib import Path
+import socket
+import uuid
+
+# third parties
+import attr
+
+from kpcli import clipboard
+from kpcli.connector import KpDatabaseConnector
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_AGENT_TTL = 60 * 15
+# Seconds a client may take to send its request or read the response
+CONNECTION_TIMEOUT = 5
+
+# Connector methods that may be called on the agent
+REMOTE_METHODS = (
+    "add_group",
+    "delete_group",
+    "list_group_names",
+    "list_group_entries",
+    "iter_group_entries",
+    "find_entries",
+    "search_entries",
+    "search_text",
+    "find_entry",
+    "find_group",
+    "add_new_entry",
+    "delete_entry",
+    "edit_entry",
+    "change_password",
+    "copy_to_clipboard",
+)
+
+
+class AgentError(Exception):
+    pass
+
+
+def agent_socket_path(profile="default"):
+    """Location of the agent socket for a config profile"""
+    return Path(environ["HOME"]) / ".kp" / f".agent_{profile}.sock"
+
+
+@attr.s
+class AgentGroup:
+    """
+    A group held by the agent
+    """
+
+    uuid = attr.ib(type=str)
+    name = attr.ib(type=str)
+
+
+@attr.s
+class AgentEntry:
+    """
+    A copy of an entry held by the agent
+    """
+
+    uuid = attr.ib(type=str)
+    title = attr.ib(type=str)
+    username = attr.ib(type=str)
+    password = attr.ib(type=str)
+    url = attr.ib(type=str)
+    notes = attr.ib(type=str)
+    group = attr.ib(type=AgentGroup)
+
+
+def _encode(value):
+    """Encode a connector result as JSON-serialisable data"""
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, (AgentEntry, AgentGroup)):
+        # only the uuid is needed to find the object again on the agent side
+        key = "__entry__" if isinstance(value, AgentEntry) else "__group__"
+        return {key: {"uuid": value.uuid}}
+    if isinstance(value, dict):
+        return {key: _encode(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)) or hasattr(value, "__next__"):
+        return [_encode(item) for item in value]
+
+    # only the agent has pykeepass objects to encode, so clients don't need to import it
+    from pykeepass.entry import Entry
+    from pykeepass.group import Group
+
+    if isinstance(value, Entry):
+        return {
+            "__entry__": {
+                "uuid": str(value.uuid),
+                "title": value.title,
+                "username": value.username,
+                "password": value.password,
+                "url": value.url,
+                "notes": value.notes,
+                "group": _encode(value.group),
+            }
+        }
+    if isinstance(value, Group):
+        return {"__group__": {"uuid": str(value.uuid), "name": value.name}}
+    return value
+
+
+def _decode_result(value):
+    """Decode agent data into AgentEntry and AgentGroup objects"""
+    if isinstance(value, dict):
+        if "__entry__" in value:
+            data = dict(value["__entry__"])
+            data["group"] = _decode_result(data["group"])
+            return AgentEntry(**data)
+        if "__group__" in value:
+            return AgentGroup(**value["__group__"])
+        return {key: _decode_result(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_decode_result(item) for item in value]
+    return value
+
+
+class KpAgentServer:
+    """
+    Serves connector calls for a single unlocked database over a Unix socket.
+    """
+
+    def __init__(self, connector, socket_path, ttl=DEFAULT_AGENT_TTL):
+        self.connector = connector
+        self.socket_path = Path(socket_path)
+        self.ttl = ttl
+        self.running = False
+        self._mtime = self._db_mtime()
+
+    def _db_mtime(self):
+        journal = self.connector.journal
+        journal_mtime = journal.filename.stat().st_mtime_ns if journal.exists() else None
+        return Path(self.connector.db.filename).stat().st_mtime_ns, journal_mtime
+
+    def _decode_arg(self, value):
+        """Find the database objects referred to in a request"""
+        if isinstance(value, dict):
+            if "__entry__" in value:
+                return self.connector.db.find_entries(
+                    uuid=uuid.UUID(value["__entry__"]["uuid"]), first=True
+                )
+            if "__group__" in value:
+                return self.connector.db.find_groups(
+                    uuid=uuid.UUID(value["__group__"]["uuid"]), first=True
+                )
+            return {key: self._decode_arg(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self._decode_arg(item) for item in value]
+        return value
+
+    def handle_request(self, request):
+        """Run a single request and return the response"""
+        method = request.get("method")
+        if method == "ping":
+            return {
+                "result": {
+                    "filename": str(self.connector.db.filename),
+                    "pid": os.getpid(),
+                }
+            }
+        if method == "stop":
+            self.running = False
+            return {"result": None}
+        if method not in REMOTE_METHODS:
+            return {"error": "AgentError", "message": f"Unknown method {method}"}
+
+        # the files may have been changed by something other than the agent
+        if self._db_mtime() != self._mtime:
+            logger.debug("Database changed on disk, reloading")
+            self.connector.reload()
+        args = self._decode_arg(request.get("args", []))
+        kwargs = self._decode_arg(request.get("kwargs", {}))
+        try:
+            result = getattr(self.connector, method)(*args, **kwargs)
+        except (AttributeError, ValueError) as e:
+            return {"error": type(e).__name__, "message": str(e)}
+        finally:
+            self._mtime = self._db_mtime()
+        return {"result": _encode(result)}
+
+    def serve(self):
+        """Serve requests until stopped or idle for longer than the ttl"""
+        if self.socket_path.exists():
+            self.socket_path.unlink()
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o077)
+        try:
+            server.bind(str(self.socket_path))
+        finally:
+            os.umask(old_umask)
+        server.listen()
+        server.settimeout(self.ttl)
+        # the agent keeps the clipboard backend and clears copied passwords itself
+        clipboard.run_timers_in_process()
+        self.running = True
+        try:
+            while self.running:
+                try:
+                    conn, _ = server.accept()
+                except socket.timeout:
+                    logger.debug("Agent idle for %s seconds, exiting", self.ttl)
+                    break
+                with conn:
+                    # requests are served one at a time, so a client that stalls is
+                    # dropped rather than blocking every later command
+                    conn.settimeout(CONNECTION_TIMEOUT)
+                    try:
+                        data = conn.makefile("rb").readline()
+                    except socket.timeout:
+                        logger.debug("No request received, dropping the connection")
+                        continue
+                    try:
+                        response = self.handle_request(json.loads(data))
+                    except Exception as e:
+                        response = {"error": "AgentError", "message": str(e)}
+                    try:
+                        conn.sendall(json.dumps(response).encode() + b"\n")
+                    except OSError:
+                        logger.debug("Could not send the response", exc_info=True)
+        finally:
+            server.close()
+            if self.socket_path.exists():
+                self.socket_path.unlink()
+            clipboard.clear_pending()
+
+
+def _remote(method):
+    def call(self, *args, **kwargs):
+        return self._call(method, *args, **kwargs)
+
+    call.__name__ = method
+    call.__doc__ = getattr(KpDatabaseConnector, method).__doc__
+    return call
+
+
+class AgentConnector(KpDatabaseConnector):
+    """
+    A KpDatabaseConnector that forwards database calls to a running agent.
+    """
+
+    def __init__(self, socket_path):
+        self.socket_path = Path(socket_path)
+
+    def _request(self, request):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(str(self.socket_path))
+            client.sendall(json.dumps(request).encode() + b"\n")
+            data = client.makefile("rb").readline()
+        if not data:
+            raise AgentError("No response from agent")
+        response = json.loads(data)
+        if "error" in response:
+            error_class = {"AttributeError": AttributeError, "ValueError": ValueError}
+            raise error_class.get(response["error"], AgentError)(response["message"])
+        return _decode_result(response["result"])
+
+    def _call(self, method, *args, **kwargs):
+        return self._request(
+            {"method": method, "args": _encode(args), "kwargs": _encode(kwargs)}
+        )
+
+    def ping(self):
+        """Fetch the agent's database filename and process id"""
+        return self._request({"method": "ping"})
+
+    def stop(self):
+        """Ask the agent to exit"""
+        return self._request({"method": "stop"})
+
+    def reload(self):
+        # the agent reloads by itself when the database file changes
+        pass
+
+    add_group = _remote("add_group")
+    delete_group = _remote("delete_group")
+    list_group_names = _remote("list_group_names")
+    list_group_entries = _remote("list_group_entries")
+    iter_group_entries = _remote("iter_group_entries")
+    find_entries = _remote("find_entries")
+    search_entries = _remote("search_entries")
+    search_text = _remote("search_text")
+    find_entry = _remote("find_entry")
+    find_group = _remote("find_group")
+    add_new_entry = _remote("add_new_entry")
+    delete_entry = _remote("delete_entry")
+    copy_to_clipboard = _remote("copy_to_clipboard")
+
+    def edit_entry(self, entry, field, new_value):
+        """Edit a specified field on an entry"""
+        self._call("edit_entry", entry, field, new_value)
+        setattr(entry, field, new_value)
+
+    def change_password(self, entry, new_password):
+        """Change an entry's password"""
+        self._call("change_password", entry, new_password)
+        entry.password = new_password
+
+
+def _ping_running_agent(profile="default"):
+    """
+    Return an AgentConnector for this profile's agent and its ping response, or
+    (None, None) if no agent is running
+    """
+    socket_path = agent_socket_path(profile)
+    if not hasattr(socket, "AF_UNIX") or not socket_path.exists():
+        return None, None
+    connector = AgentConnector(socket_path)
+    try:
+        agent_info = connector.ping()
+    except (OSError, ValueError, AgentError):
+        logger.debug("Agent socket %s is not responding", socket_path)
+        return None, None
+    return connector, agent_info
+
+
+def get_running_agent(profile="default"):
+    """
+    Return an AgentConnector if an agent is running for this profile, otherwise None
+    """
+    return _ping_running_agent(profile)[0]
+
+
+def get_agent_connector(db_config, profile="default"):
+    """
+    Return an AgentConnector if an agent is running for this profile's database,
+    otherwise None
+    """
+    connector, agent_info = _ping_running_agent(profile)
+    if connector is None or agent_info["filename"] != str(db_config.filename):
+        return
+    return connector
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Run a script of kpcli commands against a database as a single transaction.
+"""
+
+# standards
+import shlex
+
+from kpcli.shell import run_command
+
+
+class BatchError(Exception):
+    pass
+
+
+def parse_script(lines):
+    """
+    Parse a script into (line number, command name, args), skipping blank lines and
+    comments
+    """
+    commands = []
+    for line_number, line in enumerate(lines, start=1):
+        try:
+            name, *args = shlex.split(line, comments=True) or [None]
+        except ValueError as e:
+            raise BatchError(f"Line {line_number}: {e}")
+        if name is not None:
+            commands.append((line_number, name, args))
+    return commands
+
+
+def run_batch(group_ctx, obj, lines):
+    """
+    Run each command in the script, saving the database once at the end.  If a command
+    fails, none of the script's changes are saved.
+    Returns the number of commands run.
+    """
+    commands = parse_script(lines)
+    with obj["obj"].connector.transaction():
+        for line_number, name, args in commands:
+            try:
+                exit_code = run_command(group_ctx, obj, name, args)
+            except (AttributeError, ValueError) as e:
+                raise BatchError(f"Line {line_number}: {e}")
+            if exit_code:
+                raise BatchError(f"Line {line_number}: {name} failed")
+    return len(commands)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""Cache of comparison database entries, so unchanged copies aren't decrypted again."""
+
+# standards
+import base64
+import hashlib
+import json
+from os import environ
+from pathlib import Path
+
+# third parties
+import attr
+from cryptography.fernet import Fernet, InvalidToken
+
+from kpcli.datastructures import KpEntrySnapshot
+from kpcli.kdbx import header_hash
+
+
+def default_cache_file(db_filename):
+    """
+    The cache file for comparisons with a main database, so that caches for different
+    databases (and profiles) don't overwrite each other
+    """
+    db_hash = hashlib.sha256(str(Path(db_filename).resolve()).encode()).hexdigest()
+    return Path(environ["HOME"]) / ".kp" / f".compare_cache-{db_hash[:16]}"
+
+
+def file_signature(filename):
+    """
+    Identifies a version of a database file by its size, modification time and
+    outer header
+    """
+    stat = Path(filename).stat()
+    return {
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+        "header": header_hash(filename),
+    }
+
+
+class KpComparisonCache:
+    """
+    Stores the entries of each comparison database (KpEntrySnapshots, as lists of their
+    fields, with sensitive fields hashed), and its last comparison
+    with the main database, against the database file's signature.
+
+    The cache file is encrypted with a key derived from the main database's transformed
+    key, so it can only be read by someone who can unlock the main database.
+    """
+
+    def __init__(self, cache_file, transformed_key):
+        self.cache_file = Path(cache_file)
+        # the prefix changes when the format of the cached entries does, so older caches
+        # can't be read and are started again
+        key = hashlib.sha256(b"kpcli-compare-cache-v3" + transformed_key).digest()
+        self.fernet = Fernet(base64.urlsafe_b64encode(key))
+        self.hits = 0
+        self.misses = 0
+        self.data = self._load()
+
+    def _load(self):
+        if not self.cache_file.exists():
+            return {}
+        try:
+            return json.loads(self.fernet.decrypt(self.cache_file.read_bytes()))
+        except (InvalidToken, ValueError):
+            # written for a different main database key, or unreadable; start again
+            return {}
+
+    def save(self):
+        # drop databases that no longer exist
+        self.data = {
+            filename: record
+            for filename, record in self.data.items()
+            if Path(filename).exists()
+        }
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        self.cache_file.write_bytes(self.fernet.encrypt(json.dumps(self.data).encode()))
+
+    def get(self, filename):
+        """
+        Return the cached record for a comparison database if the file hasn't changed since
+        it was cached (a cache hit), otherwise None (a miss)
+        """
+        record = self.data.get(str(filename))
+        if record is None or record["signature"] != file_signature(filename):
+            self.misses += 1
+            return
+        self.hits += 1
+        return record
+
+    def set(self, filename, entries):
+        """
+        Cache a comparison database's entries (None if it couldn't be opened)
+        """
+        self.data[str(filename)] = {
+            "signature": file_signature(filename),
+            "entries": (
+                None if entries is None else [attr.astuple(entry) for entry in entries]
+            ),
+            "comparison": None,
+        }
+
+    @staticmethod
+    def entries(record):
+        """The entries from a cached record, as KpEntrySnapshots"""
+        if record["entries"] is None:
+            return
+        return {KpEntrySnapshot(*fields) for fields in record["entries"]}
+
+    @staticmethod
+    def get_comparison(record, main_signature, show_details):
+        """
+        Return (True, result) if the record holds a comparison with this version of the main
+        database, otherwise (False, None)
+        """
+        comparison = record["comparison"]
+        if comparison is None or comparison["main"] != [main_signature, show_details]:
+            return False, None
+        result = comparison["result"]
+        if result is None:
+            return True, None
+        missing_in_comparison, missing_in_main, conflicts = result
+        return True, (
+            set(missing_in_comparison),
+            set(missing_in_main),
+            set(map(tuple, conflicts)),
+        )
+
+    def set_comparison(self, filename, main_signature, show_details, result):
+        """Cache the result of comparing a comparison database with the main database"""
+        self.data[str(filename)]["comparison"] = {
+            "main": [main_signature, show_details],
+            "result": None if result is None else [list(items) for items in result],
+        }
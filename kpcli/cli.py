@@ -1,29 +1,43 @@
 #!/usr/bin/env python3
 # standards
 import logging
-import signal
+import os
+from pathlib import Path
 import sys
-from typing import Optional
+from typing import List, Optional
 
 # third parties
-from pykeepass.exceptions import CredentialsError
-import pyperclip
 import typer
 
-from kpcli.comparator import KpDatabaseComparator
-from kpcli.datastructures import CopyOption, EditOption, Encrypter, KpContext
-from kpcli.connector import KpDatabaseConnector
+from kpcli.datastructures import (
+    CopyOption,
+    EditOption,
+    Encrypter,
+    FileFormat,
+    KpContext,
+    OutputFormat,
+)
+from kpcli import utils
+from kpcli.timing import phase
 from kpcli.utils import (
     echo_banner,
+    get_compression_level,
     get_config,
+    get_journal_config,
     get_timeout,
-    inputTimeOutHandler,
-    InputTimedOut,
 )
 
+# Modules that import pykeepass, cryptography, tableformatter or pyperclip are imported
+# in the commands that need them, so that --help and shell completion start quickly
+
 logger = logging.getLogger(__name__)
+# Number of similarly named entries to suggest when nothing matches
+MAX_SUGGESTIONS = 5
+# Commands that always open the database themselves, rather than using a running agent
+LOCAL_COMMANDS = ("batch", "compact", "compare", "export", "import", "merge", "shell")
 app = typer.Typer()
-signal.signal(signal.SIGALRM, inputTimeOutHandler)
+agent_app = typer.Typer(help="Keep the unlocked database resident in a background agent")
+app.add_typer(agent_app, name="agent")
 
 
 ############
@@ -37,6 +51,22 @@ def get_obj_from_ctx(ctx):
     return ctx.obj["obj"]
 
 
+def get_record_writer(ctx: typer.Context, fields):
+    """
+    A RecordWriter for the format chosen with --output, or None for text output
+    """
+    output_format = ctx.obj.get("output", OutputFormat.text)
+    if output_format == OutputFormat.text:
+        return None
+    from kpcli.output import RecordWriter
+
+    return RecordWriter(output_format, fields)
+
+
+def is_text_output(ctx: typer.Context):
+    return ctx.obj.get("output", OutputFormat.text) == OutputFormat.text
+
+
 def validate_group(ctx: typer.Context, group_name: str):
     """Find the first group matching group_name"""   
     if ctx.resilient_parsing:
@@ -62,8 +92,8 @@ def validate_title(ctx: typer.Context, title):
         typer.echo("--group is required")
         raise typer.Exit(1)
 
-    existing_entries = ctx_connector(ctx).find_entries(title, group)
-    if existing_entries:
+    existing_entry = ctx_connector(ctx).find_entry(title, group)
+    if existing_entry:
         typer.echo(f"An entry already exists for '{title}' in group {group.name}")
         raise typer.Abort()
     return title
@@ -103,22 +133,127 @@ def validate_selection_number(option_count):
 
 
 @app.command()
-def compare(ctx: typer.Context, show_details: bool = False):
+def compare(
+    ctx: typer.Context,
+    show_details: bool = False,
+    workers: Optional[int] = typer.Option(
+        None,
+        "--workers",
+        "-w",
+        min=1,
+        help="Number of conflicting copies to open in parallel (default: number of CPUs)",
+    ),
+    cache: bool = typer.Option(
+        True, help="Reuse results for conflicting copies that haven't changed"
+    ),
+    paths: Optional[List[Path]] = typer.Option(
+        None,
+        "--paths",
+        exists=True,
+        dir_okay=False,
+        help="Compare this database with the main database and every other (may be repeated)",
+    ),
+    directories: Optional[List[Path]] = typer.Option(
+        None,
+        "--dir",
+        exists=True,
+        file_okay=False,
+        help="Compare every database in this directory with the main database and every "
+        "other (may be repeated)",
+    ),
+):
     """
     Compare potentially conflicting copies of a KeePassX Database and report conflicts
 
     If a KeePassX database is opened and modified from multiple locations, conflicting copies may arise.  Dropbox for example
     will create a duplicate with the suffix `_conflicting_copy`.  Looks for conflicting files with the same stem as the
     main database file, compares them and reports on the conflicts.
+
+    With --paths or --dir, compares every database with every other instead, and reports the
+    number of entries that differ between each pair.
     """
+    from kpcli.cache import default_cache_file
+
     obj = get_obj_from_ctx(ctx)
-    typer.echo("Looking for conflicting files...")
-    conflicting_tables = obj.generate_tables_of_conflicts(show_details=show_details)
-    if not conflicting_tables:
-        typer.echo("No conflicting tables found")
-    for conflicting_table_name, conflicting_table in conflicting_tables.items():
+    if cache:
+        obj.use_cache(default_cache_file(obj.config.filename))
+    if paths or directories:
+        database_files = list(paths or [])
+        for directory in directories or []:
+            database_files.extend(sorted(directory.glob("*.kdbx")))
+        compare_matrix(ctx, database_files, workers)
+        return
+    writer = get_record_writer(
+        ctx, ["database", "main", "conflicting", "conflicting_fields"]
+    )
+    typer.echo("Looking for conflicting files...", err=writer is not None)
+    # results are written as each database is compared
+    if writer is not None:
+        with writer:
+            for database, data in obj.iter_conflicting_data(
+                show_details=show_details, workers=workers
+            ):
+                if data is None:
+                    typer.echo(f"{database}: Database could not be accessed", err=True)
+                    continue
+                writer.write_all(
+                    {
+                        "database": database,
+                        "main": main,
+                        "conflicting": conflicting,
+                        "conflicting_fields": conflicting_fields,
+                    }
+                    for main, conflicting, conflicting_fields in obj.conflict_rows(data)
+                )
+                writer.flush()
+        if cache:
+            typer.echo(f"Cache: {obj.cache.hits} hits, {obj.cache.misses} misses", err=True)
+        return
+    found = False
+    for conflicting_table_name, tables in obj.iter_tables_of_conflicts(
+        show_details=show_details, workers=workers
+    ):
+        found = True
         echo_banner(f"Comparison db: {conflicting_table_name}", fg=typer.colors.RED)
-        typer.echo(conflicting_table)
+        for table in tables:
+            typer.echo(table)
+    if not found:
+        typer.echo("No conflicting tables found")
+    if cache:
+        typer.echo(f"Cache: {obj.cache.hits} hits, {obj.cache.misses} misses")
+
+
+def compare_matrix(ctx: typer.Context, database_files, workers):
+    """Report the differences between every pair of the main database and database_files"""
+    obj = get_obj_from_ctx(ctx)
+    writer = get_record_writer(
+        ctx, ["database", "other", "only_in_database", "only_in_other", "conflicting"]
+    )
+    err = writer is not None
+    typer.echo("Comparing databases...", err=err)
+    fingerprints, matrix = obj.get_divergence_matrix(database_files, workers=workers)
+    if obj.cache is not None:
+        typer.echo(f"Cache: {obj.cache.hits} hits, {obj.cache.misses} misses", err=err)
+    if writer is not None:
+        for filename, fingerprint in fingerprints.items():
+            if fingerprint is None:
+                typer.echo(f"{filename}: Database could not be accessed", err=True)
+        with writer:
+            writer.write_all(
+                dict(zip(writer.fields, row)) for row in obj.divergence_rows(matrix)
+            )
+        return
+    for number, (filename, fingerprint) in enumerate(fingerprints.items(), start=1):
+        if fingerprint is None:
+            typer.secho(
+                f"{number}: {filename} (Database could not be accessed)", fg=typer.colors.RED
+            )
+        else:
+            typer.echo(f"{number}: {filename}")
+    typer.echo("Entries that differ between each pair of databases:")
+    typer.echo(obj.generate_divergence_table(fingerprints, matrix))
+    entry_count, identical = obj.nway_summary(fingerprints)
+    typer.echo(f"{entry_count} entries, {identical} identical in every database")
 
 
 def ctx_connector(ctx: typer.Context):
@@ -138,18 +273,30 @@ def list_groups_and_entries(
     """
     List groups and entries
     """
-    if group_name:
-        group = validate_group(ctx, group_name)
-        group_names = [group.name]
-    else:
-        group_names = ctx_connector(ctx).list_group_names()
+    group = validate_group(ctx, group_name) if group_name else None
 
     if entries:
-        for group_name in group_names:
-            entry_names = "\n".join(ctx_connector(ctx).list_group_entries(group_name))
-            echo_banner(f"{group_name}", fg=typer.colors.GREEN)
-            typer.echo(entry_names)
+        writer = get_record_writer(ctx, ["group", "title"])
+        if writer is not None:
+            with writer:
+                for group_path, entry_names in ctx_connector(ctx).iter_group_entries(group):
+                    writer.write_all(
+                        {"group": group_path, "title": title} for title in entry_names
+                    )
+            return
+        for group_path, entry_names in ctx_connector(ctx).iter_group_entries(group):
+            echo_banner(group_path, fg=typer.colors.GREEN)
+            typer.echo("\n".join(entry_names))
     else:
+        if group:
+            group_names = [group.name]
+        else:
+            group_names = ctx_connector(ctx).list_group_names()
+        writer = get_record_writer(ctx, ["group"])
+        if writer is not None:
+            with writer:
+                writer.write_all({"group": name} for name in group_names)
+            return
         group_names = "\n".join(group_names)
         echo_banner("Groups", fg=typer.colors.GREEN)
         typer.echo(group_names)
@@ -193,7 +340,7 @@ def delete_group(
     )
     # confirm or abort
     typer.confirm("Are you sure?:", abort=True)
-    ctx_connector(ctx).delete_entry(group)
+    ctx_connector(ctx).delete_group(group)
     typer.secho(f"{group_name}: deleted", fg=typer.colors.GREEN)
 
 
@@ -235,42 +382,119 @@ def get_entry(
     """
     Fetch details for a single entry
     """
-    entries = ctx_connector(ctx).find_entries(name)
+    entries, suggestions = search_entries(ctx, name)
+    writer = get_record_writer(ctx, ["name", "username", "password", "url", "notes"])
     if not entries:
-        typer.echo("No matching entry found")
+        # with --output, messages go to stderr so stdout is still valid output
+        err = writer is not None
+        typer.echo("No matching entry found", err=err)
+        if suggestions:
+            typer.echo("Did you mean:", err=err)
+            typer.echo(
+                "\n".join(f"  {entry_name(entry)}" for entry in suggestions), err=err
+            )
+        if writer is not None:
+            writer.close()
         raise typer.Exit()
+    if writer is not None:
+        with writer:
+            for entry in entries:
+                details = ctx_connector(ctx).get_details(entry, show_password)
+                writer.write(
+                    {field.lower(): value for field, value in details.items()}
+                )
+        return
     for entry in entries:
         details = ctx_connector(ctx).get_details(entry, show_password)
         echo_banner(details["name"])
         typer.echo("\n".join([f"{field}: {value}" for field, value in details.items()]))
 
 
+@app.command("search")
+def search_text(
+    ctx: typer.Context,
+    query: List[str] = typer.Argument(
+        ...,
+        help="Terms to find in entries' fields, e.g. url:example.com OR username:admin",
+    ),
+):
+    """
+    Search the group paths, titles, usernames, URLs, notes and custom fields of all entries
+
+    Entries must contain all the terms, unless they are separated by OR.  A term written as
+    <field>:<text> only matches in that field.  Terms match the start of words, so "admin"
+    matches "admin@example.com".
+    """
+    count = 0
+    for entry, fields in ctx_connector(ctx).search_text(query):
+        count += 1
+        typer.secho(entry_name(entry), fg=typer.colors.GREEN)
+        for field, value in fields.items():
+            value = value.replace("\n", "\n    ")
+            typer.echo(f"  {field}: {value}")
+    if not count:
+        typer.echo("No matching entries found")
+        raise typer.Exit(1)
+
+
+def entry_name(entry):
+    return f"{entry.group.name}/{entry.title}"
+
+
+def search_entries(ctx: typer.Context, name):
+    """
+    Find entries matching the entered name, best matches first.  Returns the matching
+    entries, and (if there are none) suggested entries with similar names
+    """
+    from kpcli.search import EXACT_MATCH
+
+    results = ctx_connector(ctx).search_entries(name)
+    entries = [entry for score, entry in results if score >= 1]
+    if (
+        len(entries) > 1
+        and results[0][0] == EXACT_MATCH
+        and results[1][0] < EXACT_MATCH
+    ):
+        # a single exact match is the best hit
+        return entries[:1], []
+    suggestions = [] if entries else [entry for _, entry in results[:MAX_SUGGESTIONS]]
+    return entries, suggestions
+
+
+def prompt_entry_selection(entries):
+    """Prompt the user to select one of a list of entries"""
+    for i, entry in enumerate(entries, start=1):
+        typer.echo(f"{i}: {entry_name(entry)}")
+
+    selection, is_valid = validate_selection_number(len(entries))
+    while is_valid is False:
+        typer.echo(f"Invalid selection {selection}; try again")
+        selection, is_valid = validate_selection_number(len(entries))
+    return entries[selection - 1]
+
+
 def get_or_prompt_single_entry(ctx: typer.Context, name):
     """
     Find matching entries from the entered name, prompt user for a selection if multiple
-    matches found
+    matches found, or if there are no matches but similarly named entries
     """
-    entries = ctx_connector(ctx).find_entries(name)
+    entries, suggestions = search_entries(ctx, name)
     if not entries:
         typer.echo("No matching entry found")
-        raise typer.Exit(1)
+        if not suggestions:
+            raise typer.Exit(1)
+        typer.echo("Did you mean: ")
+        return prompt_entry_selection(suggestions)
     elif len(entries) > 1:
         typer.echo(f"Multiple matching entries found: ")
-        for i, entry in enumerate(entries, start=1):
-            typer.echo(f"{i}: {entry.group.name}/{entry.title}")
-
-        selection, is_valid = validate_selection_number(len(entries))
-        while is_valid is False:
-            typer.echo(f"Invalid selection {selection}; try again")
-            selection, is_valid = validate_selection_number(len(entries))
-        return entries[selection - 1]
+        return prompt_entry_selection(entries)
     else:
         return entries[0]
 
 
-def copy_item(connector, entry, item):
+def copy_item(connector, entry, item, clear_after=None):
     try:
-        connector.copy_to_clipboard(entry, str(item))
+        connector.copy_to_clipboard(entry, str(item), clear_after=clear_after)
     except ValueError as e:
         typer.secho(str(e), fg=typer.colors.RED)
         raise typer.Exit()
@@ -284,13 +508,14 @@ def copy_entry_attribute(
 ):
     """
     Copy entry attribute to clipboard (username, password, both, url, notes)
-    Password is kept on clipboard until user confirms, or timeout is reached (5 seconds by default)
+    Password is cleared from the clipboard in the background after a timeout (5 seconds by default)
     """
     obj = get_obj_from_ctx(ctx)
     entry = get_or_prompt_single_entry(ctx, entry)
     typer.echo(f"Entry: {entry.group.name}/{entry.title}")
 
     connector = ctx_connector(ctx)
+    timeout = obj.paste_timeout
 
     if str(item) == CopyOption.userpass:
         # copy username first and wait for prompt to continue to password
@@ -306,34 +531,18 @@ def copy_entry_attribute(
                 bold=True,
             )
         )
-        copy_item(connector, entry, CopyOption.password)
+        copy_item(connector, entry, CopyOption.password, clear_after=timeout)
+    elif str(item) == CopyOption.password:
+        copy_item(connector, entry, item, clear_after=timeout)
     else:
         copy_item(connector, entry, item)
-    
+
     if str(item) in [CopyOption.password, CopyOption.userpass]:
-        # Clear the clipboard after a timeout unless the user indicates they're done with it earlier
-        timeout = obj.paste_timeout
-        try:
-            typer.secho(
-                f"Password copied to clipboard; timeout in {timeout} seconds",
-                fg=typer.colors.YELLOW,
-            )
-            signal.alarm(timeout)
-            typer.prompt(
-                typer.style(
-                    f"Press any key to clear clipboard and exit",
-                    fg=typer.colors.MAGENTA,
-                    bold=True,
-                )
-            )
-            typer.secho(f"Clipboard cleared", fg=typer.colors.GREEN)
-        except InputTimedOut:
-            typer.secho("\nTimed out, clipboard cleared", fg=typer.colors.RED)
-        except typer.Abort:  # occurs on Ctrl+C
-            typer.secho(f"\nAborted, clipboard cleared", fg=typer.colors.RED)
-            raise typer.Exit()
-        finally:
-            pyperclip.copy("")
+        # the clipboard is cleared by a helper process (or the agent), so this returns now
+        typer.secho(
+            f"Password copied to clipboard; it will be cleared in {timeout} seconds",
+            fg=typer.colors.YELLOW,
+        )
     else:
         typer.secho(f"{str(item)} copied to clipboard", fg=typer.colors.GREEN)
 
@@ -402,6 +611,299 @@ def change_password(
         f"{entry.group.name}/{entry.title}: password updated", fg=typer.colors.GREEN
     )
 
+
+@app.command()
+def shell(ctx: typer.Context):
+    """
+    Unlock the database once and run commands interactively
+
+    Commands (e.g. ls, get, cp, edit, rm, add) are typed without the kpcli prefix.  Entry
+    names can be completed with tab.  Changes are saved on `save` and on exit.
+    """
+    from kpcli.shell import run_shell
+
+    get_obj_from_ctx(ctx)
+    run_shell(ctx.parent, ctx.obj)
+
+
+@app.command()
+def batch(
+    ctx: typer.Context,
+    script: typer.FileText = typer.Argument(
+        ..., help="File of commands, one per line (- to read from stdin)"
+    ),
+):
+    """
+    Run a script of commands and save the database once at the end
+
+    Each line is a command without the kpcli prefix, e.g.
+    add --group work --title email --username me --password secret --url '' --notes ''
+    If any command fails, none of the changes are saved.
+    """
+    from kpcli.batch import BatchError, run_batch
+
+    get_obj_from_ctx(ctx)
+    try:
+        command_count = run_batch(ctx.parent, ctx.obj, script)
+    except BatchError as e:
+        typer.secho(f"{e}; no changes saved", fg=typer.colors.RED)
+        raise typer.Exit(1)
+    typer.secho(f"{command_count} commands applied", fg=typer.colors.GREEN)
+
+
+@app.command("import")
+def import_entries(
+    ctx: typer.Context,
+    infile: typer.FileText = typer.Argument(
+        ..., metavar="FILE", help="CSV, JSON or NDJSON file of entries (- to read from stdin)"
+    ),
+    file_format: Optional[FileFormat] = typer.Option(
+        None, "--format", "-f", help="File format (default: from the file extension)"
+    ),
+    decrypt: bool = typer.Option(
+        False, "--decrypt", help="Decrypt a file written by export --encrypt"
+    ),
+):
+    """
+    Import entries from a file and save the database once at the end
+
+    Each entry has a title and optionally a group (path, e.g. internet/email), username,
+    password, url and notes, as CSV columns or JSON object keys.  Missing groups are
+    created, and entries with the same title as one already in the group are skipped.
+    If any entry can't be read, none are imported.
+    """
+    import time
+
+    from kpcli.importer import ImportFileError, decrypted, guess_format, read_entries
+
+    file_format = file_format or guess_format(infile.name)
+    if file_format is None:
+        typer.echo("Unknown file format; use --format")
+        raise typer.Exit(1)
+    if decrypt:
+        infile = decrypted(infile.buffer, Encrypter().get_export_key())
+    start = time.perf_counter()
+    try:
+        added, skipped = ctx_connector(ctx).import_entries(
+            read_entries(infile, file_format)
+        )
+    except ImportFileError as e:
+        typer.secho(f"{e}; no entries imported", fg=typer.colors.RED)
+        raise typer.Exit(1)
+    elapsed = time.perf_counter() - start
+    typer.secho(
+        f"{added} entries imported, {skipped} existing entries skipped "
+        f"in {elapsed:.1f}s ({(added + skipped) / elapsed:.0f} entries/s)",
+        fg=typer.colors.GREEN,
+    )
+
+
+@app.command()
+def merge(
+    ctx: typer.Context,
+    copy: Path = typer.Argument(
+        ..., exists=True, dir_okay=False, help="Copy of the database to merge in"
+    ),
+):
+    """
+    Merge a conflicting copy of the database into it and save once
+
+    Entries are matched by UUID.  Entries only in the copy are added; for entries in both,
+    the version modified last is kept and the other is added to the entry's history.
+    Entries deleted from the copy are not deleted.  The copy must have the same password
+    and keyfile.
+    """
+    import time
+
+    from construct import ConstructError
+    from pykeepass.exceptions import (
+        CredentialsError,
+        HeaderChecksumError,
+        PayloadChecksumError,
+    )
+
+    connector = ctx_connector(ctx)
+    start = time.perf_counter()
+    try:
+        result = connector.merge_database(copy)
+    except (
+        CredentialsError,
+        HeaderChecksumError,
+        PayloadChecksumError,
+        ConstructError,
+        OSError,
+    ):
+        # other credentials, or not a readable database, as for compare
+        typer.secho(f"{copy}: Database could not be accessed", fg=typer.colors.RED)
+        raise typer.Exit(1)
+    elapsed = time.perf_counter() - start
+    typer.secho(
+        f"{result.added} entries added, {result.updated} updated from the copy, "
+        f"{result.kept} kept, {result.unchanged} unchanged, "
+        f"{result.deleted} deleted since copied in {elapsed:.1f}s",
+        fg=typer.colors.GREEN,
+    )
+
+
+@app.command("export")
+def export_entries(
+    ctx: typer.Context,
+    outfile: str = typer.Argument(
+        "-", metavar="[FILE]", help="File to write (default: stdout)", show_default=False
+    ),
+    file_format: Optional[FileFormat] = typer.Option(
+        None,
+        "--format",
+        "-f",
+        help="File format (default: from the file extension, or csv)",
+    ),
+    fields: Optional[str] = typer.Option(
+        None,
+        "--fields",
+        help="Comma separated fields to export, including custom fields  "
+        "[default: title,username,password,group,url,notes]",
+    ),
+    groups: Optional[List[str]] = typer.Option(
+        None,
+        "--group",
+        "-g",
+        help="Only export entries in this group and its subgroups (may be repeated)",
+    ),
+    encrypt: bool = typer.Option(
+        False, "--encrypt", help="Encrypt the file with the kpcli export key"
+    ),
+):
+    """
+    Export entries to a CSV, JSON or NDJSON file (or stdout), as they are read
+
+    Exported files can be imported with the import command (and --decrypt, if they're
+    encrypted).  The export key is kept in ~/.kp/.export_key; keep a copy of it with
+    encrypted exports.
+    """
+    import time
+
+    from kpcli.exporter import EXPORT_FIELDS, encrypting, export_records
+    from kpcli.importer import guess_format
+    from kpcli.output import RecordWriter, echo
+
+    connector = ctx_connector(ctx)
+    group_objects = None
+    if groups:
+        group_objects = []
+        for group_name in groups:
+            group = connector.find_group(group_name)
+            if group is None:
+                typer.secho(f"No group matching '{group_name}' found", fg=typer.colors.RED)
+                raise typer.Exit(1)
+            group_objects.append(group)
+    field_names = EXPORT_FIELDS
+    if fields:
+        field_names = [field.strip() for field in fields.split(",") if field.strip()]
+    if file_format is None:
+        file_format = (outfile != "-" and guess_format(outfile)) or FileFormat.csv
+
+    start = time.perf_counter()
+    with typer.open_file(outfile, "wb" if encrypt else "w") as out:
+        write = echo if outfile == "-" and not encrypt else out.write
+        if encrypt:
+            write = encrypting(write, Encrypter().get_export_key())
+        with RecordWriter(file_format, field_names, write=write) as writer:
+            writer.write_all(export_records(connector, field_names, group_objects))
+    elapsed = time.perf_counter() - start
+    typer.secho(
+        f"{writer.count} entries exported in {elapsed:.1f}s", fg=typer.colors.GREEN, err=True
+    )
+
+
+@app.command()
+def compact(ctx: typer.Context):
+    """
+    Write changes saved in the journal into the database file
+    """
+    connector = ctx_connector(ctx)
+    if not connector.journal.exists():
+        typer.echo("No journal to compact")
+        return
+    connector.compact()
+    typer.secho("Journal compacted into the database", fg=typer.colors.GREEN)
+
+
+@agent_app.command("start")
+def start_agent(
+    ctx: typer.Context,
+    ttl: Optional[int] = typer.Option(
+        None, help="Seconds the agent may be idle before it exits  [default: 900]"
+    ),
+    foreground: bool = typer.Option(
+        False, "--foreground", help="Run the agent in the current process"
+    ),
+):
+    """
+    Unlock the database and keep it open for later kpcli commands
+    """
+    from kpcli.agent import (
+        DEFAULT_AGENT_TTL,
+        KpAgentServer,
+        agent_socket_path,
+        get_running_agent,
+    )
+
+    profile = ctx.obj["profile"]
+    if get_running_agent(profile) is not None:
+        typer.echo(f"Agent already running for profile {profile}")
+        raise typer.Exit()
+    setup_db(ctx, use_agent=False)
+    socket_path = agent_socket_path(profile)
+    server = KpAgentServer(
+        ctx.obj["obj"].connector, socket_path, ttl=ttl or DEFAULT_AGENT_TTL
+    )
+    if not foreground:
+        pid = os.fork()
+        if pid:
+            typer.secho(f"Agent started (pid {pid})", fg=typer.colors.GREEN)
+            return
+        # detach from the terminal in the child process
+        os.setsid()
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in range(3):
+            os.dup2(devnull, fd)
+        try:
+            server.serve()
+        finally:
+            os._exit(0)
+    typer.secho(f"Agent listening on {socket_path}", fg=typer.colors.GREEN)
+    server.serve()
+
+
+def _get_running_agent(ctx: typer.Context):
+    from kpcli.agent import get_running_agent
+
+    profile = ctx.obj["profile"]
+    agent = get_running_agent(profile)
+    if agent is None:
+        typer.echo(f"No agent running for profile {profile}")
+        raise typer.Exit(1)
+    return agent
+
+
+@agent_app.command("stop")
+def stop_agent(ctx: typer.Context):
+    """
+    Stop the agent for the current profile
+    """
+    _get_running_agent(ctx).stop()
+    typer.secho("Agent stopped", fg=typer.colors.GREEN)
+
+
+@agent_app.command("status")
+def agent_status(ctx: typer.Context):
+    """
+    Report whether an agent is running for the current profile
+    """
+    agent_info = _get_running_agent(ctx).ping()
+    typer.echo(f"Agent running (pid {agent_info['pid']}): {agent_info['filename']}")
+
+
 @app.callback()
 def main(
     ctx: typer.Context,
@@ -409,6 +911,18 @@ def main(
         "default", "--profile", "-p", help="Specify config profile to use"
     ),
     loglevel: Optional[str] = typer.Option("INFO"),
+    output: OutputFormat = typer.Option(
+        OutputFormat.text,
+        "--output",
+        "-o",
+        help="Output format for ls, get and compare",
+    ),
+    timings: bool = typer.Option(
+        False,
+        "--timings",
+        help="Report the time taken by each phase of the command on stderr "
+        "(or set KPCLI_TRACE to a file to append them as JSON lines)",
+    ),
 ):
     """
     Interact with a KeePassX database
@@ -421,36 +935,114 @@ def main(
     logging.basicConfig(level=loglevel.upper())
     ctx.ensure_object(dict)
     ctx.obj["profile"] = profile
-    if "--help" not in sys.argv:
+    ctx.obj["output"] = output
+    trace = os.environ.get("KPCLI_TRACE", "")
+    if trace.lower() in ("0", "false", "no", "off"):
+        trace = ""
+    if timings or trace:
+        from kpcli import timing
+
+        output_file = None
+        if not timings and trace.lower() not in ("1", "true", "stderr"):
+            output_file = trace
+        timing.start(ctx.invoked_subcommand, output_file)
+        ctx.call_on_close(timing.report)
+    # agent commands set up the database themselves, if they need it
+    if "--help" not in sys.argv and ctx.invoked_subcommand != "agent":
         setup_db(ctx)
 
-def setup_db(ctx):
+def setup_db(ctx, use_agent=True):
+    with phase("setup_db"):
+        _setup_db(ctx, use_agent)
+
+
+def _setup_db(ctx, use_agent=True):
     # Instantiate the relevant database utility object on the Context
-    config, store_encrypted_password = get_config(profile=ctx.obj["profile"])
-    typer.secho("UNLOCKING...\n", fg=typer.colors.YELLOW)
+    # keep stdout for the results if they're written in a machine readable format
+    err = not is_text_output(ctx) or ctx.invoked_subcommand == "export"
+    with phase("config"):
+        # config.ini is read once, for all the settings the command needs (looked up on
+        # the module, where it's timed with --timings)
+        config_from_file = utils.get_config_from_file(ctx.obj["profile"]) or {}
+        config, store_encrypted_password = get_config(
+            profile=ctx.obj["profile"], err=err, config_from_file=config_from_file
+        )
+    if use_agent and ctx.invoked_subcommand not in LOCAL_COMMANDS:
+        # Use the already unlocked database if an agent is running
+        from kpcli.agent import get_agent_connector
+
+        with phase("agent"):
+            connector = get_agent_connector(config, profile=ctx.obj["profile"])
+        if connector is not None:
+            logger.debug("Using running agent")
+            ctx.obj["obj"] = KpContext(
+                connector=connector,
+                paste_timeout=get_timeout(
+                    profile=ctx.obj["profile"], err=err, config_from_file=config_from_file
+                ),
+            )
+            return
+    from pykeepass.exceptions import CredentialsError
+
+    typer.secho("UNLOCKING...\n", fg=typer.colors.YELLOW, err=err)
     encrypter = Encrypter(store_encrypted_password=store_encrypted_password)
     if config.password is None:
         # If a password wasn't found in the config file or environment, prompt the use for it
-        config.password = typer.prompt("Database password", hide_input=True)
+        config.password = typer.prompt("Database password", hide_input=True, err=err)
         if store_encrypted_password:
             encrypter.save_password(config)
         else:
             encrypter.reset()
     try:
-        if ctx.invoked_subcommand == "compare":
-            ctx.obj["obj"] = KpDatabaseComparator(config)
-        else:
-            paste_timeout = get_timeout(profile=ctx.obj["profile"])
-            ctx.obj["obj"] = KpContext(
-                connector=KpDatabaseConnector(config), paste_timeout=paste_timeout
-            )
+        try:
+            with phase("unlock"):
+                ctx.obj["obj"] = open_database(ctx, config, config_from_file, err=err)
+        except CredentialsError:
+            if config.transformed_key is None:
+                raise
+            # The stored transformed key is out of date; fall back to the password
+            logger.debug("Stored transformed key is invalid")
+            config.transformed_key = None
+            with phase("unlock"):
+                ctx.obj["obj"] = open_database(ctx, config, config_from_file, err=err)
     except CredentialsError:
         typer.secho(
-            f"Invalid credentials for database {config.filename}", fg=typer.colors.RED
+            f"Invalid credentials for database {config.filename}",
+            fg=typer.colors.RED,
+            err=err,
         )
         if store_encrypted_password:
             encrypter.reset()
         raise typer.Exit(1)
+    if store_encrypted_password and config.transformed_key is None:
+        # Store the transformed key so that next time the database can be opened without the KDF
+        obj = ctx.obj["obj"]
+        db = obj.connector.db if isinstance(obj, KpContext) else obj.db
+        encrypter.save_transformed_key(config.filename, db.transformed_key)
+
+
+def open_database(ctx, config, config_from_file=None, err=False):
+    """
+    Open the database with the relevant database utility object for the subcommand,
+    with the settings in config_from_file (the profile's config, if it has already been
+    read), writing any messages to stderr if err
+    """
+    if ctx.invoked_subcommand == "compare":
+        from kpcli.comparator import KpDatabaseComparator
+
+        return KpDatabaseComparator(config)
+    from kpcli.connector import KpDatabaseConnector
+
+    profile = ctx.obj["profile"]
+    paste_timeout = get_timeout(profile, err, config_from_file)
+    journal, journal_max_size = get_journal_config(profile, err, config_from_file)
+    connector = KpDatabaseConnector(
+        config,
+        compression_level=get_compression_level(profile, err, config_from_file),
+        journal=journal,
+        journal_max_size=journal_max_size,
+    )
+    return KpContext(connector=connector, paste_timeout=paste_timeout)
 
 
 if __name__ == "__main__":
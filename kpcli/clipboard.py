@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Copy to the clipboard, and clear it again after a timeout without blocking the command.
+
+The clipboard backend (e.g. xclip, xsel or pbcopy) is found once per process and kept,
+as pyperclip runs `which` to look for each candidate.  A single command clears the
+clipboard from a small detached helper process (`python -m kpcli.clipboard`), which is
+given only the copied text and the backend's name, so the command returns straight away
+and the unlocked database doesn't outlive it.  Long-running processes (the agent and the
+shell) clear it from a timer thread instead, after calling `run_timers_in_process`.
+"""
+
+# standards
+import logging
+import subprocess
+import sys
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# pyperclip's copy functions, by the name of their backend for `pyperclip.set_clipboard`
+_BACKEND_NAMES = {
+    "copy_osx_pbcopy": "pbcopy",
+    "copy_osx_pyobjc": "pyobjc",
+    "copy_qt": "qt",
+    "copy_xclip": "xclip",
+    "copy_xsel": "xsel",
+    "copy_wl": "wl-clipboard",
+    "copy_klipper": "klipper",
+    "copy_windows": "windows",
+}
+
+_backend = None
+# timers waiting to clear the clipboard, in processes that outlive a command
+_timers = None
+
+
+def _get_backend():
+    """The clipboard's (copy, paste) functions, found on first use"""
+    global _backend
+    if _backend is None:
+        # pyperclip is only imported by the commands that use the clipboard
+        import pyperclip
+
+        _backend = pyperclip.determine_clipboard()
+    return _backend
+
+
+def copy(text):
+    _get_backend()[0](text)
+
+
+def paste():
+    return _get_backend()[1]()
+
+
+def clear_if_unchanged(text):
+    """Clear the clipboard, unless something other than text has been copied since"""
+    try:
+        if paste() != text:
+            return
+    except Exception:
+        # some backends can't paste; clear it anyway
+        logger.debug("Could not read the clipboard", exc_info=True)
+    copy("")
+
+
+def run_timers_in_process():
+    """Clear the clipboard from timer threads in this process, rather than a helper"""
+    global _timers
+    if _timers is None:
+        _timers = {}
+
+
+def clear_pending():
+    """
+    Clear the clipboard now for any timers that haven't run yet, on exit from a process
+    that called `run_timers_in_process`, and go back to clearing it from helpers
+    """
+    global _timers
+    timers, _timers = _timers or {}, None
+    for timer, text in timers.items():
+        timer.cancel()
+        clear_if_unchanged(text)
+
+
+def _run_timer(timer, text):
+    # timers stopped by `clear_pending` have already cleared the clipboard
+    if _timers is not None and _timers.pop(timer, None) is None:
+        return
+    clear_if_unchanged(text)
+
+
+def _backend_name():
+    """The name of the clipboard backend, to pass to a helper, or None if it has none"""
+    return _BACKEND_NAMES.get(getattr(_get_backend()[0], "__name__", None))
+
+
+def _clear_in_helper(text, timeout):
+    """
+    Clear the clipboard after timeout seconds from a detached helper process, passing
+    it the copied text on stdin
+    """
+    args = [sys.executable, "-m", "kpcli.clipboard", str(timeout)]
+    backend_name = _backend_name()
+    if backend_name is not None:
+        args.append(backend_name)
+    helper = subprocess.Popen(
+        args,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    helper.stdin.write(text.encode())
+    helper.stdin.close()
+    return helper
+
+
+def clear_later(text, timeout):
+    """
+    Clear the clipboard after timeout seconds if it still holds text, without waiting
+    for it
+    """
+    if _timers is None:
+        _clear_in_helper(text, timeout)
+        return
+    timer = threading.Timer(timeout, lambda: _run_timer(timer, text))
+    timer.daemon = True
+    _timers[timer] = text
+    timer.start()
+
+
+def main(args=None):
+    """Run a helper: python -m kpcli.clipboard TIMEOUT [BACKEND], with the text on stdin"""
+    global _backend
+    args = sys.argv[1:] if args is None else args
+    text = sys.stdin.buffer.read().decode()
+    if len(args) > 1:
+        import pyperclip
+
+        pyperclip.set_clipboard(args[1])
+        _backend = (pyperclip.copy, pyperclip.paste)
+    time.sleep(float(args[0]))
+    clear_if_unchanged(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,16 +2,137 @@
 """Compares two or more KeePassX databases for conflicting entries"""
 
 # standards
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import hashlib
+from itertools import chain, combinations, islice
+from pathlib import Path
 import attr
-from typing import Set
+from typing import Dict, Optional, Set, Tuple
 
 # third parties
+from construct import ConstructError
 from pykeepass import PyKeePass
-from pykeepass.exceptions import CredentialsError
+from pykeepass.exceptions import (
+    CredentialsError,
+    HeaderChecksumError,
+    PayloadChecksumError,
+)
 import tableformatter
 from tableformatter import generate_table
 
-from kpcli.datastructures import KpEntry
+from kpcli.cache import KpComparisonCache, file_signature
+from kpcli.datastructures import KpEntrySnapshot
+from kpcli.journal import KpJournal
+from kpcli.kdbx import kdf_fingerprint
+from kpcli.merger import walk_groups
+from kpcli.timing import phase, timed_iteration
+
+
+# Number of conflicts in each table of compare results
+TABLE_PAGE_SIZE = 500
+# Fields that are compared by a hash of their value, so their values aren't kept in memory
+SENSITIVE_FIELDS = ("password", "notes")
+# The fields of an entry's String elements, as named in KpEntrySnapshot
+_SNAPSHOT_FIELDS = {
+    "Title": "title",
+    "UserName": "username",
+    "Password": "password",
+    "URL": "url",
+    "Notes": "notes",
+}
+
+
+def entry_snapshots(db, hash_key):
+    """
+    Yield a KpEntrySnapshot of each entry in a database, reading each group's path and
+    each entry's fields in a single walk of the XML tree, rather than a lookup per field.
+    Entries are matched by their group's path, so groups with the same name in different
+    places aren't confused; entries in the root group have its name as their path.
+    Sensitive fields are hashed, keyed with hash_key, so the same value has the same hash
+    in every database compared with the same key.
+    """
+    root_group = db.tree.getroot().find("Root/Group")
+    for group, path in walk_groups(root_group, []):
+        group_path = "/".join(path) or root_group.findtext("Name")
+        # entries in History elements aren't children of the group, so aren't included
+        for entry in group.iterchildren("Entry"):
+            fields = dict.fromkeys(_SNAPSHOT_FIELDS.values())
+            for string in entry.iterchildren("String"):
+                # a String is a Key element followed by a Value element
+                field = _SNAPSHOT_FIELDS.get(string[0].text)
+                if field is not None:
+                    fields[field] = string[1].text
+            for field in SENSITIVE_FIELDS:
+                if fields[field] is not None:
+                    fields[field] = hashlib.blake2b(
+                        fields[field].encode(), digest_size=16, key=hash_key
+                    ).hexdigest()
+            yield KpEntrySnapshot(group=group_path, **fields)
+
+
+def get_database_entries(
+    filename, password=None, keyfile=None, hash_key=b"", transformed_key=None
+):
+    """
+    Open a database, with transformed_key if given rather than deriving it, and return its
+    entries as a set of KpEntrySnapshots (see `entry_snapshots`) and its transformed key,
+    or (None, None) if it can't be opened with the given credentials.
+    Module level so it can be run in a worker process.
+    """
+    try:
+        db = PyKeePass(
+            filename, password=password, keyfile=keyfile, transformed_key=transformed_key
+        )
+    except (CredentialsError, HeaderChecksumError, PayloadChecksumError, ConstructError):
+        return None, None
+    return set(entry_snapshots(db, hash_key)), db.transformed_key
+
+
+def has_readable_header(filename):
+    """Whether a file has a KDBX header that can be read, e.g. it isn't some other file"""
+    try:
+        kdf_fingerprint(filename)
+    except (OSError, ConstructError):
+        return False
+    return True
+
+
+def entries_fingerprint(entries: Set[KpEntrySnapshot]) -> Dict[Tuple[str, str], str]:
+    """
+    Map each (group path, title) in a set of entries to a fixed-size hash of its fields (of
+    all its entries, if there are several with the same group path and title)
+    """
+    digests = {}
+    for entry in entries:
+        digest = hashlib.blake2b(
+            repr(attr.astuple(entry)).encode(), digest_size=16
+        ).hexdigest()
+        digests.setdefault((entry.group, entry.title), []).append(digest)
+    return {
+        key: entry_digests[0] if len(entry_digests) == 1 else "".join(sorted(entry_digests))
+        for key, entry_digests in digests.items()
+    }
+
+
+def fingerprint_digest(fingerprint: Dict[Tuple[str, str], str]) -> str:
+    """A hash of a whole fingerprint, so identical databases can be found"""
+    digest = hashlib.blake2b(digest_size=16)
+    for key, entry_digest in sorted(fingerprint.items()):
+        digest.update(repr((key, entry_digest)).encode())
+    return digest.hexdigest()
+
+
+def divergence(fingerprint, other_fingerprint):
+    """
+    Count the entries (by group and title) only in the first fingerprint, only in the
+    other, and in both but with different fields
+    """
+    keys = fingerprint.keys()
+    other_keys = other_fingerprint.keys()
+    conflicting = sum(
+        1 for key in keys & other_keys if fingerprint[key] != other_fingerprint[key]
+    )
+    return len(keys - other_keys), len(other_keys - keys), conflicting
 
 
 class KpDatabaseComparator:
@@ -21,38 +142,67 @@ class KpDatabaseComparator:
 
     entry_fields = ["username", "password", "url", "group", "notes"]
 
-    def __init__(self, db_config):
+    def __init__(self, db_config, cache_file=None):
         self.config = db_config
         self.db = PyKeePass(*attr.astuple(db_config))
+        # compare the main database with any changes still in its journal
+        self.journal = KpJournal(self.db.filename, self.db.transformed_key)
+        self.journal.replay(self.db)
+        # key for hashing sensitive fields; only someone who can unlock the database can
+        # check a guessed password against its hash
+        self.hash_key = hashlib.blake2b(
+            b"kpcli-compare-hash" + self.db.transformed_key, digest_size=32
+        ).digest()
+        self.cache = None
+        if cache_file is not None:
+            self.use_cache(cache_file)
 
-    def _get_matching_entry(self, db, entry):
-        """Find matching entry from specific database by entry group and title"""
-        group = db.find_groups(name=entry.group, first=True)
-        return db.find_entries(title=entry.title, group=group, first=True)
+    def use_cache(self, cache_file):
+        """Cache comparison databases' entries in cache_file, so unchanged copies aren't opened again"""
+        self.cache = KpComparisonCache(cache_file, self.db.transformed_key)
+
+    @staticmethod
+    def entries_by_key(
+        entries: Set[KpEntrySnapshot],
+    ) -> Dict[Tuple[str, str], KpEntrySnapshot]:
+        """Map a set of entries by (group path, title)"""
+        keyed_entries = {}
+        for entry in entries:
+            keyed_entries.setdefault((entry.group, entry.title), entry)
+        return keyed_entries
 
     def compare_database_entries(
         self,
-        differences: Set[tuple],
-        comparison_db: PyKeePass,
+        differences: Set[KpEntrySnapshot],
+        main_entries: Dict[Tuple[str, str], KpEntrySnapshot],
+        comparison_entries: Dict[Tuple[str, str], KpEntrySnapshot],
         show_details: bool = False,
     ):
         """
-        Take a set of entries-as-tuple that are known to differ in a comparison database and identify
-        which are missing, and which field have conflicts
+        Take a set of entries that are known to differ in a comparison database and identify
+        which are missing, and which field have conflicts.
+        main_entries and comparison_entries map (group path, title) to the entries in each
+        database (see `entries_by_key`), so each difference is classified with two dict
+        lookups.
+        The values of sensitive fields are never shown, as only their hashes are known.
         """
         missing_in_comparison = set()
         missing_in_main = set()
         conflicts = set()
 
         def _format_conflict(conflict):
-            if show_details:
-                return f"{conflict[0]}: {conflict[1]} vs {conflict[2]}"
-            return conflict[0]
-
-        for entry_tuple in differences:
-            entry = KpEntry.from_tuple(*entry_tuple)
-            main = self._get_matching_entry(self.db, entry)
-            comparison = self._get_matching_entry(comparison_db, entry)
+            if not show_details:
+                return conflict[0]
+            if conflict[0] in SENSITIVE_FIELDS:
+                return f"{conflict[0]}: differs"
+            return f"{conflict[0]}: {conflict[1]} vs {conflict[2]}"
+
+        # an entry that differs appears in differences once from each database
+        differing_keys = {(entry.group, entry.title) for entry in differences}
+        for key in differing_keys:
+            entry_name = f"{key[0]}/{key[1]}"
+            main = main_entries.get(key)
+            comparison = comparison_entries.get(key)
             if main and comparison:
                 # find conflicts in the entry fields we care about
                 mismatched_items = []
@@ -63,22 +213,94 @@ class KpDatabaseComparator:
                         mismatched_items.append((field, main_value, comparison_value))
                 conflicts.add(
                     (
-                        f"{entry.group}/{entry.title}",
+                        entry_name,
                         ", ".join(
                             [_format_conflict(item) for item in mismatched_items]
                         ),
                     )
                 )
             elif not comparison:
-                missing_in_comparison.add(f"{entry.group}/{entry.title}")
+                missing_in_comparison.add(entry_name)
             elif not main:
-                missing_in_main.add(f"{entry.group}/{entry.title}")
+                missing_in_main.add(entry_name)
         return missing_in_comparison, missing_in_main, conflicts
 
-    def get_conflicting_data(self, show_details=False):
+    def _group_by_kdf(self, comparison_db_files):
+        """
+        Group comparison databases by their key derivation parameters, read from their
+        headers without unlocking them.  Databases with the same parameters derive the same
+        transformed key from the same credentials, so it only needs deriving once per group,
+        and not at all for copies with the main database's parameters.
+        Returns a list of (transformed key, or None if it isn't known yet, files)
+        """
+        main_fingerprint = kdf_fingerprint(self.config.filename)
+        groups = {}
+        for comparison_db_file in sorted(comparison_db_files):
+            groups.setdefault(kdf_fingerprint(comparison_db_file), []).append(
+                comparison_db_file
+            )
+        return [
+            (self.db.transformed_key if fingerprint == main_fingerprint else None, files)
+            for fingerprint, files in groups.items()
+        ]
+
+    def _iter_comparison_entries(self, comparison_db_files, workers=None):
+        """
+        Open each comparison database and yield its filename and entries as it finishes.
+        Databases are opened in a pool of worker processes, so that their key derivations
+        run in parallel.  Each group of databases with the same key derivation parameters
+        (see `_group_by_kdf`) derives its transformed key once, with the first database
+        opened, and the rest of the group is opened with that key.
+        """
+        credentials = (self.config.password, self.config.keyfile, self.hash_key)
+        with phase("read_headers"):
+            groups = self._group_by_kdf(comparison_db_files)
+        if workers == 1 or len(comparison_db_files) < 2:
+            for transformed_key, files in groups:
+                for comparison_db_file in files:
+                    # if a database can't be opened, the next one derives the key again
+                    entries, transformed_key = get_database_entries(
+                        str(comparison_db_file), *credentials, transformed_key
+                    )
+                    yield comparison_db_file, entries
+            return
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # futures, with the file being opened and the files waiting for its key
+            futures = {}
+
+            def _submit(comparison_db_file, transformed_key, waiting=()):
+                future = executor.submit(
+                    get_database_entries,
+                    str(comparison_db_file),
+                    *credentials,
+                    transformed_key,
+                )
+                futures[future] = (comparison_db_file, waiting)
+
+            for transformed_key, files in groups:
+                if transformed_key is None:
+                    _submit(files[0], None, files[1:])
+                else:
+                    for comparison_db_file in files:
+                        _submit(comparison_db_file, transformed_key)
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    comparison_db_file, waiting = futures.pop(future)
+                    entries, transformed_key = future.result()
+                    if waiting and transformed_key is None:
+                        # couldn't be opened, so the next file derives the key again
+                        _submit(waiting[0], None, waiting[1:])
+                    else:
+                        for waiting_file in waiting:
+                            _submit(waiting_file, transformed_key)
+                    yield comparison_db_file, entries
+
+    def get_conflicting_data(self, show_details=False, workers: Optional[int] = None):
         """
         Find databases with the same filepath stem as the main database and compares them for missing and
         conflicting entries.
+        Comparison databases are opened in parallel by up to `workers` processes (default: number of CPUs).
         Returns a dict of database filenames and their conflicts with the main database as a tuple of
         (
             {entries present in main, missing in comparison db},
@@ -94,69 +316,273 @@ class KpDatabaseComparator:
                 ("group4/title4", "password")
         )
         """
+        return dict(self.iter_conflicting_data(show_details, workers))
+
+    def iter_conflicting_data(self, show_details=False, workers: Optional[int] = None):
+        """
+        Yield each comparison database's filename and its conflicts with the main database
+        (see `get_conflicting_data`) as soon as it has been compared: first those with
+        cached comparisons, then the rest as they are opened.
+        """
         db_name = self.config.filename.stem
         # find conflicting copies
-        comparison_db_files = set(
-            self.config.filename.parent.glob(f"{db_name}*.kdbx")
-        ) - {self.config.filename}
-        conflicting_data = {}
-        main_entries = set(
-            attr.astuple(KpEntry.from_pykeepass_entry(entry))
-            for entry in self.db.entries
-        )
-        for comparison_db_file in comparison_db_files:
-            try:
-                comparison_db = PyKeePass(
-                    comparison_db_file, password=self.config.password
-                )
-            except CredentialsError:
+        with phase("find_copies"):
+            comparison_db_files = set(
+                self.config.filename.parent.glob(f"{db_name}*.kdbx")
+            ) - {self.config.filename}
+            # other files named like copies can't be compared
+            unreadable_files = {
+                comparison_db_file
+                for comparison_db_file in comparison_db_files
+                if not has_readable_header(comparison_db_file)
+            }
+            comparison_db_files -= unreadable_files
+        cached_comparisons = {}
+        comparison_entries_by_file = {}
+        with phase("read_cache"):
+            if self.cache is not None:
+                # Reuse the entries, or the whole comparison, for unchanged databases
+                main_signature = file_signature(self.config.filename)
+                main_signature["journal"] = self.journal.size()
+                for comparison_db_file in comparison_db_files:
+                    record = self.cache.get(comparison_db_file)
+                    if record is None:
+                        continue
+                    found, comparison = self.cache.get_comparison(
+                        record, main_signature, show_details
+                    )
+                    if found:
+                        cached_comparisons[str(comparison_db_file)] = comparison
+                    else:
+                        comparison_entries_by_file[comparison_db_file] = self.cache.entries(
+                            record
+                        )
+        files_to_open = {
+            comparison_db_file
+            for comparison_db_file in comparison_db_files
+            if str(comparison_db_file) not in cached_comparisons
+            and comparison_db_file not in comparison_entries_by_file
+        }
+        yield from cached_comparisons.items()
+        for comparison_db_file in sorted(unreadable_files):
+            yield str(comparison_db_file), None
+        if not files_to_open and not comparison_entries_by_file:
+            return
+
+        with phase("main_entries"):
+            main_entries = set(entry_snapshots(self.db, self.hash_key))
+            main_entries_by_key = self.entries_by_key(main_entries)
+        # open_copies includes the time waiting for workers to open the copies
+        for comparison_db_file, comparison_entries in timed_iteration(
+            "open_copies",
+            chain(
+                comparison_entries_by_file.items(),
+                self._iter_comparison_entries(files_to_open, workers),
+            ),
+        ):
+            if comparison_entries is None:
                 # Conflicting copies will have the same credentials as the original, but another db with the same stem
                 # may exist. In that case, just report None
                 conflicting_entries = None
             else:
-                comparison_entries = set(
-                    attr.astuple(KpEntry.from_pykeepass_entry(entry))
-                    for entry in comparison_db.entries
-                )
-                # Find the entries that are not identical in the comparison db.
-                differing_entries = main_entries ^ comparison_entries
-                # Identify the differences
-                conflicting_entries = self.compare_database_entries(
-                    differing_entries, comparison_db, show_details=show_details
+                with phase("compare"):
+                    # Find the entries that are not identical in the comparison db.
+                    differing_entries = main_entries ^ comparison_entries
+                    # Identify the differences
+                    conflicting_entries = self.compare_database_entries(
+                        differing_entries,
+                        main_entries_by_key,
+                        self.entries_by_key(comparison_entries),
+                        show_details=show_details,
+                    )
+            if self.cache is not None:
+                if comparison_db_file in files_to_open:
+                    self.cache.set(comparison_db_file, comparison_entries)
+                self.cache.set_comparison(
+                    comparison_db_file, main_signature, show_details, conflicting_entries
                 )
-            conflicting_data[str(comparison_db_file)] = conflicting_entries
-        return conflicting_data
+            yield str(comparison_db_file), conflicting_entries
+        if self.cache is not None:
+            with phase("write_cache"):
+                self.cache.save()
+
+    def get_divergence_matrix(self, database_files, workers: Optional[int] = None):
+        """
+        Compare the main database and each of database_files with every other.  Each
+        database is opened once (by up to `workers` processes, or not at all if it's cached)
+        and reduced to a fingerprint of its entries (see `entries_fingerprint`), and every
+        pair of databases is compared by their fingerprints.
+        Returns
+        (
+            {database filename: fingerprint, or None if it can't be opened},
+            {(filename, other filename): (only in filename, only in other, conflicting)},
+        )
+        where the filenames are in the order given, after the main database, and each pair
+        is in that order.
+        """
+        database_files = [
+            Path(database_file)
+            for database_file in dict.fromkeys(map(str, database_files))
+            if Path(database_file).resolve() != self.config.filename.resolve()
+        ]
+        fingerprints = {str(self.config.filename): None}
+        fingerprints.update((str(database_file), None) for database_file in database_files)
+        # files that aren't databases stay in fingerprints as not accessible
+        database_files = [
+            database_file
+            for database_file in database_files
+            if has_readable_header(database_file)
+        ]
+        entries_by_file = {}
+        with phase("read_cache"):
+            if self.cache is not None:
+                for database_file in database_files:
+                    record = self.cache.get(database_file)
+                    if record is not None:
+                        entries_by_file[database_file] = self.cache.entries(record)
+        files_to_open = set(database_files) - set(entries_by_file)
+        with phase("main_entries"):
+            fingerprints[str(self.config.filename)] = entries_fingerprint(
+                set(entry_snapshots(self.db, self.hash_key))
+            )
+        for database_file, entries in timed_iteration(
+            "open_copies",
+            chain(
+                entries_by_file.items(),
+                self._iter_comparison_entries(files_to_open, workers),
+            ),
+        ):
+            if entries is not None:
+                fingerprints[str(database_file)] = entries_fingerprint(entries)
+            if self.cache is not None and database_file in files_to_open:
+                self.cache.set(database_file, entries)
+        if self.cache is not None:
+            with phase("write_cache"):
+                self.cache.save()
 
-    def generate_tables_of_conflicts(self, show_details=False):
+        with phase("compare"):
+            # identical databases (e.g. unchanged copies) are only compared once
+            digests = {
+                filename: fingerprint_digest(fingerprint)
+                for filename, fingerprint in fingerprints.items()
+                if fingerprint is not None
+            }
+            divergences = {}
+            matrix = {}
+            for filename, other_filename in combinations(digests, 2):
+                pair = (digests[filename], digests[other_filename])
+                if pair not in divergences:
+                    divergences[pair] = divergence(
+                        fingerprints[filename], fingerprints[other_filename]
+                    )
+                matrix[filename, other_filename] = divergences[pair]
+        return fingerprints, matrix
+
+    @staticmethod
+    def nway_summary(fingerprints):
+        """
+        Count the entries (by group and title) in any of the databases that could be
+        opened, and how many of them are identical in all of them
+        """
+        fingerprints = [
+            fingerprint for fingerprint in fingerprints.values() if fingerprint is not None
+        ]
+        if not fingerprints:
+            return 0, 0
+        all_keys = set().union(*fingerprints)
+        first, *others = fingerprints
+        identical = sum(
+            1
+            for key, entry_digest in first.items()
+            if all(other.get(key) == entry_digest for other in others)
+        )
+        return len(all_keys), identical
+
+    def generate_tables_of_conflicts(self, show_details=False, workers=None):
         """
         Find databases with the same filepath stem as the main database and compare them for missing and
         conflicting entries.
         Returns a dict of tabulated results for each conflicting database found which can be passed to `print` or `typer.echo`.
         """
-        conflicting_tables = {}
-        for comparison_db_filename, data in self.get_conflicting_data(
-            show_details
-        ).items():
+        return {
+            comparison_db_filename: "\n".join(tables)
+            for comparison_db_filename, tables in self.iter_tables_of_conflicts(
+                show_details, workers
+            )
+        }
+
+    def iter_tables_of_conflicts(
+        self, show_details=False, workers=None, page_size=TABLE_PAGE_SIZE
+    ):
+        """
+        Yield each comparison database's filename and its tabulated results as soon as it
+        has been compared (see `iter_conflicting_data`).  The results are a generator of
+        tables of up to page_size conflicts each, so that large conflict lists are tabulated
+        a page at a time; use them before moving on to the next database.
+        """
+        for comparison_db_filename, data in self.iter_conflicting_data(show_details, workers):
             if data is None:
-                conflicting_tables[
-                    comparison_db_filename
-                ] = "Database could not be accessed"
-                continue
-            missing_in_comparison, missing_in_main, conflicts = data
-            # Build a table of conflicts
-            if not any([missing_in_comparison, missing_in_main, conflicts]):
-                conflicting_tables[comparison_db_filename] = "No conflicts found"
+                yield comparison_db_filename, iter(["Database could not be accessed"])
             else:
-                column_headers = ["Main", "Conflicting", "Conflicting fields"]
-                rows = [
-                    *[(entry_name, "-", "") for entry_name in missing_in_comparison],
-                    *[("-", entry_name, "") for entry_name in missing_in_main],
-                    *[
-                        (entry_name, entry_name, conflicting_fields)
-                        for entry_name, conflicting_fields in conflicts
-                    ],
-                ]
-                conflicting_tables[comparison_db_filename] = generate_table(
-                    rows, column_headers, grid_style=tableformatter.FancyGrid()
-                )
-        return conflicting_tables
+                yield comparison_db_filename, self._conflict_table_pages(data, page_size)
+
+    def _conflict_table_pages(self, data, page_size):
+        column_headers = ["Main", "Conflicting", "Conflicting fields"]
+        rows = self.conflict_rows(data)
+        page = list(islice(rows, page_size))
+        if not page:
+            yield "No conflicts found"
+        while page:
+            yield generate_table(page, column_headers, grid_style=tableformatter.FancyGrid())
+            page = list(islice(rows, page_size))
+
+    @staticmethod
+    def divergence_rows(matrix):
+        """
+        Yield each pair of databases compared by `get_divergence_matrix` as (database,
+        other database, entries only in database, entries only in other, conflicting entries)
+        """
+        for (filename, other_filename), counts in matrix.items():
+            yield (filename, other_filename, *counts)
+
+    @staticmethod
+    def generate_divergence_table(fingerprints, matrix):
+        """
+        Tabulate the number of entries that differ between each pair of databases that
+        could be opened, numbered in the order of fingerprints (see `get_divergence_matrix`)
+        """
+        numbers = {
+            filename: str(number)
+            for number, filename in enumerate(fingerprints, start=1)
+            if fingerprints[filename] is not None
+        }
+        rows = []
+        for filename, number in numbers.items():
+            row = [number]
+            for other_filename in numbers:
+                if other_filename == filename:
+                    row.append("-")
+                else:
+                    counts = matrix.get((filename, other_filename)) or matrix[
+                        other_filename, filename
+                    ]
+                    row.append(sum(counts))
+            rows.append(row)
+        return generate_table(
+            rows, ["", *numbers.values()], grid_style=tableformatter.FancyGrid()
+        )
+
+    @staticmethod
+    def conflict_rows(data):
+        """
+        Yield the conflicts found with a comparison database (see `get_conflicting_data`)
+        as (entry in main, entry in comparison, conflicting fields), with "-" for a
+        missing entry
+        """
+        missing_in_comparison, missing_in_main, conflicts = data
+        for entry_name in missing_in_comparison:
+            yield entry_name, "-", ""
+        for entry_name in missing_in_main:
+            yield "-", entry_name, ""
+        for entry_name, conflicting_fields in conflicts:
+            yield entry_name, entry_name, conflicting_fields
@@ -1,83 +1,427 @@
 #!/usr/bin/env python3
 """Connect to and interact with a KeePassX database."""
 
-import attr
-from pykeepass import PyKeePass
-import pyperclip
+# standards
+from contextlib import contextmanager
+import logging
+import time
+
+from kpcli import clipboard
+from kpcli.index import KpIndex
+from kpcli.journal import DEFAULT_JOURNAL_MAX_SIZE, KpJournal
+from kpcli.kdbx import kdf_fingerprint, save_database
+from kpcli.merger import merge_entries
+from kpcli.search import FUZZY_MATCH, SUBSTRING_MATCH, entry_strings
+
+
+logger = logging.getLogger(__name__)
 
 
 class KpDatabaseConnector:
     """
     Connects to and interacts with a KeePassX database.
+
+    In journal mode, changes are appended to a journal next to the database file instead of
+    rewriting the database, until the journal reaches journal_max_size bytes or is
+    compacted.  An existing journal is always replayed when the database is opened.
     """
 
-    def __init__(self, db_config):
+    def __init__(
+        self,
+        db_config,
+        compression_level=None,
+        journal=False,
+        journal_max_size=DEFAULT_JOURNAL_MAX_SIZE,
+    ):
+        # pykeepass is slow to import, so only import it when a database is opened
+        from pykeepass import PyKeePass
+
         self.db = PyKeePass(
-            str(db_config.filename), db_config.password, db_config.keyfile
+            str(db_config.filename),
+            db_config.password,
+            db_config.keyfile,
+            transformed_key=db_config.transformed_key,
+        )
+        self.journal = KpJournal(self.db.filename, self.db.transformed_key)
+        self.use_journal = journal
+        self.journal_max_size = journal_max_size
+        self.journal.replay(self.db)
+        self.index = KpIndex(self.db)
+        self.compression_level = compression_level
+        # when saves are deferred, changes are only written by `flush`
+        self.defer_saves = False
+        self.unsaved_changes = False
+        # changes not yet written to the journal
+        self._changes = []
+        # timings of each save, see `kdbx.save_database`
+        self.save_timings = []
+
+    def reload(self):
+        """Re-read the database from disk, discarding any unsaved changes"""
+        # reuse the transformed key so the KDF doesn't run again
+        self.db.read(
+            self.db.filename,
+            self.db.password,
+            self.db.keyfile,
+            transformed_key=self.db.transformed_key,
+        )
+        self.journal.replay(self.db)
+        self.index.rebuild()
+        self.unsaved_changes = False
+        self._changes = []
+
+    def save(self, change=None):
+        """
+        Record that the database has changed and save it, unless saves are deferred.
+        change describes the change for the journal (see `journal.apply_change`)
+        """
+        self.unsaved_changes = True
+        # changes are only kept for the journal, so that deferred saves (e.g. of a large
+        # import) don't hold every change in memory
+        if change is not None and self.use_journal:
+            self._changes.append(change)
+        if not self.defer_saves:
+            self.flush()
+
+    def flush(self):
+        """
+        Write unsaved changes, to the journal in journal mode, otherwise to the database
+        file, reusing the transformed key so the KDF doesn't run again
+        """
+        if not self.unsaved_changes:
+            return
+        if self.use_journal:
+            start = time.perf_counter()
+            self.journal.append(self._changes)
+            timings = {"journal": time.perf_counter() - start, "size": self.journal.size()}
+            logger.debug("Appended to journal: %s", timings)
+            self.save_timings.append(timings)
+            self._changes = []
+            self.unsaved_changes = False
+            if self.journal.size() >= self.journal_max_size:
+                self.compact()
+            return
+        self.compact()
+
+    def compact(self):
+        """
+        Write the database file with all changes, including any in the journal, and
+        remove the journal
+        """
+        timings = save_database(
+            self.db,
+            transformed_key=self.db.transformed_key,
+            compression_level=self.compression_level,
         )
+        logger.debug("Saved database: %s", timings)
+        self.save_timings.append(timings)
+        self.journal.remove()
+        self._changes = []
+        self.unsaved_changes = False
+
+    @contextmanager
+    def deferred_save(self):
+        """
+        Defer saving until the end of the block, so that several changes are written
+        to the database file once
+        """
+        self.defer_saves = True
+        try:
+            yield self
+        finally:
+            self.defer_saves = False
+        self.flush()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Apply the changes made in the block together: save once at the end of the block,
+        or, if an error is raised, discard all of them by re-reading the database file.
+        A transaction inside deferred saves (e.g. an import in a batch) leaves the save
+        to the outer block
+        """
+        defer_saves = self.defer_saves
+        self.defer_saves = True
+        try:
+            yield self
+        except BaseException:
+            if self.unsaved_changes:
+                self.reload()
+            raise
+        finally:
+            self.defer_saves = defer_saves
+        if not defer_saves:
+            self.flush()
 
     def add_group(self, group_name, super_group=None):
         if super_group is None:
             super_group = self.find_group("root")
-        self.db.add_group(super_group, group_name)
-        self.db.save()
+        group = self.db.add_group(super_group, group_name)
+        super_path = self.index.group_paths[super_group.uuid]
+        self.index.add_group(group, [super_path, group_name] if super_path else [group_name])
+        self.save(
+            {
+                "op": "add_group",
+                "uuid": str(group.uuid),
+                "parent": str(super_group.uuid),
+                "name": group_name,
+            }
+        )
 
     def delete_group(self, group):
+        change = {"op": "delete_group", "uuid": str(group.uuid)}
+        self.index.remove_group(group)
         self.db.delete_group(group)
-        self.db.save()
+        self.save(change)
 
     def list_group_names(self):
         """Fetch names of all groups"""
         return sorted(
-            [group.name for group in self.db.groups], key=lambda name: name.lower()
+            [group.name for group in self.index.groups], key=lambda name: name.lower()
         )
 
     def list_group_entries(self, group_name):
         """Fetch names of all entries in a single group"""
         group = self.find_group(group_name=group_name)
         return sorted(
-            [entry.title for entry in group.entries], key=lambda name: name.lower()
+            [entry.title for entry in self.index.group_entries[group.uuid]],
+            key=lambda name: name.lower(),
         )
 
+    def iter_group_entries(self, group=None):
+        """
+        Walk the group tree once, yielding (group path, sorted entry titles) for each
+        group in turn, or for a single group if one is given.  The root group's path is
+        its name.
+        """
+        groups = self.index.groups if group is None else [group]
+        for group in groups:
+            entry_titles = sorted(
+                [entry.title for entry in self.index.group_entries[group.uuid]],
+                key=lambda name: name.lower(),
+            )
+            yield self.index.group_paths[group.uuid] or group.name, entry_titles
+
+    def iter_entries(self, groups=None):
+        """
+        Walk the group tree once, yielding (group path, entry) for each entry, or only for
+        the entries in the given groups and their subgroups.  The root group's path is "".
+        """
+        paths = None
+        if groups is not None:
+            paths = [self.index.group_paths[group.uuid] for group in groups]
+        for group in self.index.groups:
+            group_path = self.index.group_paths[group.uuid]
+            if paths is not None and not any(
+                not path or group_path == path or group_path.startswith(f"{path}/")
+                for path in paths
+            ):
+                continue
+            for entry in self.index.group_entries[group.uuid]:
+                yield group_path, entry
+
     def find_entries(self, query, group=None):
         """
         Fetch entries from a query string, formatted optionally as <group>/<entry title>.
         Both <group> and <entry title> are case insensitive and can be partial terms.
+        <group> may also be a full group path, e.g. <group>/<subgroup>/<entry title>.
         If a group is provided, entries will only be looked for in that group.
         """
         if query is None:
             return []
-        if group is None:
-            query = query.split("/")
-            if len(query) > 1:
-                group_name, query = query
-                group = self.find_group(group_name=group_name)
-            else:
-                query = query[0]
-
-        if group:
-            # recursive=False because if we have a specific group we want to search this group only
-            entries = self.db.find_entries(
-                title=query, group=group, recursive=False, regex=True, flags="i"
-            )
-        else:
-            entries = self.db.find_entries(title=query, regex=True, flags="i")
-        entries.sort(key=lambda entry: (entry.group.name, entry.title))
+        if group is None and "/" in query:
+            group_name, query = query.rsplit("/", 1)
+            group = self.find_group(group_name=group_name)
+
+        # if we have a specific group we want to search this group only
+        entries = self.index.find_entries(query, group)
+        entries.sort(
+            key=lambda entry: (self.index.entry_group(entry).name, entry.title)
+        )
         return entries
 
+    def search_entries(self, query, group=None, limit=None):
+        """
+        Find entries matching query, as for `find_entries`, and return them as a list of
+        (score, entry) with the best matches first.  Scores of 1 or more are matches;
+        if there are none, entries with similar titles, usernames, URLs or group paths are
+        returned as suggestions, scored below 1.
+        """
+        # matches are scored from the index, so the search index is only built if there
+        # are none
+        results = [
+            (max(self.index.match_score(query, entry), SUBSTRING_MATCH), entry)
+            for entry in self.find_entries(query, group)
+        ]
+        if not results and query:
+            # entries found by the search index are only suggestions
+            results = [
+                (min(score, FUZZY_MATCH), entry)
+                for score, entry in self.index.search_index.search(query)
+                if group is None or self.index.entry_group(entry).uuid == group.uuid
+            ]
+        results.sort(
+            key=lambda result: (
+                -result[0],
+                self.index.entry_group(result[1]).name or "",
+                result[1].title or "",
+            )
+        )
+        return results[:limit]
+
+    def search_text(self, query):
+        """
+        Full-text search of the entries' group paths, titles, usernames, URLs, notes and
+        custom string fields; see `search.parse_query` for the query syntax.  Yields
+        (entry, {field: value}) for each matching entry, with the fields that matched,
+        as soon as it's found.
+        """
+        for entry, field_names in self.index.text_index.search(query):
+            values = dict(entry_strings(entry))
+            values["group"] = self.index.group_paths[self.index.entry_group(entry).uuid]
+            yield entry, {name: values[name] for name in field_names}
+
+    def find_entry(self, title, group):
+        """Find an entry in a group by its exact title (case insensitive)"""
+        return self.index.find_entry(title, group)
+
     def find_group(self, group_name):
-        """Find the first matching group"""
-        return self.db.find_groups(name=group_name, regex=True, flags="i", first=True)
+        """
+        Find a group by exact path or name (case insensitive), or else the first group
+        partially matching group_name
+        """
+        return self.index.find_group(group_name)
 
     def add_new_entry(self, group, title, username, password, url, notes):
         """Add a new entry"""
-        self.db.add_entry(group, title, username, password, url=url, notes=notes)
-        self.db.save()
+        entry = self.db.add_entry(group, title, username, password, url=url, notes=notes)
+        self.index.add_entry(entry, group)
+        self.save(
+            {
+                "op": "add_entry",
+                "uuid": str(entry.uuid),
+                "group": str(group.uuid),
+                "title": title,
+                "username": username,
+                "password": password,
+                "url": url,
+                "notes": notes,
+            }
+        )
+
+    def find_or_add_group_path(self, path):
+        """
+        Find a group by its exact path, e.g. internet/email, adding it and any missing
+        parent groups if it doesn't exist.  An empty path is the root group.
+        """
+        root = self.db.root_group
+        names = [name for name in (path or "").split("/") if name]
+        if names and names[0].casefold() == (root.name or "").casefold():
+            # paths may include the root group, as in `ls --entries`
+            names = names[1:]
+        group = root
+        for depth in range(len(names)):
+            subgroup = self.index.find_group_by_path("/".join(names[: depth + 1]))
+            if subgroup is None:
+                self.add_group(names[depth], group)
+                subgroup = self.index.find_group_by_path("/".join(names[: depth + 1]))
+            group = subgroup
+        return group
+
+    def import_entries(self, entries):
+        """
+        Add entries, as dicts of group path, title, username, password, url and notes,
+        creating any missing groups, and save once at the end.  Entries with the same
+        title (case insensitive) as an entry already in the group are skipped.  If an error
+        is raised, none of the entries are added.
+        Returns the numbers of entries added and skipped.
+        """
+        # pykeepass is slow to import, so only import it when a database is opened
+        from pykeepass.entry import Entry
+
+        added = skipped = 0
+        with self.transaction():
+            existing = {
+                (group_uuid, (entry.title or "").casefold())
+                for group_uuid, group_entries in self.index.group_entries.items()
+                for entry in group_entries
+            }
+            # group path: (group, uuid); reading a group's uuid gets slower as entries
+            # are added to it, so it's only read once
+            groups = {}
+            for fields in entries:
+                if fields["group"] not in groups:
+                    group = self.find_or_add_group_path(fields["group"])
+                    groups[fields["group"]] = (group, group.uuid)
+                group, group_uuid = groups[fields["group"]]
+                key = (group_uuid, fields["title"].casefold())
+                if key in existing:
+                    logger.debug("Skipping existing entry %s", fields["title"])
+                    skipped += 1
+                    continue
+                existing.add(key)
+                # `PyKeePass.add_entry` checks for duplicates with an XPath query per entry
+                entry = Entry(
+                    title=fields["title"],
+                    username=fields["username"],
+                    password=fields["password"],
+                    url=fields["url"],
+                    notes=fields["notes"],
+                    kp=self.db,
+                )
+                group.append(entry)
+                self.index.add_entry(entry, group, group_uuid=group_uuid)
+                self.save(
+                    {
+                        "op": "add_entry",
+                        "uuid": str(entry.uuid),
+                        "group": str(group_uuid),
+                        "title": fields["title"],
+                        "username": fields["username"],
+                        "password": fields["password"],
+                        "url": fields["url"],
+                        "notes": fields["notes"],
+                    }
+                )
+                added += 1
+        return added, skipped
+
+    def merge_database(self, filename):
+        """
+        Merge the entries of a copy of the database (see `merger.merge_entries`), opened with
+        the same credentials, and save once.  The transformed key is reused if the copy has
+        the same key derivation parameters.  The merged changes can't be recorded in the
+        journal, so the database file is written even in journal mode.  If an error is
+        raised, none of the changes are kept.
+        Returns a KpMergeResult
+        """
+        from pykeepass import PyKeePass
+
+        transformed_key = None
+        if kdf_fingerprint(filename) == kdf_fingerprint(self.db.filename):
+            transformed_key = self.db.transformed_key
+        other_db = PyKeePass(
+            str(filename),
+            self.db.password,
+            self.db.keyfile,
+            transformed_key=transformed_key,
+        )
+        with self.transaction():
+            # the merge changes the tree directly, so an error must discard it by reloading
+            self.unsaved_changes = True
+            result = merge_entries(self, other_db)
+            if result.changed:
+                self.compact()
+            self.unsaved_changes = False
+        self.index.rebuild()
+        return result
 
     def delete_entry(self, entry):
         """Delete an entry"""
+        change = {"op": "delete_entry", "uuid": str(entry.uuid)}
+        self.index.remove_entry(entry)
         self.db.delete_entry(entry)
-        self.db.save()
+        self.save(change)
 
     def edit_entry(self, entry, field, new_value):
         """Edit a specified field on an entry"""
@@ -86,25 +430,48 @@ class KpDatabaseConnector:
             getattr(entry, field)
         except AttributeError:
             raise AttributeError(f"Entry has no attribute {field}")
+        old_title = entry.title
+        if getattr(entry, field) == new_value:
+            # nothing to save
+            return
         setattr(entry, field, new_value)
-        self.db.save()
+        if field == "title":
+            self.index.retitle_entry(entry, old_title)
+        else:
+            self.index.update_entry(entry)
+        self.save(
+            {"op": "edit_entry", "uuid": str(entry.uuid), "field": field, "value": new_value}
+        )
 
     def change_password(self, entry, new_password):
         """Change an entry's password"""
+        if entry.password == new_password:
+            return
         entry.password = new_password
-        self.db.save()
+        self.save(
+            {
+                "op": "edit_entry",
+                "uuid": str(entry.uuid),
+                "field": "password",
+                "value": new_password,
+            }
+        )
 
-    def copy_to_clipboard(self, entry, item):
-        """Copy the requested item to the clipboard"""
+    def copy_to_clipboard(self, entry, item, clear_after=None):
+        """
+        Copy the requested item to the clipboard, and clear it after clear_after seconds
+        if given, without waiting (see `clipboard.clear_later`)
+        """
         try:
             value = getattr(entry, item)
         except AttributeError:
             raise AttributeError(f"Entry has no attribute {item}")
 
-        if value is not None:
-            pyperclip.copy(getattr(entry, item))
-        else:
+        if value is None:
             raise ValueError(f"{item} is None, nothing to copy")
+        clipboard.copy(value)
+        if clear_after is not None:
+            clipboard.clear_later(value, clear_after)
 
     def get_details(self, entry, show_password=False):
         """Retrieve details for a single entry"""
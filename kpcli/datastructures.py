@@ -1,17 +1,22 @@
 #!/usr/bin/env python3
+import base64
 from datetime import datetime
 from enum import Enum
+import json
 from os import environ
 from pathlib import Path
 import random
 import string
 
 import attr
-from cryptography.fernet import Fernet
-from pykeepass.group import Group
-from typing import Optional
+from typing import Optional, TYPE_CHECKING
 
-from kpcli.connector import KpDatabaseConnector
+from kpcli.kdbx import kdf_fingerprint
+
+if TYPE_CHECKING:
+    from pykeepass.group import Group
+
+    from kpcli.connector import KpDatabaseConnector
 
 
 @attr.s
@@ -20,8 +25,8 @@ class KpContext:
     A holder object so we can pass things around in the typer Context
     """
 
-    connector = attr.ib(type=KpDatabaseConnector)
-    group = attr.ib(type=Optional[Group], default=None)
+    connector = attr.ib(type="KpDatabaseConnector")
+    group = attr.ib(type=Optional["Group"], default=None)
     paste_timeout = attr.ib(type=int, default=5)
 
 
@@ -34,6 +39,7 @@ class KpConfig:
     filename = attr.ib(type=Path)
     password = attr.ib(type=Optional[str], default=None)
     keyfile = attr.ib(type=Optional[str], default=None)
+    transformed_key = attr.ib(type=Optional[bytes], default=None)
 
 
 @attr.s
@@ -72,6 +78,22 @@ class KpEntry:
         )
 
 
+@attr.s(slots=True, frozen=True, cache_hash=True)
+class KpEntrySnapshot:
+    """
+    A compact, immutable copy of the fields of an entry, for comparing databases.
+    Sensitive fields hold a fixed-size hash of their value rather than the value itself
+    (see `comparator.entry_snapshots`).  Fields are in the same order as `KpEntry`.
+    """
+
+    title = attr.ib(type=Optional[str])
+    username = attr.ib(type=Optional[str])
+    password = attr.ib(type=Optional[str])
+    group = attr.ib(type=Optional[str])
+    url = attr.ib(type=Optional[str])
+    notes = attr.ib(type=Optional[str])
+
+
 class CopyOption(str, Enum):
     username = "username"
     u = "u"
@@ -104,10 +126,31 @@ class EditOption(str, Enum):
         return self.value
 
 
+class OutputFormat(str, Enum):
+    text = "text"
+    json = "json"
+    ndjson = "ndjson"
+    tsv = "tsv"
+
+    def __str__(self):
+        return self.value
+
+
+class FileFormat(str, Enum):
+    csv = "csv"
+    json = "json"
+    ndjson = "ndjson"
+
+    def __str__(self):
+        return self.value
+
+
 class Encrypter:
     """
     Helper class for storing and retrieving encrypted database password
     Generates an encryption key and a salt and stores the encrypted password to file
+    The transformed (KDF-derived) key for each database is stored alongside the
+    password, so that the database can be opened without re-running the KDF
     Every 24 hours the salt expires and is regenerated
     """
 
@@ -115,6 +158,7 @@ class Encrypter:
         self.secret_file = None
         self.secret = None
         self.password_file = None
+        self.keys_file = None
         self.salt_files = None
         self.latest_salt_file = None
         self.timeout = 60 * 60 * 24
@@ -128,24 +172,36 @@ class Encrypter:
             if self.store_encrypted_password:
                 if not self.secret_file.exists():
                     # generate a secret
+                    from cryptography.fernet import Fernet
+
                     key = Fernet.generate_key()
                     self.secret = key
                     self.secret_file.write_bytes(key)
                 else:
                     self.secret = self.secret_file.read_bytes()
             self.password_file = Path(environ["HOME"]) / ".kp" / ".pass"
+            self.keys_file = Path(environ["HOME"]) / ".kp" / ".keys"
             self.salt_files = list((Path(environ["HOME"]) / ".kp").glob(".salt_*"))
             self.latest_salt_file = max(self.salt_files) if self.salt_files else None
 
+    def _fernet(self):
+        # cryptography is only imported when a password is stored or retrieved
+        from cryptography.fernet import Fernet
+
+        return Fernet(self.secret)
+
+    def _salt_expired(self):
+        timestamp = float(self.latest_salt_file.name.split("_")[-1])
+        return datetime.now().timestamp() - timestamp > self.timeout
+
     def get_password(self):
         self.setup()
         if self.latest_salt_file is not None and self.password_file.exists():
-            timestamp = float(self.latest_salt_file.name.split("_")[-1])
             # check timestamp and delete/refresh salt every 24 hrs
-            if datetime.now().timestamp() - timestamp > self.timeout:
+            if self._salt_expired():
                 self.reset()
                 return
-            fernet = Fernet(self.secret)
+            fernet = self._fernet()
             salt = self.latest_salt_file.read_text()
             password_with_salt = self.password_file.read_bytes()
             password = (
@@ -157,7 +213,7 @@ class Encrypter:
         self.setup()
         for salt_file in self.salt_files:
             salt_file.unlink()
-        for filepath in [self.secret_file, self.password_file]:
+        for filepath in [self.secret_file, self.password_file, self.keys_file]:
             if filepath.exists():
                 filepath.unlink()
         return
@@ -171,5 +227,67 @@ class Encrypter:
         salt = f"".join(random.choice(string.ascii_letters) for i in range(24))
         password_with_salt = f"{salt}{config.password}"
         salt_file.write_text(salt)
-        fernet = Fernet(self.secret)
+        self.latest_salt_file = salt_file
+        self.salt_files.append(salt_file)
+        fernet = self._fernet()
         self.password_file.write_bytes(fernet.encrypt(password_with_salt.encode()))
+
+    def _read_keys(self):
+        if not self.keys_file.exists():
+            return {}
+        fernet = self._fernet()
+        salt = self.latest_salt_file.read_text()
+        keys_with_salt = fernet.decrypt(self.keys_file.read_bytes()).decode("utf-8")
+        return json.loads(keys_with_salt[len(salt) :])
+
+    def get_export_key(self):
+        """
+        The Fernet key that exports are encrypted with, generated the first time it's
+        needed.  Unlike the secret, it isn't removed by `reset`, so that encrypted exports
+        can always be decrypted.
+        """
+        export_key_file = Path(environ["HOME"]) / ".kp" / ".export_key"
+        if not export_key_file.exists():
+            from cryptography.fernet import Fernet
+
+            export_key_file.parent.mkdir(parents=True, exist_ok=True)
+            export_key_file.touch(mode=0o600)
+            export_key_file.write_bytes(Fernet.generate_key())
+        return export_key_file.read_bytes()
+
+    def get_transformed_key(self, filename):
+        """
+        Fetch the stored transformed key for a database.  Returns None if there is no key,
+        the salt has expired, or the database's KDF salt or parameters have changed since
+        the key was stored.
+        """
+        self.setup()
+        if self.latest_salt_file is None or not self.keys_file.exists():
+            return
+        if self._salt_expired():
+            self.reset()
+            return
+        stored_key = self._read_keys().get(str(filename))
+        if stored_key is None or stored_key["kdf"] != kdf_fingerprint(filename):
+            return
+        return base64.b64decode(stored_key["key"])
+
+    def save_transformed_key(self, filename, transformed_key):
+        """
+        Store the transformed key for a database, along with the fingerprint of the KDF
+        parameters it was derived with
+        """
+        self.setup()
+        if self.latest_salt_file is None or not self.password_file.exists():
+            # keys are only stored alongside a stored password
+            return
+        keys = self._read_keys()
+        keys[str(filename)] = {
+            "kdf": kdf_fingerprint(filename),
+            "key": base64.b64encode(transformed_key).decode(),
+        }
+        salt = self.latest_salt_file.read_text()
+        fernet = self._fernet()
+        self.keys_file.write_bytes(
+            fernet.encrypt(f"{salt}{json.dumps(keys)}".encode())
+        )
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""Export the entries of a KeePassX database as CSV, JSON or NDJSON, optionally encrypted."""
+
+from kpcli.search import entry_strings
+
+
+# The fields of an exported entry, as in `KpEntry`; group is the path of its group
+EXPORT_FIELDS = ("title", "username", "password", "group", "url", "notes")
+
+
+def export_records(connector, fields=EXPORT_FIELDS, groups=None):
+    """
+    Yield a record for each entry (see `KpDatabaseConnector.iter_entries`), with the
+    given fields.  Fields other than EXPORT_FIELDS are read from the entry's custom string
+    fields.  Missing fields are "".
+    """
+    for group_path, entry in connector.iter_entries(groups):
+        # all the fields are read in one pass over the entry's strings
+        values = dict(entry_strings(entry, protected=True))
+        values["group"] = group_path
+        yield {field: values.get(field, "") for field in fields}
+
+
+def encrypting(write, key):
+    """
+    Wrap a function that writes bytes, so that each chunk of text written is encrypted
+    with the Fernet key and written as a token on its own line
+    """
+    # cryptography is only imported if the export is encrypted
+    from cryptography.fernet import Fernet
+
+    fernet = Fernet(key)
+
+    def write_encrypted(text):
+        write(fernet.encrypt(text.encode()) + b"\n")
+
+    return write_encrypted
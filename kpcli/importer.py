@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""Read entries to import into a KeePassX database from CSV, JSON or NDJSON files."""
+
+# standards
+import csv
+import io
+import json
+import re
+
+from kpcli.datastructures import FileFormat
+
+
+# The fields of an imported entry; group is the path of its group, e.g. internet/email
+IMPORT_FIELDS = ("group", "title", "username", "password", "url", "notes")
+# Characters read from a JSON file at a time
+JSON_CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = re.compile(r"\s*")
+
+
+class ImportFileError(ValueError):
+    pass
+
+
+class _DecryptingReader(io.RawIOBase):
+    """Reads the plain text of a file of Fernet tokens, one per line (see `exporter.encrypting`)"""
+
+    def __init__(self, infile, key):
+        # cryptography is only imported if the file is encrypted
+        from cryptography.fernet import Fernet
+
+        self._lines = iter(infile)
+        self._fernet = Fernet(key)
+        self._buffer = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        from cryptography.fernet import InvalidToken
+
+        while not self._buffer:
+            line = next(self._lines, b"").strip()
+            if not line:
+                return 0
+            try:
+                self._buffer = self._fernet.decrypt(line)
+            except InvalidToken:
+                raise ImportFileError("File could not be decrypted with this key")
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+def decrypted(infile, key):
+    """The decrypted text of an encrypted export, read from a binary file as it's needed"""
+    return io.TextIOWrapper(
+        io.BufferedReader(_DecryptingReader(infile, key)), encoding="utf-8", newline=""
+    )
+
+
+def guess_format(filename):
+    """The format of a file from its extension, or None if it isn't known"""
+    suffix = filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+    if suffix == "jsonl":
+        return FileFormat.ndjson
+    try:
+        return FileFormat(suffix)
+    except ValueError:
+        return None
+
+
+def _iter_json_array(infile):
+    """
+    Yield the items in a JSON array one at a time, reading the file in chunks rather than
+    parsing it all at once
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    started = False
+    eof = False
+    while True:
+        position = _WHITESPACE.match(buffer, position).end()
+        if position < len(buffer):
+            char = buffer[position]
+            if not started:
+                if char != "[":
+                    raise ImportFileError("Expected a JSON array of entries")
+                started = True
+                position += 1
+                continue
+            if char == "]":
+                return
+            if char == ",":
+                position += 1
+                continue
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except ValueError as e:
+                # the item may not have been read completely yet
+                if eof:
+                    raise ImportFileError(f"Invalid JSON: {e}")
+            else:
+                yield item
+                continue
+        elif eof:
+            raise ImportFileError("Invalid JSON: unexpected end of file")
+        chunk = infile.read(JSON_CHUNK_SIZE)
+        eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+
+def _read_records(infile, file_format):
+    if file_format == FileFormat.csv:
+        yield from csv.DictReader(infile)
+    elif file_format == FileFormat.ndjson:
+        for line_number, line in enumerate(infile, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                raise ImportFileError(f"Line {line_number}: invalid JSON: {e}")
+    else:
+        yield from _iter_json_array(infile)
+
+
+def read_entries(infile, file_format):
+    """
+    Yield the entries in a file in turn, as dicts of the IMPORT_FIELDS ("" if a field is
+    missing).  Field names are case insensitive, so CSV files exported by other
+    password managers with Title, Username, URL etc. columns can be read.
+    """
+    for number, record in enumerate(_read_records(infile, file_format), start=1):
+        if not isinstance(record, dict):
+            raise ImportFileError(f"Entry {number}: expected an object, not {record!r}")
+        fields = {str(key).casefold(): value for key, value in record.items()}
+        entry = {
+            field: "" if fields.get(field) is None else str(fields[field])
+            for field in IMPORT_FIELDS
+        }
+        if not entry["title"]:
+            raise ImportFileError(f"Entry {number}: no title")
+        yield entry
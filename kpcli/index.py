@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""In-memory index of the groups and entries in a KeePassX database."""
+
+# standards
+import re
+
+from kpcli.search import KpSearchIndex, KpTextIndex, match_score
+
+
+def _key(name):
+    return (name or "").casefold()
+
+
+def _compile(query):
+    """Compile a query as a case-insensitive regex, or as literal text if it isn't one"""
+    try:
+        return re.compile(query, flags=re.IGNORECASE)
+    except re.error:
+        return re.compile(re.escape(query), flags=re.IGNORECASE)
+
+
+class KpIndex:
+    """
+    Maps case-folded group names, group paths and entry titles to the groups and
+    entries in a database.  Built in a single walk of the group tree, so that lookups
+    don't need an XPath query against the whole database.
+
+    Group paths are the names of the group and its parents joined with "/", not
+    including the root group, e.g. "internet/email".
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.rebuild()
+
+    def rebuild(self):
+        """(Re)build the index from the database"""
+        # all groups, in document order
+        self.groups = []
+        self.group_paths = {}
+        self.group_entries = {}
+        self.entry_groups = {}
+        self._groups_by_name = {}
+        self._groups_by_path = {}
+        self._entries_by_title = {}
+        # built the first time they're needed
+        self._search_index = None
+        self._text_index = None
+        self._add_group_tree(self.db.root_group, path=[])
+
+    @property
+    def search_index(self):
+        """Trigram index of the entries, for ranked and fuzzy search"""
+        if self._search_index is None:
+            self._search_index = KpSearchIndex()
+            for group in self.groups:
+                for entry in self.group_entries[group.uuid]:
+                    self._search_index.add(entry, self.group_paths[group.uuid])
+        return self._search_index
+
+    @property
+    def text_index(self):
+        """Inverted index of the entries' fields, for full-text search"""
+        if self._text_index is None:
+            self._text_index = KpTextIndex()
+            for group in self.groups:
+                for entry in self.group_entries[group.uuid]:
+                    self._text_index.add(entry, self.group_paths[group.uuid])
+        return self._text_index
+
+    def _search_indexes(self):
+        """The search indexes that have been built"""
+        return [
+            index
+            for index in (self._search_index, self._text_index)
+            if index is not None
+        ]
+
+    def _add_group_tree(self, group, path):
+        self.add_group(group, path)
+        group_uuid = group.uuid
+        for entry in group.entries:
+            self.add_entry(entry, group, group_uuid=group_uuid)
+        for subgroup in group.subgroups:
+            self._add_group_tree(subgroup, [*path, subgroup.name or ""])
+
+    def add_group(self, group, path):
+        """Add a group, with its path as a list of group names"""
+        self.groups.append(group)
+        path = "/".join(path)
+        self.group_paths[group.uuid] = path
+        self.group_entries[group.uuid] = []
+        self._groups_by_name.setdefault(_key(group.name), []).append(group)
+        self._groups_by_path.setdefault(_key(path), group)
+
+    def remove_group(self, group):
+        """Remove a group and all its subgroups and entries"""
+        for subgroup in group.subgroups:
+            self.remove_group(subgroup)
+        for entry in self.group_entries.pop(group.uuid):
+            self.entry_groups.pop(entry.uuid, None)
+            self._remove(self._entries_by_title, _key(entry.title), entry)
+            for index in self._search_indexes():
+                index.remove(entry)
+        path = self.group_paths.pop(group.uuid)
+        self.groups = [g for g in self.groups if g.uuid != group.uuid]
+        self._remove(self._groups_by_name, _key(group.name), group)
+        if self._groups_by_path.get(_key(path)) == group:
+            del self._groups_by_path[_key(path)]
+
+    def add_entry(self, entry, group, group_uuid=None):
+        """
+        Add an entry to the group it belongs to.  group_uuid may be given if it's already
+        known, as reading it takes longer the more entries the group has.
+        """
+        group_uuid = group_uuid or group.uuid
+        self.group_entries[group_uuid].append(entry)
+        self.entry_groups[entry.uuid] = group
+        self._entries_by_title.setdefault(_key(entry.title), []).append(entry)
+        for index in self._search_indexes():
+            index.add(entry, self.group_paths[group_uuid])
+
+    def remove_entry(self, entry, group=None):
+        """Remove an entry"""
+        group = group or self.entry_groups[entry.uuid]
+        self.entry_groups.pop(entry.uuid, None)
+        self.group_entries[group.uuid] = [
+            e for e in self.group_entries[group.uuid] if e.uuid != entry.uuid
+        ]
+        self._remove(self._entries_by_title, _key(entry.title), entry)
+        for index in self._search_indexes():
+            index.remove(entry)
+
+    def retitle_entry(self, entry, old_title):
+        """Update the index after an entry's title changes"""
+        self._remove(self._entries_by_title, _key(old_title), entry)
+        self._entries_by_title.setdefault(_key(entry.title), []).append(entry)
+        self.update_entry(entry)
+
+    def update_entry(self, entry):
+        """Update the search indexes after an entry's fields change"""
+        group = self.entry_groups[entry.uuid]
+        for index in self._search_indexes():
+            index.remove(entry)
+            index.add(entry, self.group_paths[group.uuid])
+
+    @staticmethod
+    def _remove(mapping, key, item):
+        items = [i for i in mapping.get(key, []) if i.uuid != item.uuid]
+        if items:
+            mapping[key] = items
+        else:
+            mapping.pop(key, None)
+
+    @property
+    def entries(self):
+        """All entries, grouped by group in document order"""
+        return [
+            entry for group in self.groups for entry in self.group_entries[group.uuid]
+        ]
+
+    def entry_group(self, entry):
+        return self.entry_groups[entry.uuid]
+
+    def match_score(self, query, entry):
+        """
+        Score how well an entry's title and full name match query (see
+        `search.match_score`), without building the search index
+        """
+        title = (entry.title or "").casefold()
+        group_path = self.group_paths[self.entry_group(entry).uuid]
+        full_name = f"{group_path}/{title}".casefold() if group_path else title
+        return match_score(query.casefold(), title, full_name)
+
+    def find_group(self, group_name):
+        """
+        Find a group by its exact (case-insensitive) path or name, otherwise the first
+        group whose name matches group_name as a case-insensitive regex (or as text)
+        """
+        key = _key(group_name)
+        if key in self._groups_by_path:
+            return self._groups_by_path[key]
+        if self._groups_by_name.get(key):
+            return self._groups_by_name[key][0]
+        pattern = _compile(group_name)
+        for group in self.groups:
+            if group.name is not None and pattern.search(group.name):
+                return group
+
+    def find_group_by_path(self, path):
+        """Find a group by its exact (case-insensitive) path, or None"""
+        return self._groups_by_path.get(_key(path))
+
+    def find_entry(self, title, group):
+        """Find an entry in a group by its exact (case-insensitive) title"""
+        for entry in self._entries_by_title.get(_key(title), []):
+            if self.entry_groups[entry.uuid].uuid == group.uuid:
+                return entry
+
+    def find_entries(self, query, group=None):
+        """
+        Find entries whose title matches query as a case-insensitive regex (or as text,
+        if it isn't a valid regex), optionally in a single group only
+        """
+        pattern = _compile(query)
+        if group is not None:
+            return [
+                entry
+                for entry in self.group_entries.get(group.uuid, [])
+                if entry.title is not None and pattern.search(entry.title)
+            ]
+        # match against the indexed titles rather than reading each entry's title
+        return [
+            entry
+            for title, entries in self._entries_by_title.items()
+            if title and pattern.search(title)
+            for entry in entries
+        ]
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Append-only journal of changes to a KeePassX database.
+
+In journal mode, each change is appended to an encrypted sidecar file instead of
+rewriting the whole database.  The journal is replayed on top of the database when it is
+opened, and folded back into the database file by compaction.
+"""
+
+# standards
+import base64
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+import uuid
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOURNAL_MAX_SIZE = 1024 * 1024
+
+
+def database_hash(filename):
+    """A hash of the whole database file, which the journal's changes apply to"""
+    digest = hashlib.sha256()
+    with open(filename, "rb") as infile:
+        for block in iter(lambda: infile.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class KpJournal:
+    """
+    An encrypted journal of changes to a database, stored next to it as <database>.journal.
+
+    Each line is a Fernet token.  The first holds the hash of the database file that the
+    journal applies to; each following line holds one change.  The key is derived from the
+    database's transformed key, so only someone who can unlock the database can read it.
+    """
+
+    def __init__(self, db_filename, transformed_key):
+        self.db_filename = Path(db_filename)
+        self.filename = self.db_filename.with_name(f"{self.db_filename.name}.journal")
+        self._key = base64.urlsafe_b64encode(
+            hashlib.sha256(b"kpcli-journal" + transformed_key).digest()
+        )
+
+    def _fernet(self):
+        # cryptography is only imported if there is a journal to read or write
+        from cryptography.fernet import Fernet
+
+        return Fernet(self._key)
+
+    def exists(self):
+        return self.filename.exists()
+
+    def size(self):
+        return self.filename.stat().st_size if self.exists() else 0
+
+    def read(self):
+        """
+        Return the changes recorded in the journal.  A change that was only partly written
+        (e.g. by a crash) ends the journal.  If the journal doesn't apply to the current
+        database file, it is moved aside to <database>.journal.stale and None is returned.
+        """
+        from cryptography.fernet import InvalidToken
+
+        fernet = self._fernet()
+        with open(self.filename, "rb") as infile:
+            lines = infile.read().splitlines()
+        try:
+            header = json.loads(fernet.decrypt(lines[0]))
+        except (IndexError, InvalidToken, ValueError):
+            header = None
+        if header is None or header["base"] != database_hash(self.db_filename):
+            stale_filename = self.filename.with_name(f"{self.filename.name}.stale")
+            logger.warning(
+                "Journal %s doesn't match the database; moved to %s",
+                self.filename,
+                stale_filename,
+            )
+            os.replace(self.filename, stale_filename)
+            return None
+
+        changes = []
+        for line_number, line in enumerate(lines[1:], start=2):
+            try:
+                changes.append(json.loads(fernet.decrypt(line)))
+            except (InvalidToken, ValueError):
+                logger.warning(
+                    "Ignoring incomplete journal record at line %s of %s",
+                    line_number,
+                    self.filename,
+                )
+                break
+        return changes
+
+    def replay(self, db):
+        """Apply the changes in the journal, if there is one, to an opened database"""
+        if not self.exists():
+            return
+        changes = self.read() or []
+        for change in changes:
+            try:
+                apply_change(db, change)
+            except (AttributeError, TypeError, ValueError) as e:
+                logger.warning("Could not replay journal change %s: %s", change["op"], e)
+        logger.debug("Replayed %s changes from %s", len(changes), self.filename)
+
+    def append(self, changes):
+        """Append changes to the journal, creating it if it doesn't exist"""
+        fernet = self._fernet()
+        lines = []
+        if not self.exists():
+            header = {"base": database_hash(self.db_filename)}
+            lines.append(fernet.encrypt(json.dumps(header).encode()))
+        lines.extend(fernet.encrypt(json.dumps(change).encode()) for change in changes)
+        with open(self.filename, "ab") as outfile:
+            outfile.write(b"".join(line + b"\n" for line in lines))
+            outfile.flush()
+            os.fsync(outfile.fileno())
+
+    def remove(self):
+        if self.exists():
+            self.filename.unlink()
+
+
+def _find_group(db, group_uuid):
+    return db.find_groups(uuid=uuid.UUID(group_uuid), first=True)
+
+
+def _find_entry(db, entry_uuid):
+    return db.find_entries(uuid=uuid.UUID(entry_uuid), first=True)
+
+
+def apply_change(db, change):
+    """Apply a journal change to an opened PyKeePass database"""
+    operation = change["op"]
+    if operation == "add_group":
+        group = db.add_group(_find_group(db, change["parent"]), change["name"])
+        group.uuid = uuid.UUID(change["uuid"])
+    elif operation == "delete_group":
+        db.delete_group(_find_group(db, change["uuid"]))
+    elif operation == "add_entry":
+        entry = db.add_entry(
+            _find_group(db, change["group"]),
+            change["title"],
+            change["username"],
+            change["password"],
+            url=change["url"],
+            notes=change["notes"],
+        )
+        entry.uuid = uuid.UUID(change["uuid"])
+    elif operation == "delete_entry":
+        db.delete_entry(_find_entry(db, change["uuid"]))
+    elif operation == "edit_entry":
+        setattr(_find_entry(db, change["uuid"]), change["field"], change["value"])
+    else:
+        raise ValueError(f"Unknown journal operation {operation}")
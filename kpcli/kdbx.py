@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""Read KDBX file headers without unlocking the database, and write KDBX files safely."""
+
+# standards
+from contextlib import contextmanager
+import hashlib
+import os
+from pathlib import Path
+import stat
+import tempfile
+import time
+import zlib
+
+
+def _parse_header(filename):
+    from pykeepass.kdbx_parsing import KDBX
+
+    header_struct = KDBX.subcons[0]
+    with open(filename, "rb") as infile:
+        return header_struct.parse_stream(infile)
+
+
+def read_header(filename):
+    """Parse the unencrypted outer header of a KDBX file"""
+    return _parse_header(filename).value
+
+
+def header_hash(filename):
+    """A hash of the raw bytes of a KDBX file's outer header"""
+    return hashlib.sha256(_parse_header(filename).data).hexdigest()
+
+
+def kdf_parameters(filename):
+    """
+    Return the key derivation parameters (algorithm, salt, rounds/cost) from a
+    KDBX header as bytes.  Two files with the same credentials and the same KDF
+    parameters derive the same transformed key.
+    """
+    header = read_header(filename)
+    dynamic_header = header.dynamic_header
+    if header.major_version == 3:
+        parameters = [
+            b"aeskdf",
+            dynamic_header.transform_seed.data,
+            str(dynamic_header.transform_rounds.data).encode(),
+        ]
+    else:
+        kdf = dynamic_header.kdf_parameters.data.dict
+        parameters = [f"{key}={kdf[key].value!r}".encode() for key in sorted(kdf)]
+    return b"|".join([str(header.major_version).encode(), *parameters])
+
+
+def kdf_fingerprint(filename):
+    """A hash of a KDBX file's key derivation parameters"""
+    return hashlib.sha256(kdf_parameters(filename)).hexdigest()
+
+
+@contextmanager
+def _compression_level(level):
+    """
+    Compress KDBX payloads at this zlib level (0-9) inside the block.  pykeepass always
+    compresses at level 6, so its encoder is replaced while the block runs.
+    """
+    if level is None:
+        yield
+        return
+    from pykeepass.kdbx_parsing.common import Decompressed
+
+    def _encode(self, data, con, path):
+        # gzip format, as pykeepass writes it
+        compressobj = zlib.compressobj(level, zlib.DEFLATED, 16 + 15)
+        return compressobj.compress(data) + compressobj.flush()
+
+    original_encode = Decompressed._encode
+    Decompressed._encode = _encode
+    try:
+        yield
+    finally:
+        Decompressed._encode = original_encode
+
+
+def _fsync_directory(directory):
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        # directories can't be opened on some platforms, e.g. Windows
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def save_database(db, transformed_key=None, compression_level=None):
+    """
+    Save an opened PyKeePass database atomically: the file is built in memory, written to
+    a temporary file in the same directory and fsynced, then renamed over the original, so
+    that a crash can't leave a partly written database.
+    Returns the time in seconds taken by each stage, and the size of the file in bytes.
+    """
+    from pykeepass.kdbx_parsing import KDBX
+
+    timings = {}
+    filename = Path(db.filename)
+    start = time.perf_counter()
+    with _compression_level(compression_level):
+        data = KDBX.build(
+            db.kdbx,
+            password=db.password,
+            keyfile=db.keyfile,
+            transformed_key=transformed_key,
+            decrypt=True,
+        )
+    timings["build"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    fd, temp_filename = tempfile.mkstemp(
+        dir=filename.parent, prefix=f".{filename.name}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "wb") as outfile:
+            outfile.write(data)
+            outfile.flush()
+            timings["write"] = time.perf_counter() - start
+            start = time.perf_counter()
+            os.fsync(outfile.fileno())
+            timings["fsync"] = time.perf_counter() - start
+        if filename.exists():
+            os.chmod(temp_filename, stat.S_IMODE(filename.stat().st_mode))
+        start = time.perf_counter()
+        os.replace(temp_filename, filename)
+        _fsync_directory(filename.parent)
+        timings["rename"] = time.perf_counter() - start
+    except BaseException:
+        if os.path.exists(temp_filename):
+            os.unlink(temp_filename)
+        raise
+    timings["total"] = sum(timings.values())
+    timings["size"] = len(data)
+    return timings
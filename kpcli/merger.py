@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Merge the entries of a conflicting copy of a KeePassX database into the main database.
+
+Entries are matched by UUID, which copies of a database share.  Each database is walked
+once and its entries mapped by UUID, so merging takes time linear in the number of
+entries.  For an entry in both databases, the version modified last wins, and the other
+version is kept in the entry's history, along with the history of both versions.
+"""
+
+# standards
+from copy import deepcopy
+
+# third parties
+import attr
+
+
+@attr.s
+class KpMergeResult:
+    """Numbers of entries merged from a copy, by what happened to them"""
+
+    # only in the copy, and added to the main database
+    added = attr.ib(type=int, default=0)
+    # modified later in the copy, so replaced by the copy's version
+    updated = attr.ib(type=int, default=0)
+    # modified later in the main database; the copy's version is added to the history
+    kept = attr.ib(type=int, default=0)
+    # the same in both databases (their histories are still merged)
+    unchanged = attr.ib(type=int, default=0)
+    # only in the copy, but deleted from the main database since it was last modified
+    deleted = attr.ib(type=int, default=0)
+    # whether anything in the main database was changed
+    changed = attr.ib(type=bool, default=False)
+
+
+# The Times elements that hold dates, which are stored differently in KDBX 3 and 4
+_TIME_FIELDS = (
+    "CreationTime",
+    "LastModificationTime",
+    "LastAccessTime",
+    "ExpiryTime",
+    "LocationChanged",
+)
+
+
+def walk_groups(group, path, recycle_bin_uuid=None):
+    """Yield (group, path) for a group and its subgroups, leaving out the recycle bin"""
+    yield group, path
+    for subgroup in group.iterchildren("Group"):
+        if subgroup.findtext("UUID") != recycle_bin_uuid:
+            yield from walk_groups(
+                subgroup, [*path, subgroup.findtext("Name") or ""], recycle_bin_uuid
+            )
+
+
+def _entries_by_uuid(db, include_recycle_bin=True):
+    """
+    Map the UUID of each entry in a database (not including history) to the entry's
+    element and its group's path, in a single walk of the group tree
+    """
+    root = db.tree.getroot()
+    recycle_bin_uuid = None
+    if not include_recycle_bin:
+        recycle_bin_uuid = root.findtext("Meta/RecycleBinUUID")
+    entries = {}
+    for group, path in walk_groups(root.find("Root/Group"), [], recycle_bin_uuid):
+        group_path = "/".join(path)
+        for entry in group.iterchildren("Entry"):
+            entries[entry.findtext("UUID")] = (entry, group_path)
+    return entries
+
+
+def _deletion_times(db):
+    """Map the UUIDs of objects deleted from a database to when they were deleted"""
+    deleted_objects = db.tree.getroot().find("Root/DeletedObjects")
+    if deleted_objects is None:
+        return {}
+    return {
+        deleted.findtext("UUID"): db._decode_time(deleted.findtext("DeletionTime"))
+        for deleted in deleted_objects.iterchildren("DeletedObject")
+    }
+
+
+def _mtime(db, element):
+    return db._decode_time(element.findtext("Times/LastModificationTime"))
+
+
+def _strings(element):
+    """An entry's string fields, to compare versions of it"""
+    return sorted(
+        (string.findtext("Key"), string.findtext("Value"))
+        for string in element.iterchildren("String")
+    )
+
+
+def _version_key(db, element):
+    """Identifies a version of an entry, so it isn't in the history twice"""
+    return _mtime(db, element), tuple(_strings(element))
+
+
+def _copy_entry(element, source_db, target_db):
+    """
+    Copy an entry element from one database for another, re-encoding its times if the
+    databases' KDBX versions store them differently.  Attachments are left out, as they
+    refer to binaries stored elsewhere in the source database.
+    """
+    element = deepcopy(element)
+    for binary in list(element.iter("Binary")):
+        binary.getparent().remove(binary)
+    if source_db.version[0] != target_db.version[0]:
+        for times in element.iter("Times"):
+            for field in _TIME_FIELDS:
+                time_element = times.find(field)
+                if time_element is not None and time_element.text:
+                    time_element.text = target_db._encode_time(
+                        source_db._decode_time(time_element.text)
+                    )
+    return element
+
+
+def _without_history(element):
+    element = deepcopy(element)
+    history = element.find("History")
+    if history is not None:
+        element.remove(history)
+    return element
+
+
+def _set_history(db, element, versions):
+    """
+    Replace an entry's history with versions (entry elements of the main database),
+    without duplicates and in order of modification time.  Returns whether the history
+    changed.
+    """
+    unique_versions = {}
+    for version in versions:
+        unique_versions.setdefault(_version_key(db, version), version)
+    history = element.find("History")
+    old_keys = []
+    if history is not None:
+        old_keys = [_version_key(db, version) for version in history]
+    new_keys = sorted(unique_versions, key=lambda key: key[0])
+    if new_keys == old_keys:
+        return False
+    if history is None:
+        history = element.makeelement("History")
+        element.append(history)
+    for version in list(history):
+        history.remove(version)
+    for key in new_keys:
+        history.append(unique_versions[key])
+    return True
+
+
+def merge_entries(connector, other_db):
+    """
+    Merge the entries of other_db (an opened PyKeePass copy) into the connector's
+    database, in memory.  Entries only in the copy are added to the group with the same
+    path (created if needed), unless they were deleted from the main database after they
+    were last modified.  Entries deleted from the copy, or only in its recycle bin, are
+    left alone.
+    Returns a KpMergeResult
+    """
+    db = connector.db
+    result = KpMergeResult()
+    main_entries = _entries_by_uuid(db)
+    deletion_times = _deletion_times(db)
+    other_entries = _entries_by_uuid(other_db, include_recycle_bin=False)
+    for entry_uuid, (other_entry, group_path) in other_entries.items():
+        if entry_uuid not in main_entries:
+            deleted_at = deletion_times.get(entry_uuid)
+            if deleted_at is not None and deleted_at >= _mtime(other_db, other_entry):
+                result.deleted += 1
+                continue
+            group = connector.find_or_add_group_path(group_path)
+            group._element.append(_copy_entry(other_entry, other_db, db))
+            result.added += 1
+            result.changed = True
+            continue
+
+        main_entry = main_entries[entry_uuid][0]
+        other_history = [
+            _copy_entry(version, other_db, db)
+            for version in other_entry.iterfind("History/Entry")
+        ]
+        main_history = list(main_entry.iterfind("History/Entry"))
+        if _strings(main_entry) == _strings(other_entry):
+            result.unchanged += 1
+            if _set_history(db, main_entry, main_history + other_history):
+                result.changed = True
+            continue
+
+        if _mtime(other_db, other_entry) > _mtime(db, main_entry):
+            # the copy's version replaces the main version, which goes into the history;
+            # the main version's attachments are kept
+            new_entry = _copy_entry(_without_history(other_entry), other_db, db)
+            for binary in main_entry.iterchildren("Binary"):
+                new_entry.append(deepcopy(binary))
+            versions = main_history + other_history + [_without_history(main_entry)]
+            main_entry.getparent().replace(main_entry, new_entry)
+            _set_history(db, new_entry, versions)
+            result.updated += 1
+        else:
+            versions = main_history + other_history
+            versions.append(_copy_entry(_without_history(other_entry), other_db, db))
+            _set_history(db, main_entry, versions)
+            result.kept += 1
+        result.changed = True
+    return result
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Write command results as JSON, NDJSON, TSV or CSV records, for piping to other programs
+or exporting to a file.
+"""
+
+# standards
+import csv
+import io
+import json
+
+# third parties
+import typer
+
+from kpcli.datastructures import FileFormat, OutputFormat
+
+
+# Number of records written at once
+DEFAULT_BATCH_SIZE = 1000
+
+
+def _tsv_value(value):
+    """Escape a value so it fits in a single TSV field"""
+    if value is None:
+        return ""
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def echo(text):
+    typer.echo(text, nl=False)
+
+
+class RecordWriter:
+    """
+    Writes records (dicts) as they are produced, in one of the machine readable output
+    formats:
+
+    - json: a single JSON array of objects
+    - ndjson: one JSON object per line
+    - tsv: a header line with the field names, then one line of tab separated values per
+      record, with tabs, newlines and backslashes escaped
+    - csv: a header line with the field names, then one CSV row per record
+
+    Only the given fields of each record are written.  Records are buffered and passed
+    to write (by default, written to stdout) batch_size at a time, so large outputs
+    aren't held in memory or flushed line by line.
+    """
+
+    def __init__(self, output_format, fields, batch_size=DEFAULT_BATCH_SIZE, write=echo):
+        self.output_format = str(output_format)
+        self.fields = fields
+        self.batch_size = batch_size
+        self.count = 0
+        self._batch = []
+        self._write = write
+        if self.output_format == FileFormat.csv:
+            self._csv_buffer = io.StringIO()
+            self._csv_writer = csv.writer(self._csv_buffer, lineterminator="")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _format_csv(self, values):
+        self._csv_buffer.seek(0)
+        self._csv_buffer.truncate()
+        self._csv_writer.writerow(values)
+        return self._csv_buffer.getvalue()
+
+    def _format(self, record):
+        if self.output_format == OutputFormat.tsv:
+            return "\t".join(_tsv_value(record.get(field)) for field in self.fields)
+        if self.output_format == FileFormat.csv:
+            return self._format_csv([record.get(field) for field in self.fields])
+        return json.dumps({field: record.get(field) for field in self.fields})
+
+    def _header(self):
+        if self.output_format == FileFormat.csv:
+            return self._format_csv(self.fields)
+        return "\t".join(self.fields)
+
+    def write(self, record):
+        if self.count == 0:
+            if self.output_format in (OutputFormat.tsv, FileFormat.csv):
+                self._batch.append(self._header())
+            elif self.output_format == OutputFormat.json:
+                self._batch.append("[")
+        elif self.output_format == OutputFormat.json:
+            # the previous object is always still in the batch (see `flush`)
+            self._batch[-1] += ","
+        self._batch.append(self._format(record))
+        self.count += 1
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def write_all(self, records):
+        for record in records:
+            self.write(record)
+
+    def flush(self, final=False):
+        """
+        Write the buffered records.  In JSON, the last record is held back until the next
+        one (or the end of the array) so that the comma between them can be added.
+        """
+        if final or self.output_format != OutputFormat.json:
+            held_back = []
+        else:
+            held_back = self._batch[-1:]
+        lines = self._batch[: len(self._batch) - len(held_back)]
+        if lines:
+            self._write("".join(f"{line}\n" for line in lines))
+        self._batch = held_back
+
+    def close(self):
+        """Write any buffered records, and the end of the JSON array"""
+        if self.output_format == OutputFormat.json:
+            self._batch.append("]" if self.count else "[]")
+        elif self.output_format in (OutputFormat.tsv, FileFormat.csv) and self.count == 0:
+            self._batch.append(self._header())
+        self.flush(final=True)
@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+"""
+Ranked, typo-tolerant search over the entries in a KeePassX database, and full-text
+search over their fields.
+"""
+
+# standards
+import bisect
+import heapq
+import math
+import re
+import shlex
+
+
+# Scores for matches against an entry's title, or its full name (<group path>/<title>),
+# which scores FULL_NAME_PENALTY less.  Anything else is a fuzzy match, scored between 0
+# and FUZZY_MATCH by how similar the query's words are to the entry's words.
+EXACT_MATCH = 4
+PREFIX_MATCH = 3
+WORD_MATCH = 2
+SUBSTRING_MATCH = 1
+FUZZY_MATCH = 0.5
+FULL_NAME_PENALTY = 0.5
+
+# Words are similar if they share at least this fraction of the query word's trigrams...
+MIN_SHARED_TRIGRAMS = 1 / 3
+# ...and fuzzy matches must have at least this average similarity over the query's words
+MIN_SIMILARITY = 0.3
+# Only the most similar words to each query word are looked up
+MAX_SIMILAR_WORDS = 20
+
+
+_WORD = re.compile(r"\w+")
+
+
+def words(text):
+    return _WORD.findall((text or "").casefold())
+
+
+def trigrams(word):
+    """
+    The set of three character sequences in a word, padded so that short words and the
+    start of the word have trigrams too
+    """
+    padded = f"  {word} "
+    return frozenset(padded[i : i + 3] for i in range(len(padded) - 2))
+
+
+def similarity(query_trigrams, word_trigrams):
+    """
+    The Dice coefficient of two words' trigrams (1 for the same word), or 0 if they
+    share too few of the query word's trigrams to be similar
+    """
+    shared = len(query_trigrams & word_trigrams)
+    if shared < math.ceil(MIN_SHARED_TRIGRAMS * len(query_trigrams)):
+        return 0
+    return 2 * shared / (len(query_trigrams) + len(word_trigrams))
+
+
+def _text_score(query, text):
+    if query == text:
+        return EXACT_MATCH
+    if text.startswith(query):
+        return PREFIX_MATCH
+    if any(word.startswith(query) for word in words(text)):
+        return WORD_MATCH
+    if query in text:
+        return SUBSTRING_MATCH
+    return 0
+
+
+def match_score(query, title, full_name):
+    """
+    Score how well an entry's title and full name match query (all case-folded);
+    0 if query isn't found in either
+    """
+    full_name_score = _text_score(query, full_name)
+    return max(
+        _text_score(query, title),
+        full_name_score - FULL_NAME_PENALTY if full_name_score else 0,
+    )
+
+
+class KpSearchIndex:
+    """
+    An index of the words in the group path, title, username and URL of each entry, with
+    a trigram index of the distinct words so that words with typos can be matched.
+    """
+
+    fields = ("title", "username", "url")
+
+    def __init__(self):
+        # entries are numbered, as ints are quicker to hash than uuids
+        self._ids = {}
+        self._next_id = 0
+        # entry id: (entry, case-folded title, case-folded full name, words)
+        self.entries = {}
+        # word: {entry id}
+        self.word_entries = {}
+        # word: trigrams
+        self.word_trigrams = {}
+        # trigram: {word}
+        self.trigram_words = {}
+
+    def add(self, entry, group_path):
+        """Index an entry, with the path of the group it's in"""
+        title = (entry.title or "").casefold()
+        full_name = f"{group_path}/{title}".casefold() if group_path else title
+        entry_words = set(words(group_path))
+        for field in self.fields:
+            entry_words.update(words(getattr(entry, field)))
+        entry_id = self._next_id
+        self._next_id += 1
+        self._ids[entry.uuid] = entry_id
+        self.entries[entry_id] = (entry, title, full_name, entry_words)
+        for word in entry_words:
+            if word not in self.word_entries:
+                self.word_entries[word] = set()
+                self.word_trigrams[word] = trigrams(word)
+                for trigram in self.word_trigrams[word]:
+                    self.trigram_words.setdefault(trigram, set()).add(word)
+            self.word_entries[word].add(entry_id)
+
+    def remove(self, entry):
+        """Remove an entry from the index"""
+        entry_id = self._ids.pop(entry.uuid)
+        _, _, _, entry_words = self.entries.pop(entry_id)
+        for word in entry_words:
+            entry_ids = self.word_entries[word]
+            entry_ids.discard(entry_id)
+            if entry_ids:
+                continue
+            del self.word_entries[word]
+            for trigram in self.word_trigrams.pop(word):
+                trigram_words = self.trigram_words[trigram]
+                trigram_words.discard(word)
+                if not trigram_words:
+                    del self.trigram_words[trigram]
+
+    def similar_words(self, query_word):
+        """
+        Find the indexed words most similar to query_word, as {word: similarity}, where
+        similarity is the Dice coefficient of their trigrams (1 for the same word)
+        """
+        query_trigrams = trigrams(query_word)
+        min_shared = math.ceil(MIN_SHARED_TRIGRAMS * len(query_trigrams))
+        # A word sharing min_shared trigrams must have one of the rarest
+        # len - min_shared + 1 trigrams, so only words with those need to be checked
+        rarest_trigrams = sorted(
+            query_trigrams, key=lambda trigram: len(self.trigram_words.get(trigram, ()))
+        )[: len(query_trigrams) - min_shared + 1]
+        candidates = set()
+        for trigram in rarest_trigrams:
+            candidates.update(self.trigram_words.get(trigram, ()))
+        similar = []
+        for word in candidates:
+            word_similarity = similarity(query_trigrams, self.word_trigrams[word])
+            if word_similarity:
+                similar.append((word_similarity, word))
+        return {word: word_similarity for word_similarity, word in heapq.nlargest(MAX_SIMILAR_WORDS, similar)}
+
+    def score(self, query, entry):
+        """Score an indexed entry against a query"""
+        _, title, full_name, entry_words = self.entries[self._ids[entry.uuid]]
+        query = query.casefold()
+        score = match_score(query, title, full_name)
+        if score:
+            return score
+        query_words = words(query)
+        if not query_words or not entry_words:
+            return 0
+        total_similarity = 0
+        for query_word in query_words:
+            query_trigrams = trigrams(query_word)
+            total_similarity += max(
+                similarity(query_trigrams, self.word_trigrams[word]) for word in entry_words
+            )
+        return FUZZY_MATCH * total_similarity / len(query_words)
+
+    def search(self, query, limit=10):
+        """
+        Find entries that match query exactly, partially, or with typos.  Returns a list of
+        up to `limit` (score, entry) with the best matches first.
+        """
+        query = query.casefold()
+        query_words = words(query)
+        if not query_words:
+            return []
+        # entry id: total of the best similarity of each query word to the entry's words
+        similarities = {}
+        for query_word in query_words:
+            best = {}
+            for word, word_similarity in self.similar_words(query_word).items():
+                for entry_id in self.word_entries[word]:
+                    if word_similarity > best.get(entry_id, 0):
+                        best[entry_id] = word_similarity
+            for entry_id, word_similarity in best.items():
+                similarities[entry_id] = similarities.get(entry_id, 0) + word_similarity
+
+        min_total = MIN_SIMILARITY * len(query_words)
+        # entries with the same words are tied, so the most similar are scored, then sorted
+        # by the substring match score too
+        most_similar = heapq.nlargest(
+            limit,
+            (item for item in similarities.items() if item[1] >= min_total),
+            key=lambda item: item[1],
+        )
+        results = []
+        for entry_id, total_similarity in most_similar:
+            entry, title, full_name, _ = self.entries[entry_id]
+            score = match_score(query, title, full_name) or (
+                FUZZY_MATCH * total_similarity / len(query_words)
+            )
+            results.append((score, full_name, entry))
+        results.sort(key=lambda result: (-result[0], result[1]))
+        return [(score, entry) for score, _, entry in results]
+
+
+# The standard string fields of an entry, by their names in the database
+STANDARD_FIELDS = {
+    "Title": "title",
+    "UserName": "username",
+    "Password": "password",
+    "URL": "url",
+    "Notes": "notes",
+}
+# Query keywords combining terms; terms next to each other must all match
+AND = "AND"
+OR = "OR"
+
+
+def entry_strings(entry, protected=False):
+    """
+    Yield (field, value) for each of an entry's string fields, including custom fields,
+    apart from its password and protected custom fields unless protected is True.
+    Standard fields are named as the entry's attributes, e.g. "username" rather than
+    "UserName".
+    """
+    # read the String elements directly, rather than with an XPath query per field
+    for string in entry._element.iterchildren("String"):
+        # each String holds a Key and a Value element
+        if len(string) != 2:
+            continue
+        key, value = string[0].text, string[1]
+        if not value.text:
+            continue
+        field = STANDARD_FIELDS.get(key)
+        if field is None:
+            if protected or value.get("Protected") != "True":
+                yield key, value.text
+        # pykeepass marks the standard fields it sets as protected, so that's ignored
+        elif protected or field != "password":
+            yield field, value.text
+
+
+def parse_query(query):
+    """
+    Parse a full-text query, a string or a list of terms, into a list of alternatives,
+    each a list of (field, text) terms that must all match.  Terms are ANDed, unless
+    separated by OR.  A term written as field:text only matches in that field; field is
+    None for other terms.
+
+    e.g. 'url:example.com OR notes:"example host" admin' is
+    [[("url", "example.com")], [("notes", "example host"), (None, "admin")]]
+    """
+    if isinstance(query, str):
+        query = shlex.split(query)
+    alternatives = [[]]
+    for term in query:
+        if term == OR:
+            alternatives.append([])
+        elif term != AND:
+            field, separator, text = term.partition(":")
+            # not a field name if it's the scheme of a URL, e.g. https://
+            if separator and field and text and not text.startswith("//"):
+                alternatives[-1].append((field.casefold(), text))
+            else:
+                alternatives[-1].append((None, term))
+    return [terms for terms in alternatives if terms]
+
+
+class KpTextIndex:
+    """
+    An inverted index of the words in each entry's group path and unprotected string
+    fields (title, username, URL, notes and custom fields), for full-text queries.
+
+    Query words match words in the entries that they are a prefix of, so "admin" matches
+    "admin@example.com" and "exam" matches "example.com".
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self._next_id = 0
+        # entry id: (entry, {field: (field name, words)}), in the order entries were added
+        self.entries = {}
+        # (field, word): {entry id}
+        self.postings = {}
+        # field: sorted words, to find the words a query word is a prefix of
+        self.vocabulary = {}
+
+    def add(self, entry, group_path):
+        """Index an entry, with the path of the group it's in"""
+        fields = {}
+        for name, value in [("group", group_path), *entry_strings(entry)]:
+            field_words = set(words(value))
+            if field_words:
+                fields[name.casefold()] = (name, field_words)
+        entry_id = self._next_id
+        self._next_id += 1
+        self._ids[entry.uuid] = entry_id
+        self.entries[entry_id] = (entry, fields)
+        for field, (_, field_words) in fields.items():
+            for word in field_words:
+                entry_ids = self.postings.get((field, word))
+                if entry_ids is None:
+                    self.postings[field, word] = {entry_id}
+                    bisect.insort(self.vocabulary.setdefault(field, []), word)
+                else:
+                    entry_ids.add(entry_id)
+
+    def remove(self, entry):
+        """Remove an entry from the index"""
+        entry_id = self._ids.pop(entry.uuid)
+        _, fields = self.entries.pop(entry_id)
+        for field, (_, field_words) in fields.items():
+            for word in field_words:
+                entry_ids = self.postings[field, word]
+                entry_ids.discard(entry_id)
+                if entry_ids:
+                    continue
+                del self.postings[field, word]
+                vocabulary = self.vocabulary[field]
+                del vocabulary[bisect.bisect_left(vocabulary, word)]
+                if not vocabulary:
+                    del self.vocabulary[field]
+
+    def _prefix_ids(self, field, query_word):
+        """Ids of the entries with a word in field that query_word is a prefix of"""
+        vocabulary = self.vocabulary.get(field, [])
+        entry_ids = set()
+        for i in range(bisect.bisect_left(vocabulary, query_word), len(vocabulary)):
+            if not vocabulary[i].startswith(query_word):
+                break
+            entry_ids |= self.postings[field, vocabulary[i]]
+        return entry_ids
+
+    def _term_ids(self, field, text):
+        """Ids of the entries with all the words of a term in a single field"""
+        query_words = words(text)
+        fields = list(self.vocabulary) if field is None else [field]
+        entry_ids = set()
+        for field in fields:
+            field_ids = None
+            for query_word in query_words:
+                word_ids = self._prefix_ids(field, query_word)
+                field_ids = word_ids if field_ids is None else field_ids & word_ids
+                if not field_ids:
+                    break
+            entry_ids |= field_ids or set()
+        return entry_ids
+
+    @staticmethod
+    def _term_fields(fields, field, text):
+        """Names of the fields of an entry that a term matches"""
+        query_words = words(text)
+        return [
+            name
+            for key, (name, field_words) in fields.items()
+            if (field is None or key == field)
+            and query_words
+            and all(
+                any(word.startswith(query_word) for word in field_words)
+                for query_word in query_words
+            )
+        ]
+
+    def search(self, query):
+        """
+        Find entries matching a query (see `parse_query`), yielding (entry, names of the
+        matched fields) for each in turn, in the order the entries were indexed
+        """
+        alternatives = parse_query(query)
+        matching_ids = set()
+        for terms in alternatives:
+            alternative_ids = self._term_ids(*terms[0])
+            for field, text in terms[1:]:
+                if not alternative_ids:
+                    break
+                alternative_ids &= self._term_ids(field, text)
+            matching_ids |= alternative_ids
+        if not matching_ids:
+            return
+        # walk the entries in order instead of sorting the matches, so the first results
+        # are yielded straight away
+        for entry_id, (entry, fields) in self.entries.items():
+            if entry_id not in matching_ids:
+                continue
+            matched_fields = []
+            for terms in alternatives:
+                term_fields = [
+                    self._term_fields(fields, field, text) for field, text in terms
+                ]
+                if not all(term_fields):
+                    continue
+                for names in term_fields:
+                    matched_fields.extend(
+                        name for name in names if name not in matched_fields
+                    )
+            yield entry, matched_fields
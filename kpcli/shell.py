@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+An interactive shell that runs kpcli commands against a single unlocked database.
+"""
+
+# standards
+import cmd
+import shlex
+
+# third parties
+import click
+import typer
+
+from kpcli import clipboard
+
+
+# Commands that can't run inside the shell or a batch; compact and merge write the
+# database file straight away, so they can't be deferred with the other changes
+EXCLUDED_COMMANDS = ("agent", "batch", "compact", "compare", "merge", "shell")
+
+
+def run_command(group_ctx, obj, name, args):
+    """
+    Run a kpcli command with the context object of an already unlocked database,
+    returning its exit code
+    """
+    command = group_ctx.command.get_command(group_ctx, name)
+    if command is None or name in EXCLUDED_COMMANDS:
+        typer.echo(f"Unknown command: {name}")
+        return 1
+    # the selected group is set by each command
+    obj["obj"].group = None
+    try:
+        return command.main(args, prog_name=name, standalone_mode=False, obj=obj)
+    except click.ClickException as e:
+        e.show()
+        return e.exit_code
+    except click.Abort:
+        typer.secho("Aborted", fg=typer.colors.RED)
+        return 1
+
+
+class KpShell(cmd.Cmd):
+    """
+    Runs kpcli commands with the database connector already on the context object.
+    Saves are deferred while the shell runs, and written on `save` or when the shell
+    exits.
+    """
+
+    intro = "kpcli shell: type help for a list of commands, exit to save and quit"
+
+    def __init__(self, group_ctx, obj, **kwargs):
+        super().__init__(**kwargs)
+        # the context of the kpcli app, used to look up commands
+        self.group_ctx = group_ctx
+        self.obj = obj
+        self._entry_names = None
+
+    @property
+    def connector(self):
+        return self.obj["obj"].connector
+
+    @property
+    def prompt(self):
+        changed = "*" if self.connector.unsaved_changes else ""
+        return f"kpcli{changed}> "
+
+    @property
+    def command_names(self):
+        return sorted(
+            name
+            for name in self.group_ctx.command.list_commands(self.group_ctx)
+            if name not in EXCLUDED_COMMANDS
+        )
+
+    def entry_names(self):
+        """Entry titles and group path/titles, cached until the next command runs"""
+        if self._entry_names is None:
+            names = set()
+            for group_path, entry_titles in self.connector.iter_group_entries():
+                for title in entry_titles:
+                    names.add(title)
+                    names.add(f"{group_path}/{title}")
+            self._entry_names = sorted(names, key=str.casefold)
+        return self._entry_names
+
+    def default(self, line):
+        try:
+            name, *args = shlex.split(line)
+        except ValueError as e:
+            typer.secho(str(e), fg=typer.colors.RED)
+            return
+        try:
+            run_command(self.group_ctx, self.obj, name, args)
+        except (AttributeError, ValueError) as e:
+            # e.g. editing a field that doesn't exist; the shell keeps running
+            typer.secho(str(e), fg=typer.colors.RED)
+
+    def postcmd(self, stop, line):
+        # the command may have changed the entries
+        self._entry_names = None
+        return stop
+
+    def emptyline(self):
+        pass
+
+    def completenames(self, text, *ignored):
+        return [
+            name
+            for name in [*self.command_names, "exit", "help", "save"]
+            if name.startswith(text)
+        ]
+
+    def completedefault(self, text, line, begidx, endidx):
+        # Complete the whole argument after the command, as entry names may contain spaces
+        _, _, argument = line[:endidx].partition(" ")
+        argument = argument.lstrip().lstrip("\"'")
+        prefix_length = len(argument) - len(text)
+        return [
+            name[prefix_length:]
+            for name in self.entry_names()
+            if name.casefold().startswith(argument.casefold())
+        ]
+
+    def do_help(self, arg):
+        """List commands, or show help for a command"""
+        if arg:
+            run_command(self.group_ctx, self.obj, arg, ["--help"])
+            return
+        for name in self.command_names:
+            command = self.group_ctx.command.get_command(self.group_ctx, name)
+            typer.echo(f"  {name:<16}{command.get_short_help_str()}")
+        typer.echo(f"  {'save':<16}Save changes")
+        typer.echo(f"  {'exit':<16}Save changes and exit")
+
+    def do_save(self, arg):
+        """Save changes"""
+        if self.connector.unsaved_changes:
+            self.connector.flush()
+            typer.secho("Saved", fg=typer.colors.GREEN)
+        else:
+            typer.echo("No changes to save")
+
+    def do_exit(self, arg):
+        """Save changes and exit"""
+        return True
+
+    do_quit = do_exit
+
+    def do_EOF(self, arg):
+        typer.echo()
+        return True
+
+
+def run_shell(group_ctx, obj):
+    """Run the shell until the user exits, saving changes once at the end"""
+    shell = KpShell(group_ctx, obj)
+    try:
+        # readline is used for tab completion where it's available
+        import readline
+
+        # complete entry names containing "/" and "-"
+        readline.set_completer_delims(" \t\n\"'")
+    except ImportError:
+        pass
+    # passwords copied in the shell are cleared by timers, or when it exits
+    clipboard.run_timers_in_process()
+    with shell.connector.deferred_save():
+        try:
+            shell.cmdloop()
+        except KeyboardInterrupt:
+            typer.echo()
+        except Exception:
+            # keep the session's changes before the error is reported
+            shell.connector.flush()
+            raise
+        finally:
+            clipboard.clear_pending()
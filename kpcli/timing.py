@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Time the phases of a command, for the --timings option and the KPCLI_TRACE environment
+variable.
+
+Phases nest, e.g. setup_db/open/kdf, and repeated phases are added together.  Timing is
+off unless `start` is called, and `phase` then costs a single check.  `start` also wraps
+the connector's methods and pykeepass's key derivation, decompression and XML parsing in
+phases, so that they don't need to be timed explicitly.
+"""
+
+# standards
+from contextlib import contextmanager
+from datetime import datetime
+import functools
+import inspect
+import json
+import time
+
+# third parties
+import typer
+
+
+_recorder = None
+
+
+class PhaseRecorder:
+    """
+    Records the total time and number of calls of each phase, by its path of enclosing
+    phases, in the order they first start
+    """
+
+    def __init__(self, command, output_file=None):
+        self.command = command
+        self.output_file = output_file
+        self.phases = {}
+        self._path = ()
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name, path=None):
+        """Time a phase, nested in the current one (or at path, if given)"""
+        outer_path = self._path
+        self._path = (path or outer_path) + (name,)
+        record = self.phases.setdefault(self._path, [0.0, 0])
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record[0] += time.perf_counter() - start
+            record[1] += 1
+            self._path = outer_path
+
+    def timed_generator(self, name, generator):
+        """
+        Time a generator's iteration as a phase, leaving out the time spent by the caller
+        between items
+        """
+        path = self._path
+        while True:
+            with self.phase(name, path):
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    return
+            yield item
+
+    def total(self):
+        return time.perf_counter() - self._start
+
+    def report(self):
+        """Write the timings to stderr, or append them to the output file as a JSON line"""
+        if self.output_file is not None:
+            record = {
+                "command": self.command,
+                "time": datetime.now().isoformat(),
+                "total": self.total(),
+                "phases": [
+                    {"phase": "/".join(path), "seconds": seconds, "calls": calls}
+                    for path, (seconds, calls) in self.phases.items()
+                ],
+            }
+            with open(self.output_file, "a") as outfile:
+                outfile.write(json.dumps(record) + "\n")
+            return
+        lines = [f"Timings for {self.command}:"]
+        for path, (seconds, calls) in self.phases.items():
+            name = "  " * len(path) + path[-1]
+            lines.append(
+                f"{name:<48}{seconds * 1000:>10.1f} ms" + (f"  x{calls}" if calls > 1 else "")
+            )
+        total = self.total()
+        # the rest of the time is the command itself, e.g. rendering its output
+        rest = total - sum(
+            seconds for path, (seconds, _) in self.phases.items() if len(path) == 1
+        )
+        lines.append(f"{'  (rest of command)':<48}{rest * 1000:>10.1f} ms")
+        lines.append(f"{'  total':<48}{total * 1000:>10.1f} ms")
+        typer.echo("\n".join(lines), err=True)
+
+
+def start(command, output_file=None):
+    """Start timing a command's phases, reported by `report`"""
+    global _recorder
+    _recorder = PhaseRecorder(command, output_file)
+    with phase("import"):
+        _instrument()
+
+
+def report():
+    """Report the timings of the command, and stop timing"""
+    global _recorder
+    if _recorder is not None:
+        _recorder.report()
+        _recorder = None
+
+
+@contextmanager
+def phase(name):
+    """Time the block as a phase of the command, if timing is on"""
+    if _recorder is None:
+        yield
+        return
+    with _recorder.phase(name):
+        yield
+
+
+def timed_iteration(name, iterable):
+    """Time the iteration of iterable as a phase, if timing is on"""
+    if _recorder is None:
+        return iterable
+    return _recorder.timed_generator(name, iter(iterable))
+
+
+def timed(function, name=None):
+    """
+    Wrap a function so that its calls are timed as a phase, including the iteration of a
+    generator it returns
+    """
+    name = name or function.__name__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if _recorder is None:
+            return function(*args, **kwargs)
+        with _recorder.phase(name):
+            result = function(*args, **kwargs)
+        if inspect.isgenerator(result):
+            return _recorder.timed_generator(name, result)
+        return result
+
+    wrapper.timed = True
+    return wrapper
+
+
+def _wrap(owner, attribute, name=None):
+    """Replace a function of a class or module with a timed one, once"""
+    function = getattr(owner, attribute)
+    if not getattr(function, "timed", False):
+        setattr(owner, attribute, timed(function, name or attribute))
+
+
+def _instrument():
+    """Wrap the connector, config and pykeepass functions that commands spend time in"""
+    # imported here, so that they're only imported if timing is on
+    import argon2.low_level
+    from pykeepass.kdbx_parsing import common, kdbx3, kdbx4
+
+    from kpcli import utils
+    from kpcli.connector import KpDatabaseConnector
+    from kpcli.datastructures import Encrypter
+
+    _wrap(KpDatabaseConnector, "__init__", "open")
+    for name, value in list(vars(KpDatabaseConnector).items()):
+        if inspect.isfunction(value) and not name.startswith("_"):
+            _wrap(KpDatabaseConnector, name)
+    _wrap(Encrypter, "get_password")
+    _wrap(Encrypter, "get_transformed_key")
+    _wrap(utils, "get_config_from_file", "read_config")
+    _wrap(kdbx3, "aes_kdf", "kdf")
+    _wrap(kdbx4, "aes_kdf", "kdf")
+    _wrap(argon2.low_level, "hash_secret_raw", "kdf")
+    _wrap(common.Decompressed, "_decode", "decompress")
+    _wrap(common.XML, "_decode", "xml_parse")
@@ -31,12 +31,16 @@ def get_config_from_file(profile="default"):
             return config[profile]
 
 
-def get_config(profile="default"):
+def get_config(profile="default", err=False, config_from_file=None):
     """
     Find database config from a config.ini file or relevant environment variables
     returns a KPConfig instance
+    Messages are written to stderr if err is True
+    config_from_file is the profile's config (see `get_config_from_file`), if it has
+    already been read
     """
-    config_from_file = get_config_from_file(profile) or {}
+    if config_from_file is None:
+        config_from_file = get_config_from_file(profile) or {}
     db_path = environ.get("KEEPASSDB") or config_from_file.get("KEEPASSDB")
     password = environ.get("KEEPASSDB_PASSWORD") or config_from_file.get(
         "KEEPASSDB_PASSWORD"
@@ -69,12 +73,17 @@ def get_config(profile="default"):
             encrypter.reset()
         else:
             db_config.password = encrypter.get_password()
-    typer.secho(f"Database: {db_config.filename}", fg=typer.colors.YELLOW)
+            if db_config.password is not None:
+                db_config.transformed_key = encrypter.get_transformed_key(
+                    db_config.filename
+                )
+    typer.secho(f"Database: {db_config.filename}", fg=typer.colors.YELLOW, err=err)
     return db_config, store_encrypted_password
 
 
-def get_timeout(profile="default"):
-    config_from_file = get_config_from_file(profile) or {}
+def get_timeout(profile="default", err=False, config_from_file=None):
+    if config_from_file is None:
+        config_from_file = get_config_from_file(profile) or {}
 
     try:
         return int(
@@ -86,19 +95,65 @@ def get_timeout(profile="default"):
             "Invalid timeout found, defaulting to 5 seconds",
             fg=typer.colors.RED,
             bold=True,
+            err=err,
         )
         return 5
 
 
-def echo_banner(message: str, **style_options):
-    """Helper function to print a banner style message"""
-    banner = "=" * 80
-    typer.secho(f"{banner}\n{message}\n{banner}", **style_options)
+def get_compression_level(profile="default", err=False, config_from_file=None):
+    """Zlib compression level (0-9) to save the database with, or None for the default"""
+    if config_from_file is None:
+        config_from_file = get_config_from_file(profile) or {}
+    compression_level = environ.get("KEEPASSDB_COMPRESSION_LEVEL") or config_from_file.get(
+        "KEEPASSDB_COMPRESSION_LEVEL"
+    )
+    if compression_level is None:
+        return None
+    try:
+        compression_level = int(compression_level)
+    except ValueError:
+        compression_level = None
+    if compression_level is None or not 0 <= compression_level <= 9:
+        typer.secho(
+            "Invalid compression level found, using the default",
+            fg=typer.colors.RED,
+            bold=True,
+            err=err,
+        )
+        return None
+    return compression_level
+
 
+def get_journal_config(profile="default", err=False, config_from_file=None):
+    """
+    Whether to save changes to a journal instead of rewriting the database, and the
+    journal size in bytes at which it is compacted into the database
+    """
+    from kpcli.journal import DEFAULT_JOURNAL_MAX_SIZE
 
-class InputTimedOut(Exception):
-    pass
+    if config_from_file is None:
+        config_from_file = get_config_from_file(profile) or {}
+    journal = environ.get(
+        "KEEPASSDB_JOURNAL", config_from_file.get("KEEPASSDB_JOURNAL", False)
+    )
+    journal = str(journal).lower() in ["true", "1"]
+    try:
+        journal_max_size = int(
+            environ.get("KEEPASSDB_JOURNAL_MAX_SIZE")
+            or config_from_file.get("KEEPASSDB_JOURNAL_MAX_SIZE", DEFAULT_JOURNAL_MAX_SIZE)
+        )
+    except ValueError:
+        typer.secho(
+            "Invalid journal size found, using the default",
+            fg=typer.colors.RED,
+            bold=True,
+            err=err,
+        )
+        journal_max_size = DEFAULT_JOURNAL_MAX_SIZE
+    return journal, journal_max_size
 
 
-def inputTimeOutHandler(signum, frame):
-    raise InputTimedOut
+def echo_banner(message: str, **style_options):
+    """Helper function to print a banner style message"""
+    banner = "=" * 80
+    typer.secho(f"{banner}\n{message}\n{banner}", **style_options)
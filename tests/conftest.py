@@ -14,6 +14,9 @@ def temp_db_path():
     shutil.copy(test_db, temp_db)
     yield temp_db
     temp_db.unlink()
+    # journal files
+    for sidecar_file in temp_db.parent.glob(f"{temp_db.name}.*"):
+        sidecar_file.unlink()
 
 
 @pytest.fixture
@@ -24,6 +27,21 @@ def test_db_path():
     yield named_test_db_path
 
 
+@pytest.fixture
+def comparison_dir(tmp_path, test_db_path):
+    shutil.copy(test_db_path("test_compare"), tmp_path / "test_compare.kdbx")
+    for copy_name in ["conflicting", "conflicting_2", "conflicting_3"]:
+        shutil.copy(
+            test_db_path("test_compare_conflicting"),
+            tmp_path / f"test_compare_{copy_name}.kdbx",
+        )
+    # a database with the same stem that can't be opened with the same credentials
+    shutil.copy(
+        test_db_path("test_db_with_keyfile"), tmp_path / "test_compare_locked.kdbx"
+    )
+    yield tmp_path
+
+
 @pytest.fixture
 def mock_config_file():
     # HOME is set to the fixtures file in tests
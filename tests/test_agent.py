@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+from os import environ
+from pathlib import Path
+import socket
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+from typer.testing import CliRunner
+
+from kpcli.agent import (
+    AgentConnector,
+    AgentEntry,
+    KpAgentServer,
+    agent_socket_path,
+    get_agent_connector,
+)
+from kpcli.cli import app
+from kpcli.connector import KpDatabaseConnector
+from kpcli.datastructures import KpConfig
+
+from .conftest import GROUP_ENTRY_NAMES
+from .test_cli import get_env_vars
+
+runner = CliRunner()
+
+
+@pytest.fixture
+def agent_home():
+    # HOME is set to the fixtures directory in cli tests
+    kp_dir = Path(__file__).parent / "fixtures/.kp"
+    kp_dir.mkdir(exist_ok=True)
+    yield kp_dir
+    if not any(kp_dir.iterdir()):
+        kp_dir.rmdir()
+
+
+@pytest.fixture
+def running_agent(agent_home):
+    def start_agent(db_path, profile="default"):
+        connector = KpDatabaseConnector(KpConfig(filename=db_path, password="test"))
+        with patch.dict(environ, {"HOME": str(agent_home.parent)}):
+            socket_path = agent_socket_path(profile)
+        server = KpAgentServer(connector, socket_path, ttl=10)
+        thread = threading.Thread(target=server.serve, daemon=True)
+        thread.start()
+        # the socket file is created before the agent listens on it
+        while not server.running:
+            time.sleep(0.01)
+        servers.append((server, thread))
+        return AgentConnector(socket_path)
+
+    servers = []
+    yield start_agent
+    for server, thread in servers:
+        # an agent that has been asked to stop may still be shutting down
+        if server.running:
+            AgentConnector(server.socket_path).stop()
+        thread.join()
+
+
+def test_agent_list_groups(running_agent, test_db_path):
+    agent = running_agent(test_db_path("test_db"))
+    assert agent.list_group_names() == ["MyGroup", "Root", "Test"]
+    assert agent.list_group_entries("mygroup") == GROUP_ENTRY_NAMES
+
+
+def test_agent_find_entries(running_agent, test_db_path):
+    agent = running_agent(test_db_path("test_db"))
+    entries = agent.find_entries("gmail")
+    assert len(entries) == 1
+    assert isinstance(entries[0], AgentEntry)
+    assert entries[0].group.name == "MyGroup"
+    assert agent.get_details(entries[0], show_password=True)["password"] == "testpass"
+
+
+def test_agent_find_entries_with_group(running_agent, test_db_path):
+    agent = running_agent(test_db_path("test_db"))
+    group = agent.find_group("root")
+    assert agent.find_entries("gmail", group) == []
+
+
+def test_agent_edit_entry(running_agent, temp_db_path):
+    agent = running_agent(temp_db_path)
+    entry = agent.find_entries("gmail")[0]
+    agent.edit_entry(entry, "url", "foo.com")
+    assert entry.url == "foo.com"
+    # the change is saved to the database file
+    connector = KpDatabaseConnector(KpConfig(filename=temp_db_path, password="test"))
+    assert connector.find_entries("gmail")[0].url == "foo.com"
+
+
+def test_agent_edit_entry_invalid_field(running_agent, test_db_path):
+    agent = running_agent(test_db_path("test_db"))
+    entry = agent.find_entries("gmail")[0]
+    with pytest.raises(AttributeError):
+        agent.edit_entry(entry, "unknown", "foo")
+
+
+def test_agent_copies_and_clears_clipboard(running_agent, test_db_path):
+    copied = []
+    backend = (copied.append, lambda: copied[-1])
+    with patch("kpcli.clipboard._backend", backend), patch(
+        "kpcli.clipboard._clear_in_helper"
+    ) as mock_helper:
+        agent = running_agent(test_db_path("test_db"))
+        entry = agent.find_entries("gmail")[0]
+        agent.copy_to_clipboard(entry, "password", clear_after=60)
+        assert copied == ["testpass"]
+        # the agent clears the clipboard from a timer, and when it exits
+        agent.stop()
+        for _ in range(100):
+            if copied[-1] == "":
+                break
+            time.sleep(0.01)
+    mock_helper.assert_not_called()
+    assert copied == ["testpass", ""]
+
+
+def test_agent_reloads_changed_database(running_agent, temp_db_path):
+    agent = running_agent(temp_db_path)
+    assert agent.find_entries("new entry") == []
+    connector = KpDatabaseConnector(KpConfig(filename=temp_db_path, password="test"))
+    connector.add_new_entry(connector.find_group("root"), "new entry", "u", "p", "", "")
+    assert len(agent.find_entries("new entry")) == 1
+
+
+@patch("kpcli.agent.CONNECTION_TIMEOUT", 0.1)
+def test_agent_drops_stalled_connection(running_agent, test_db_path):
+    agent = running_agent(test_db_path("test_db"))
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stalled_client:
+        # connects, but never sends a request
+        stalled_client.connect(str(agent.socket_path))
+        assert agent.list_group_names() == ["MyGroup", "Root", "Test"]
+
+
+def test_get_agent_connector_other_database(running_agent, test_db_path, agent_home):
+    running_agent(test_db_path("test_db"))
+    with patch.dict(environ, {"HOME": str(agent_home.parent)}), patch.object(
+        AgentConnector, "ping", autospec=True, side_effect=AgentConnector.ping
+    ) as mock_ping:
+        assert get_agent_connector(KpConfig(filename=test_db_path("test_db"))) is not None
+        # the agent is only pinged once
+        mock_ping.assert_called_once()
+        assert get_agent_connector(KpConfig(filename=test_db_path("test_db1"))) is None
+
+
+@patch.dict(environ, get_env_vars("test_db", password="wrong"))
+def test_cli_uses_running_agent(running_agent, test_db_path):
+    # the agent holds the unlocked database, so the wrong password isn't used
+    running_agent(test_db_path("test_db"))
+    result = runner.invoke(app, ["get", "gmail"])
+    assert result.exit_code == 0
+    assert "UNLOCKING" not in result.stdout
+    assert "MyGroup/gmail" in result.stdout
+
+
+@patch.dict(environ, get_env_vars("test_db"))
+def test_cli_agent_status(running_agent, test_db_path, agent_home):
+    result = runner.invoke(app, ["agent", "status"])
+    assert result.exit_code == 1
+    assert "No agent running" in result.stdout
+
+    running_agent(test_db_path("test_db"))
+    result = runner.invoke(app, ["agent", "status"])
+    assert result.exit_code == 0
+    assert str(test_db_path("test_db")) in result.stdout
+
+    result = runner.invoke(app, ["agent", "stop"])
+    assert result.exit_code == 0
+    assert "Agent stopped" in result.stdout
+
+
+def test_agent_iter_group_entries(running_agent, test_db_path):
+    agent = running_agent(test_db_path("test_db"))
+    group = agent.find_group("mygroup")
+    assert agent.iter_group_entries(group) == [["MyGroup", GROUP_ENTRY_NAMES]]
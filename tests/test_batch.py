@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+from os import environ
+from unittest.mock import patch
+
+import pytest
+from typer.testing import CliRunner
+
+from kpcli.batch import BatchError, parse_script
+from kpcli.cli import app
+from kpcli.connector import KpDatabaseConnector
+from kpcli.datastructures import KpConfig
+from kpcli.kdbx import save_database
+
+from .test_cli import get_env_vars
+
+runner = CliRunner()
+
+
+def add_command(title, group="mygroup"):
+    return (
+        f"add --group {group} --title '{title}' --username u --password p --url '' --notes ''"
+    )
+
+
+def test_parse_script():
+    script = ["# a comment", "", "get 'my entry'  # trailing comment", "ls -e"]
+    assert parse_script(script) == [(3, "get", ["my entry"]), (4, "ls", ["-e"])]
+    with pytest.raises(BatchError, match="Line 1"):
+        parse_script(["get 'unclosed"])
+
+
+@patch.dict(environ, get_env_vars("temp_db"))
+def test_batch_saves_once(temp_db_path):
+    script = [add_command(f"account {i}") for i in range(5)]
+    script.append("edit gmail --field url --value foo.com")
+    with patch("kpcli.connector.save_database", wraps=save_database) as mock_save:
+        result = runner.invoke(app, ["batch", "-"], input="\n".join(script))
+    assert result.exit_code == 0
+    assert "6 commands applied" in result.stdout
+    assert mock_save.call_count == 1
+
+    connector = KpDatabaseConnector(KpConfig(filename=temp_db_path, password="test"))
+    assert len(connector.find_entries("mygroup/account")) == 5
+    assert connector.find_entries("gmail")[0].url == "foo.com"
+
+
+@pytest.mark.parametrize(
+    "failing_command,error",
+    [
+        (add_command("gmail"), "Line 2: add failed"),
+        (add_command("new", group="unknown"), "Line 2: add failed"),
+        ("edit gmail --field unknown --value foo", "Line 2: Entry has no attribute unknown"),
+        ("rm gmail", "Line 2: rm failed"),
+    ],
+)
+@patch.dict(environ, get_env_vars("temp_db"))
+def test_batch_rolls_back_on_failure(temp_db_path, failing_command, error):
+    script = [add_command("account 1"), failing_command, add_command("account 2")]
+    with patch("kpcli.connector.save_database") as mock_save:
+        result = runner.invoke(app, ["batch", "-"], input="\n".join(script))
+    assert result.exit_code == 1
+    assert f"{error}; no changes saved" in result.stdout
+    mock_save.assert_not_called()
+    assert "account 2" not in result.stdout
+
+
+@patch.dict(environ, get_env_vars("temp_db"))
+def test_batch_from_file(temp_db_path, tmp_path):
+    script_file = tmp_path / "script.txt"
+    script_file.write_text(f"{add_command('from file')}\n")
+    result = runner.invoke(app, ["batch", str(script_file)])
+    assert result.exit_code == 0
+    result = runner.invoke(app, ["get", "from file"])
+    assert "MyGroup/from file" in result.stdout
+
+
+def test_transaction_rollback(temp_db_path):
+    connector = KpDatabaseConnector(KpConfig(filename=temp_db_path, password="test"))
+    group = connector.find_group("mygroup")
+    with pytest.raises(ValueError):
+        with connector.transaction():
+            connector.add_new_entry(group, "new entry", "u", "p", "", "")
+            assert connector.unsaved_changes
+            raise ValueError()
+    assert connector.find_entries("new entry") == []
+    assert not connector.unsaved_changes
+    assert not connector.defer_saves
+
+
+@patch.dict(environ, get_env_vars("temp_db"))
+def test_batch_import_rolls_back_on_failure(temp_db_path, tmp_path):
+    import_file = tmp_path / "entries.csv"
+    import_file.write_text("group,title\nmygroup,imported\n")
+    script = [add_command("first"), f"import '{import_file}'", "rm doesnotexist"]
+    with patch("kpcli.connector.save_database") as mock_save:
+        result = runner.invoke(app, ["batch", "-"], input="\n".join(script))
+    assert result.exit_code == 1
+    assert "Line 3: rm failed; no changes saved" in result.stdout
+    # the import's transaction leaves the save to the batch
+    mock_save.assert_not_called()
+
+    connector = KpDatabaseConnector(KpConfig(filename=temp_db_path, password="test"))
+    assert connector.find_entries("first") == []
+    assert connector.find_entries("imported") == []
+
+
+@pytest.mark.parametrize("command", ["compact", "merge copy.kdbx"])
+@patch.dict(environ, get_env_vars("temp_db"))
+def test_batch_excludes_commands_that_write_the_file(temp_db_path, command):
+    result = runner.invoke(app, ["batch", "-"], input=command)
+    assert result.exit_code == 1
+    assert "Unknown command" in result.stdout
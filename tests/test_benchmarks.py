@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+from benchmarks.vaults import PASSWORD, get_or_generate_vault
+from kpcli.comparator import KpDatabaseComparator
+from kpcli.connector import KpDatabaseConnector
+from kpcli.datastructures import KpConfig
+
+
+def test_generate_vault_with_conflicting_copy(tmp_path):
+    filename = get_or_generate_vault(tmp_path, 200, copies=1, depth=2, branching=2)
+    connector = KpDatabaseConnector(KpConfig(filename=filename, password=PASSWORD))
+    assert len(connector.index.entries) == 200
+    assert connector.find_group("group 0.1/group 1.0") is not None
+
+    comparator = KpDatabaseComparator(KpConfig(filename=filename, password=PASSWORD))
+    conflicting_data = comparator.get_conflicting_data()
+    missing_in_comparison, missing_in_main, conflicts = conflicting_data[
+        str(tmp_path / "200/vault_conflicting_copy_0.kdbx")
+    ]
+    assert len(conflicts) == 2
+    assert len(missing_in_comparison) == 1
+    assert missing_in_main == {"Root/added entry 0"}
@@ -1,12 +1,17 @@
 #!/usr/bin/env python3
 from os import environ
 from pathlib import Path
+import subprocess
+import sys
 from unittest.mock import call, patch
 
+from pykeepass import PyKeePass
 import pytest
 from typer.testing import CliRunner
 
+from kpcli import utils
 from kpcli.cli import app
+from kpcli.datastructures import Encrypter
 
 from .conftest import GROUP_ENTRY_NAMES
 
@@ -94,6 +99,16 @@ def test_overrides_config_file_without_env_vars(mock_config_file):
     assert "Invalid credentials" in result.stdout
 
 
+@patch.dict(environ, get_env_vars("test_db"))
+def test_config_file_read_once(mock_config_file):
+    with patch.object(
+        utils, "get_config_from_file", wraps=utils.get_config_from_file
+    ) as mock_read:
+        result = runner.invoke(app, ["--profile", "test", "ls"])
+    assert result.exit_code == 0
+    mock_read.assert_called_once_with("test")
+
+
 @pytest.mark.parametrize(
     "command,password_expected",
     [(["get", "gmail"], False), (["get", "gmail", "--show-password"], True)],
@@ -157,15 +172,16 @@ def test_get_entry_with_no_password(command):
 )
 @patch.dict(environ, get_env_vars("test_db"))
 @patch("kpcli.cli.typer.prompt")
-@patch("kpcli.cli.signal.alarm")
+@patch("kpcli.clipboard.clear_later")
+@patch("kpcli.clipboard.copy")
 def test_copy_multiple_matches(
-    mock_alarm,
+    mock_copy,
+    mock_clear_later,
     mock_prompt,
     prompt_values,
     expected_stdout_terms,
     unexpected_stdout_terms,
 ):
-    # also mock the alarm signal so it doesn't pollute other tests
     mock_prompt.side_effect = prompt_values
     result = runner.invoke(app, ["cp", "multi"])
     for term in expected_stdout_terms:
@@ -175,34 +191,36 @@ def test_copy_multiple_matches(
 
 
 @pytest.mark.parametrize(
-    "command,expected_args",
+    "command,expected_args,cleared",
     [
-        # copies password by default, then copies empty string
-        (
-            ["cp", "gmail"],
-            ["testpass", ""],
-        ),
+        # copies password by default, and clears it later
+        (["cp", "gmail"], ["testpass"], True),
         # copy username
-        (["cp", "gmail", "username"], ["test@test.com"]),
+        (["cp", "gmail", "username"], ["test@test.com"], False),
         # copy username with abbreviation
-        (["cp", "gmail", "u"], ["test@test.com"]),
-        # copy both; username then password, then empty string
-        (["cp", "gmail", "both"], ["test@test.com", "testpass", ""]),
+        (["cp", "gmail", "u"], ["test@test.com"], False),
+        # copy both; username then password, which is cleared later
+        (["cp", "gmail", "both"], ["test@test.com", "testpass"], True),
         # copy both with abbreviation
-        (["cp", "gmail", "b"], ["test@test.com", "testpass", ""]),
+        (["cp", "gmail", "b"], ["test@test.com", "testpass"], True),
     ],
 )
 @patch.dict(environ, get_env_vars("test_db"))
-@patch("kpcli.connector.pyperclip.copy")
+@patch("kpcli.clipboard.clear_later")
+@patch("kpcli.clipboard.copy")
 @patch("kpcli.cli.typer.prompt")
-@patch("kpcli.cli.signal.alarm")
-def test_copy(mock_alarm, mock_prompt, mock_copy, command, expected_args):
-    # mock prompt for confirmation after password copy - this will trigger the clipboard to be cleared
-    # also mock the alarm signal so it doesn't pollute other tests
+def test_copy(mock_prompt, mock_copy, mock_clear_later, command, expected_args, cleared):
+    # mock the prompt to copy the password after the username
     mock_prompt.return_value = "y"
-    runner.invoke(app, command)
-    calls = [call(arg) for arg in expected_args]
-    mock_copy.assert_has_calls(calls)
+    result = runner.invoke(app, command)
+    assert result.exit_code == 0
+    assert mock_copy.call_args_list == [call(arg) for arg in expected_args]
+    # the clipboard is cleared in the background, rather than waiting for the timeout
+    if cleared:
+        mock_clear_later.assert_called_once_with("testpass", 5)
+        assert "it will be cleared in 5 seconds" in result.stdout
+    else:
+        mock_clear_later.assert_not_called()
 
 
 @patch.dict(environ, get_env_vars("temp_db"))
@@ -306,3 +324,123 @@ def test_delete_group(mock_confirm, temp_db_path):
     assert "MyGroup" in result.stdout
     result = runner.invoke(app, ["rm-group", "MyGroup"])
     assert "MyGroup: deleted" in result.stdout
+
+
+@pytest.fixture
+def encrypted_password_env(tmp_path):
+    (tmp_path / ".kp").mkdir()
+    env_vars = get_env_vars("temp_db")
+    env_vars.update({"HOME": str(tmp_path), "STORE_ENCRYPTED_PASSWORD": "true"})
+    with patch.dict(environ, env_vars):
+        # prompt for the password on first use
+        del environ["KEEPASSDB_PASSWORD"]
+        yield tmp_path / ".kp"
+
+
+def test_stored_transformed_key(encrypted_password_env, temp_db_path):
+    result = runner.invoke(app, ["get", "gmail"], input="test\n")
+    assert "Database password" in result.stdout
+    assert "MyGroup/gmail" in result.stdout
+    assert (encrypted_password_env / ".keys").exists()
+    assert Encrypter().get_transformed_key(temp_db_path) is not None
+
+    # the stored key is used and the password isn't needed to derive it
+    with patch("pykeepass.PyKeePass", wraps=PyKeePass) as mock_pykeepass:
+        result = runner.invoke(app, ["get", "gmail"])
+    assert "Database password" not in result.stdout
+    assert "MyGroup/gmail" in result.stdout
+    assert mock_pykeepass.call_args.kwargs["transformed_key"] is not None
+
+
+def test_stored_transformed_key_kdf_changed(encrypted_password_env, temp_db_path):
+    runner.invoke(app, ["get", "gmail"], input="test\n")
+    assert Encrypter().get_transformed_key(temp_db_path) is not None
+    with patch("kpcli.datastructures.kdf_fingerprint", return_value="changed"):
+        assert Encrypter().get_transformed_key(temp_db_path) is None
+
+
+def test_stored_transformed_key_invalid(encrypted_password_env, temp_db_path):
+    runner.invoke(app, ["get", "gmail"], input="test\n")
+    # a stale key falls back to the stored password
+    with patch.object(Encrypter, "get_transformed_key", return_value=b"0" * 32):
+        result = runner.invoke(app, ["get", "gmail"])
+    assert result.exit_code == 0
+    assert "MyGroup/gmail" in result.stdout
+
+
+def test_compare(comparison_dir):
+    env_vars = get_env_vars("test_compare")
+    env_vars.update(
+        {
+            "HOME": str(comparison_dir),
+            "KEEPASSDB": str(comparison_dir / "test_compare.kdbx"),
+        }
+    )
+    (comparison_dir / "test_compare_notes.kdbx").write_text("not a database")
+    with patch.dict(environ, env_vars):
+        result = runner.invoke(app, ["compare"])
+        assert result.exit_code == 0
+        assert "blue/test4" in result.stdout
+        assert "test_compare_notes.kdbx" in result.stdout
+        assert "Cache: 0 hits, 4 misses" in result.stdout
+
+        result = runner.invoke(app, ["compare"])
+        assert "blue/test4" in result.stdout
+        assert "Cache: 4 hits, 0 misses" in result.stdout
+
+        result = runner.invoke(app, ["compare", "--no-cache"])
+        assert "blue/test4" in result.stdout
+        assert "Cache:" not in result.stdout
+
+
+def test_compare_dir(comparison_dir):
+    env_vars = get_env_vars("test_compare")
+    env_vars.update(
+        {
+            "HOME": str(comparison_dir),
+            "KEEPASSDB": str(comparison_dir / "test_compare.kdbx"),
+        }
+    )
+    # a file that isn't a database can't be accessed, like one with other credentials
+    (comparison_dir / "notes.kdbx").write_text("not a database")
+    with patch.dict(environ, env_vars):
+        result = runner.invoke(app, ["compare", "--dir", str(comparison_dir), "--no-cache"])
+        assert result.exit_code == 0
+        assert f"1: {comparison_dir / 'test_compare.kdbx'}" in result.stdout
+        assert "test_compare_locked.kdbx (Database could not be accessed)" in result.stdout
+        assert "notes.kdbx (Database could not be accessed)" in result.stdout
+        assert "4 entries, 1 identical in every database" in result.stdout
+
+        # at least one worker is needed
+        result = runner.invoke(app, ["compare", "--workers", "0"])
+        assert result.exit_code == 2
+
+        # missing files and directories are rejected
+        result = runner.invoke(app, ["compare", "--paths", str(comparison_dir / "missing")])
+        assert result.exit_code == 2
+        result = runner.invoke(app, ["compare", "--dir", str(comparison_dir / "missing")])
+        assert result.exit_code == 2
+
+
+SLOW_IMPORTS = ["pykeepass", "lxml", "cryptography", "tableformatter", "pyperclip"]
+
+
+def test_help_startup():
+    # the time taken is measured by the benchmarks (help_startup), as it varies too much
+    # between machines to assert here
+    script = "\n".join(
+        [
+            "import sys",
+            "from kpcli.cli import app",
+            "try:",
+            "    app(['--help'])",
+            "except SystemExit:",
+            "    pass",
+            f"print(','.join(m for m in {SLOW_IMPORTS!r} if m in sys.modules))",
+        ]
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, text=True, check=True
+    )
+    *_, slow_imports = result.stdout.splitlines()
+    assert slow_imports == ""
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+import io
+from pathlib import Path
+import subprocess
+import sys
+import time
+from unittest.mock import patch
+
+import pytest
+
+from kpcli import clipboard
+
+
+@pytest.fixture
+def file_clipboard(tmp_path):
+    """A clipboard backend that keeps its contents in a file, so a helper can share it"""
+    clipboard_file = tmp_path / "clipboard"
+    clipboard_file.write_text("")
+
+    def copy(text):
+        clipboard_file.write_text(text)
+
+    with patch.object(clipboard, "_backend", (copy, clipboard_file.read_text)):
+        yield clipboard_file
+    clipboard.clear_pending()
+
+
+def test_clear_if_unchanged(file_clipboard):
+    clipboard.copy("secret")
+    clipboard.clear_if_unchanged("other")
+    assert clipboard.paste() == "secret"
+    clipboard.clear_if_unchanged("secret")
+    assert clipboard.paste() == ""
+
+
+def test_clear_later_in_helper(file_clipboard):
+    with patch("kpcli.clipboard.subprocess.Popen") as mock_popen, patch(
+        "kpcli.clipboard._backend_name", return_value="xclip"
+    ):
+        clipboard.clear_later("secret", 5)
+    args, kwargs = mock_popen.call_args
+    # the helper is passed the timeout and backend, and the copied text on stdin only
+    assert args[0][1:] == ["-m", "kpcli.clipboard", "5", "xclip"]
+    assert kwargs["start_new_session"]
+    mock_popen.return_value.stdin.write.assert_called_once_with(b"secret")
+
+
+def test_helper(file_clipboard):
+    clipboard.copy("secret")
+    with patch("kpcli.clipboard.sys.stdin", io.TextIOWrapper(io.BytesIO(b"other"))):
+        clipboard.main(["0"])
+    assert clipboard.paste() == "secret"
+    with patch("kpcli.clipboard.sys.stdin", io.TextIOWrapper(io.BytesIO(b"secret"))):
+        clipboard.main(["0"])
+    assert clipboard.paste() == ""
+
+
+def test_helper_process():
+    # the helper runs on its own, without the command's process
+    helper = subprocess.run(
+        [sys.executable, "-m", "kpcli.clipboard", "0", "no"],
+        input=b"secret",
+        capture_output=True,
+        cwd=Path(__file__).parent.parent,
+    )
+    # there's no clipboard here, so the helper only gets as far as trying to use it
+    assert b"Pyperclip could not find a copy/paste mechanism" in helper.stderr
+
+
+def test_clear_later_in_process(file_clipboard):
+    clipboard.run_timers_in_process()
+    with patch("kpcli.clipboard._clear_in_helper") as mock_helper:
+        clipboard.copy("first")
+        clipboard.clear_later("first", 0)
+        for _ in range(100):
+            if clipboard.paste() == "":
+                break
+            time.sleep(0.01)
+        assert clipboard.paste() == ""
+
+        # pending timers are run on exit
+        clipboard.copy("second")
+        clipboard.clear_later("second", 60)
+        clipboard.clear_pending()
+    mock_helper.assert_not_called()
+    assert clipboard.paste() == ""
+    assert clipboard._timers is None
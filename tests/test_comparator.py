@@ -1,7 +1,17 @@
 #!/usr/bin/env python3
+from os import environ
+from unittest.mock import patch
 
-from kpcli.comparator import KpDatabaseComparator
-from kpcli.datastructures import KpConfig
+import attr
+
+from pykeepass import PyKeePass
+from pykeepass.kdbx_parsing.common import aes_kdf
+import pytest
+
+from kpcli.cache import default_cache_file
+from kpcli.comparator import KpDatabaseComparator, entry_snapshots
+from kpcli.datastructures import KpConfig, KpEntrySnapshot
+from kpcli.kdbx import kdf_fingerprint
 
 
 def test_compare_no_conflicts(test_db_path):
@@ -43,7 +53,8 @@ def test_compare_with_details(test_db_path):
     assert missing_in_comparison == set()
     assert missing_in_main == {"blue/test4"}
     assert conflicting_entries == {
-        ("red/test1", "username: test1 vs redtest, password: test1 vs pass1"),
+        # passwords are compared by hash, so their values aren't shown
+        ("red/test1", "username: test1 vs redtest, password: differs"),
         ("blue/test3", "username: test3 vs testblue"),
     }
 
@@ -56,3 +67,243 @@ def test_compare_with_inaccessible_database(test_db_path):
     conflicts = comparator.get_conflicting_data()
     comparator_path = str(db_path.parent / "test_db_with_keyfile.kdbx")
     assert conflicts[comparator_path] is None
+
+
+@pytest.mark.parametrize("workers", [1, 2, None])
+def test_compare_in_parallel(comparison_dir, workers):
+    comparator = KpDatabaseComparator(
+        KpConfig(filename=comparison_dir / "test_compare.kdbx", password="test")
+    )
+    conflicts = comparator.get_conflicting_data(workers=workers)
+    assert len(conflicts) == 4
+    assert conflicts.pop(str(comparison_dir / "test_compare_locked.kdbx")) is None
+    for missing_in_comparison, missing_in_main, conflicting_entries in conflicts.values():
+        assert missing_in_comparison == set()
+        assert missing_in_main == {"blue/test4"}
+        assert conflicting_entries == {
+            ("red/test1", "username, password"),
+            ("blue/test3", "username"),
+        }
+
+
+def test_compare_database_entries(test_db_path):
+    comparator = KpDatabaseComparator(
+        KpConfig(filename=test_db_path("test_db1"), password="test")
+    )
+    # (title, username, password, group, url, notes)
+    main_entries = {
+        KpEntrySnapshot(f"title{i}", "user", "pass", "group", "", "") for i in range(1000)
+    } | {KpEntrySnapshot("only in main", "user", "pass", "group", "", "")}
+    comparison_entries = {
+        KpEntrySnapshot(f"title{i}", "user", "pass", "group", "", "")
+        for i in range(1, 1000)
+    } | {
+        KpEntrySnapshot("title0", "user", "new pass", "group", "", ""),
+        KpEntrySnapshot("only in comparison", "user", "pass", "other", "", ""),
+    }
+    assert comparator.compare_database_entries(
+        main_entries ^ comparison_entries,
+        comparator.entries_by_key(main_entries),
+        comparator.entries_by_key(comparison_entries),
+    ) == (
+        {"group/only in main"},
+        {"other/only in comparison"},
+        {("group/title0", "password")},
+    )
+
+
+def test_compare_with_cache(comparison_dir, tmp_path):
+    cache_file = tmp_path / "cache"
+    config = KpConfig(filename=comparison_dir / "test_compare.kdbx", password="test")
+    comparator = KpDatabaseComparator(config, cache_file=cache_file)
+    conflicts = comparator.get_conflicting_data(workers=1)
+    assert (comparator.cache.hits, comparator.cache.misses) == (0, 4)
+
+    # nothing has changed, so no databases are opened
+    comparator = KpDatabaseComparator(config, cache_file=cache_file)
+    with patch("kpcli.comparator.get_database_entries") as mock_get_entries:
+        assert comparator.get_conflicting_data(workers=1) == conflicts
+    mock_get_entries.assert_not_called()
+    assert (comparator.cache.hits, comparator.cache.misses) == (4, 0)
+
+
+def test_compare_with_cache_changed_databases(comparison_dir, tmp_path):
+    cache_file = tmp_path / "cache"
+    main_db_path = comparison_dir / "test_compare.kdbx"
+    config = KpConfig(filename=main_db_path, password="test")
+    KpDatabaseComparator(config, cache_file=cache_file).get_conflicting_data(workers=1)
+
+    # a changed comparison database is opened again
+    copy_path = comparison_dir / "test_compare_conflicting.kdbx"
+    copy_db = PyKeePass(copy_path, password="test")
+    copy_db.add_entry(copy_db.root_group, "new", "user", "pass")
+    copy_db.save()
+    comparator = KpDatabaseComparator(config, cache_file=cache_file)
+    conflicts = comparator.get_conflicting_data(workers=1)
+    assert (comparator.cache.hits, comparator.cache.misses) == (3, 1)
+    assert conflicts[str(copy_path)][1] == {"blue/test4", "Root/new"}
+
+    # a changed main database is compared again, using the cached copy entries
+    main_db = PyKeePass(main_db_path, password="test")
+    main_db.add_entry(main_db.root_group, "new", "user", "pass")
+    main_db.save()
+    comparator = KpDatabaseComparator(config, cache_file=cache_file)
+    with patch("kpcli.comparator.get_database_entries") as mock_get_entries:
+        conflicts = comparator.get_conflicting_data(workers=1)
+    mock_get_entries.assert_not_called()
+    assert conflicts[str(copy_path)][1] == {"blue/test4"}
+    assert conflicts[str(comparison_dir / "test_compare_conflicting_2.kdbx")][0] == {
+        "Root/new"
+    }
+
+
+def test_compare_cache_for_other_database(comparison_dir, tmp_path, test_db_path):
+    cache_file = tmp_path / "cache"
+    config = KpConfig(filename=comparison_dir / "test_compare.kdbx", password="test")
+    KpDatabaseComparator(config, cache_file=cache_file).get_conflicting_data(workers=1)
+    # the cache can't be read with another database's key
+    other_config = KpConfig(filename=test_db_path("test_db"), password="test")
+    assert KpDatabaseComparator(other_config, cache_file=cache_file).cache.data == {}
+
+
+def test_default_cache_file_per_database(comparison_dir, test_db_path):
+    with patch.dict(environ, {"HOME": str(comparison_dir)}):
+        cache_file = default_cache_file(comparison_dir / "test_compare.kdbx")
+        assert cache_file.parent == comparison_dir / ".kp"
+        assert cache_file == default_cache_file(comparison_dir / "." / "test_compare.kdbx")
+        assert cache_file != default_cache_file(test_db_path("test_db"))
+
+
+def test_entry_snapshots(test_db_path):
+    db = PyKeePass(str(test_db_path("test_db")), password="test")
+    snapshots = {entry.title: entry for entry in entry_snapshots(db, b"key")}
+    assert len(snapshots) == len(db.entries)
+    gmail = snapshots["gmail"]
+    assert (gmail.group, gmail.username, gmail.url) == ("MyGroup", "test@test.com", "gmail.com")
+    # the password is replaced by a fixed-size hash, which depends on the key
+    assert len(gmail.password) == 32
+    assert "testpass" not in attr.astuple(gmail)
+    other_key = {entry.title: entry for entry in entry_snapshots(db, b"other key")}
+    assert other_key["gmail"].password != gmail.password
+    assert other_key["gmail"].username == gmail.username
+
+
+def test_compare_groups_by_path(comparison_dir):
+    main_db_path = comparison_dir / "test_compare.kdbx"
+    copy_path = comparison_dir / "test_compare_conflicting.kdbx"
+    for db_path, parent_name in ((main_db_path, "Work"), (copy_path, "Home")):
+        db = PyKeePass(db_path, password="test")
+        parent = db.add_group(db.root_group, parent_name)
+        db.add_entry(db.add_group(parent, "email"), "gmail", "user", "pass")
+        db.save()
+    comparator = KpDatabaseComparator(KpConfig(filename=main_db_path, password="test"))
+    missing_in_comparison, missing_in_main, conflicting_entries = (
+        comparator.get_conflicting_data(workers=1)[str(copy_path)]
+    )
+    # groups with the same name in different places aren't paired
+    assert missing_in_comparison == {"Work/email/gmail"}
+    assert missing_in_main == {"blue/test4", "Home/email/gmail"}
+    assert {entry_name for entry_name, _ in conflicting_entries} == {
+        "red/test1",
+        "blue/test3",
+    }
+
+
+def _fresh_salt_fingerprints(comparison_dir):
+    """KDF fingerprints as if two of the copies had been saved with a fresh salt"""
+    fresh_copies = {
+        comparison_dir / "test_compare_conflicting_2.kdbx",
+        comparison_dir / "test_compare_conflicting_3.kdbx",
+    }
+
+    def _kdf_fingerprint(filename):
+        if filename in fresh_copies:
+            return "fresh"
+        return kdf_fingerprint(filename)
+
+    return _kdf_fingerprint
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_compare_derives_key_once_per_kdf(comparison_dir, workers):
+    comparator = KpDatabaseComparator(
+        KpConfig(filename=comparison_dir / "test_compare.kdbx", password="test")
+    )
+    with patch(
+        "kpcli.comparator.kdf_fingerprint",
+        side_effect=_fresh_salt_fingerprints(comparison_dir),
+    ), patch("pykeepass.kdbx_parsing.kdbx3.aes_kdf", wraps=aes_kdf) as mock_kdf:
+        conflicts = comparator.get_conflicting_data(workers=workers)
+    if workers == 1:
+        # once for the fresh salt copies, and once for the locked database; the first
+        # copy uses the main database's key
+        assert mock_kdf.call_count == 2
+    assert conflicts.pop(str(comparison_dir / "test_compare_locked.kdbx")) is None
+    assert len(conflicts) == 3
+    for missing_in_comparison, missing_in_main, conflicting_entries in conflicts.values():
+        assert missing_in_main == {"blue/test4"}
+        assert conflicting_entries == {
+            ("red/test1", "username, password"),
+            ("blue/test3", "username"),
+        }
+
+
+def test_divergence_matrix(comparison_dir, tmp_path):
+    main_path = comparison_dir / "test_compare.kdbx"
+    comparator = KpDatabaseComparator(
+        KpConfig(filename=main_path, password="test"), cache_file=tmp_path / "cache"
+    )
+    copies = [
+        comparison_dir / "test_compare_conflicting.kdbx",
+        comparison_dir / "test_compare_conflicting_2.kdbx",
+        comparison_dir / "test_compare_locked.kdbx",
+    ]
+    # the main database and duplicates are only compared once
+    fingerprints, matrix = comparator.get_divergence_matrix(
+        [main_path, *copies, copies[0]], workers=1
+    )
+    assert list(fingerprints) == [str(main_path), *map(str, copies)]
+    assert fingerprints[str(copies[2])] is None
+    assert matrix == {
+        (str(main_path), str(copies[0])): (0, 1, 2),
+        (str(main_path), str(copies[1])): (0, 1, 2),
+        (str(copies[0]), str(copies[1])): (0, 0, 0),
+    }
+    # green/test2 is the same everywhere
+    assert comparator.nway_summary(fingerprints) == (4, 1)
+
+    # the fingerprints are made from cached entries the next time
+    comparator = KpDatabaseComparator(
+        KpConfig(filename=main_path, password="test"), cache_file=tmp_path / "cache"
+    )
+    with patch("kpcli.comparator.get_database_entries") as mock_get_entries:
+        assert comparator.get_divergence_matrix(copies, workers=1) == (fingerprints, matrix)
+    mock_get_entries.assert_not_called()
+
+
+def test_iter_tables_of_conflicts_in_pages(test_db_path):
+    db_path = test_db_path("test_compare")
+    comparator = KpDatabaseComparator(KpConfig(filename=db_path, password="test"))
+    results = comparator.iter_tables_of_conflicts(page_size=2)
+    comparator_path, tables = next(results)
+    assert comparator_path == str(db_path.parent / "test_compare_conflicting.kdbx")
+    # 3 conflicts, tabulated 2 at a time
+    tables = list(tables)
+    assert len(tables) == 2
+    assert all("Conflicting fields" in table for table in tables)
+    assert sum(table.count("test") for table in tables) == 5
+
+
+def test_iter_conflicting_data_cached_first(comparison_dir, tmp_path):
+    cache_file = tmp_path / "cache"
+    config = KpConfig(filename=comparison_dir / "test_compare.kdbx", password="test")
+    KpDatabaseComparator(config, cache_file=cache_file).get_conflicting_data(workers=1)
+    # a changed copy is opened again after the unchanged copies' cached results
+    copy_path = comparison_dir / "test_compare_conflicting.kdbx"
+    copy_db = PyKeePass(copy_path, password="test")
+    copy_db.add_entry(copy_db.root_group, "new", "user", "pass")
+    copy_db.save()
+    comparator = KpDatabaseComparator(config, cache_file=cache_file)
+    filenames = [filename for filename, _ in comparator.iter_conflicting_data(workers=1)]
+    assert len(filenames) == 4
+    assert filenames[-1] == str(copy_path)
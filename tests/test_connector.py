@@ -69,13 +69,18 @@ def test_get_details(test_db_path, show_password, password):
     "attribute,expected",
     [("username", "test@test.com"), ("password", "testpass"), ("url", "gmail.com")],
 )
-@patch("kpcli.connector.pyperclip.copy")
-def test_copy(mock_copy, test_db_path, attribute, expected):
+@patch("kpcli.clipboard.clear_later")
+@patch("kpcli.clipboard.copy")
+def test_copy(mock_copy, mock_clear_later, test_db_path, attribute, expected):
     db_path = test_db_path("test_db")
     connector = KpDatabaseConnector(KpConfig(filename=db_path, password="test"))
     entry = connector.find_entries("gmail")[0]
     connector.copy_to_clipboard(entry, attribute)
     mock_copy.assert_called_with(expected)
+    mock_clear_later.assert_not_called()
+
+    connector.copy_to_clipboard(entry, attribute, clear_after=5)
+    mock_clear_later.assert_called_once_with(expected, 5)
 
 
 def test_copy_invalid_attribute(test_db_path):
@@ -151,3 +156,124 @@ def test_delete_group(temp_db_path):
     group = connector.find_group("MyGroup")
     connector.delete_group(group)
     assert connector.list_group_names() == ["Root", "Test"]
+
+
+def test_open_with_transformed_key(temp_db_path):
+    connector = KpDatabaseConnector(KpConfig(filename=temp_db_path, password="test"))
+    transformed_key = connector.db.transformed_key
+    # no password needed with the transformed key
+    connector = KpDatabaseConnector(
+        KpConfig(filename=temp_db_path, transformed_key=transformed_key)
+    )
+    entry = connector.find_entries("gmail")[0]
+    connector.change_password(entry, "new_pass")
+    connector = KpDatabaseConnector(KpConfig(filename=temp_db_path, password="test"))
+    assert connector.find_entries("gmail")[0].password == "new_pass"
+
+
+def test_find_group_prefers_exact_match(temp_db_path):
+    connector = KpDatabaseConnector(KpConfig(filename=temp_db_path, password="test"))
+    connector.add_group("MyGroup2")
+    connector.add_group("Group")
+    assert connector.find_group("group").name == "Group"
+    assert connector.find_group("mygroup").name == "MyGroup"
+    assert connector.find_group("roup2").name == "MyGroup2"
+
+
+def test_find_entry(test_db_path):
+    db_path = test_db_path("test_db")
+    connector = KpDatabaseConnector(KpConfig(filename=db_path, password="test"))
+    group = connector.find_group("mygroup")
+    assert connector.find_entry("GMAIL", group).title == "gmail"
+    assert connector.find_entry("gm", group) is None
+    assert connector.find_entry("gmail", connector.find_group("root")) is None
+
+
+def test_index_updated_for_new_group_and_entry(temp_db_path):
+    connector = KpDatabaseConnector(KpConfig(filename=temp_db_path, password="test"))
+    connector.add_group("Sub", connector.find_group("mygroup"))
+    group = connector.find_group("mygroup/sub")
+    assert group.name == "Sub"
+    connector.add_new_entry(group, "gmail", "test user", "pass", "", "")
+    entries = connector.find_entries("gmail")
+    assert [connector.index.entry_group(entry).name for entry in entries] == [
+        "MyGroup",
+        "Sub",
+    ]
+    assert len(connector.find_entries("mygroup/sub/gmail")) == 1
+    assert connector.list_group_entries("sub") == ["gmail"]
+
+
+def test_index_updated_for_deleted_group(temp_db_path):
+    connector = KpDatabaseConnector(KpConfig(filename=temp_db_path, password="test"))
+    connector.delete_group(connector.find_group("mygroup"))
+    assert connector.find_entries("gmail") == []
+    assert connector.find_group("mygroup") is None
+
+
+def test_index_updated_for_edited_title(temp_db_path):
+    connector = KpDatabaseConnector(KpConfig(filename=temp_db_path, password="test"))
+    entry = connector.find_entries("gmail")[0]
+    connector.edit_entry(entry, "title", "googlemail")
+    assert connector.find_entries("gmail") == []
+    assert connector.find_entries("googlemail")[0].title == "googlemail"
+
+
+def test_iter_group_entries(temp_db_path):
+    connector = KpDatabaseConnector(KpConfig(filename=temp_db_path, password="test"))
+    connector.add_group("Sub", connector.find_group("mygroup"))
+    connector.add_new_entry(connector.find_group("sub"), "b", "u", "p", "", "")
+    group_entries = dict(connector.iter_group_entries())
+    assert group_entries["MyGroup"] == GROUP_ENTRY_NAMES
+    assert group_entries["MyGroup/Sub"] == ["b"]
+    assert "Test Root Entry" in group_entries["Root"]
+
+
+def test_iter_group_entries_single_group(test_db_path):
+    db_path = test_db_path("test_db")
+    connector = KpDatabaseConnector(KpConfig(filename=db_path, password="test"))
+    group = connector.find_group("mygroup")
+    assert list(connector.iter_group_entries(group)) == [("MyGroup", GROUP_ENTRY_NAMES)]
+
+
+def test_edit_with_unchanged_value_is_not_saved(temp_db_path):
+    connector = KpDatabaseConnector(KpConfig(filename=temp_db_path, password="test"))
+    entry = connector.find_entries("gmail")[0]
+    with patch("kpcli.connector.save_database") as mock_save:
+        connector.edit_entry(entry, "username", entry.username)
+        connector.change_password(entry, entry.password)
+        mock_save.assert_not_called()
+        connector.edit_entry(entry, "username", "new")
+        mock_save.assert_called_once()
+
+
+def test_save_records_timings(temp_db_path):
+    connector = KpDatabaseConnector(KpConfig(filename=temp_db_path, password="test"))
+    connector.edit_entry(connector.find_entries("gmail")[0], "url", "foo.com")
+    assert len(connector.save_timings) == 1
+    assert set(connector.save_timings[0]) == {
+        "build", "write", "fsync", "rename", "total", "size"
+    }
+    # no temporary files are left behind
+    assert list(temp_db_path.parent.glob(f".{temp_db_path.name}*")) == []
+
+
+def test_failed_save_leaves_database_intact(temp_db_path):
+    original = temp_db_path.read_bytes()
+    connector = KpDatabaseConnector(KpConfig(filename=temp_db_path, password="test"))
+    with patch("kpcli.kdbx.os.fsync", side_effect=OSError("disk full")):
+        with pytest.raises(OSError):
+            connector.edit_entry(connector.find_entries("gmail")[0], "url", "foo.com")
+    assert temp_db_path.read_bytes() == original
+    assert list(temp_db_path.parent.glob(f".{temp_db_path.name}*")) == []
+
+
+@pytest.mark.parametrize("compression_level", [0, 9])
+def test_save_with_compression_level(temp_db_path, compression_level):
+    connector = KpDatabaseConnector(
+        KpConfig(filename=temp_db_path, password="test"),
+        compression_level=compression_level,
+    )
+    connector.add_new_entry(connector.find_group("root"), "new", "u", "p" * 1000, "", "")
+    connector = KpDatabaseConnector(KpConfig(filename=temp_db_path, password="test"))
+    assert connector.find_entries("new")[0].password == "p" * 1000
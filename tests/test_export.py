@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+import csv
+import io
+import json
+from os import environ
+from unittest.mock import patch
+
+from typer.testing import CliRunner
+
+from kpcli.cli import app
+from kpcli.connector import KpDatabaseConnector
+from kpcli.datastructures import KpConfig
+from kpcli.exporter import encrypting, export_records
+from kpcli.importer import decrypted
+
+from .test_cli import get_env_vars
+
+# keep stderr separate, so stdout can be parsed
+runner = CliRunner(mix_stderr=False)
+
+
+def test_export_records(temp_db_path):
+    connector = KpDatabaseConnector(KpConfig(filename=temp_db_path, password="test"))
+    records = list(export_records(connector))
+    assert {
+        "title": "gmail",
+        "username": "test@test.com",
+        "password": "testpass",
+        "group": "MyGroup",
+        "url": "gmail.com",
+        "notes": "",
+    } in records
+    assert len(records) == len(connector.db.entries)
+
+    group = connector.find_group("test")
+    records = list(export_records(connector, ["title", "missing"], groups=[group]))
+    assert records == [
+        {"title": f"Multi{i}", "missing": ""} for i in range(1, 4)
+    ]
+
+
+def test_encrypted_round_trip():
+    from cryptography.fernet import Fernet
+
+    key = Fernet.generate_key()
+    encrypted = io.BytesIO()
+    write = encrypting(encrypted.write, key)
+    write("a,b\n")
+    write("1,2\n")
+    assert b"a,b" not in encrypted.getvalue()
+    encrypted.seek(0)
+    assert decrypted(encrypted, key).read() == "a,b\n1,2\n"
+
+
+@patch.dict(environ, get_env_vars("temp_db"))
+def test_export_command(temp_db_path, tmp_path):
+    result = runner.invoke(
+        app, ["export", "--fields", "group,title", "--group", "test"]
+    )
+    assert result.exit_code == 0
+    assert list(csv.DictReader(io.StringIO(result.stdout))) == [
+        {"group": "Test", "title": f"Multi{i}"} for i in range(1, 4)
+    ]
+    assert "3 entries exported" in result.stderr
+
+    export_file = tmp_path / "export.ndjson"
+    result = runner.invoke(app, ["export", str(export_file)])
+    assert result.exit_code == 0
+    records = [json.loads(line) for line in export_file.read_text().splitlines()]
+    assert {"title", "username", "password", "group", "url", "notes"} == set(records[0])
+
+    result = runner.invoke(app, ["export", "--group", "nonexistent"])
+    assert result.exit_code == 1
+
+
+def test_encrypted_export_import(temp_db_path, tmp_path):
+    env_vars = get_env_vars("temp_db")
+    env_vars["HOME"] = str(tmp_path)
+    export_file = tmp_path / "export.csv"
+    with patch.dict(environ, env_vars):
+        result = runner.invoke(app, ["export", str(export_file), "--encrypt"])
+        assert result.exit_code == 0
+        assert b"gmail" not in export_file.read_bytes()
+        assert (tmp_path / ".kp" / ".export_key").exists()
+
+        result = runner.invoke(app, ["import", str(export_file), "--decrypt"])
+    assert result.exit_code == 0
+    # every entry is already in the database
+    assert "0 entries imported" in result.stdout
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+import io
+import json
+from os import environ
+from unittest.mock import patch
+
+import pytest
+from typer.testing import CliRunner
+
+from kpcli.cli import app
+from kpcli.connector import KpDatabaseConnector
+from kpcli.datastructures import FileFormat, KpConfig
+from kpcli.importer import ImportFileError, guess_format, read_entries
+from kpcli.kdbx import save_database
+
+from .test_cli import get_env_vars
+
+runner = CliRunner()
+
+ENTRIES = [
+    {"group": "internet/email", "title": "gmail", "username": "me", "password": "pw"},
+    {"group": "", "title": "bank", "url": "https://bank.example.com", "notes": "a\nb"},
+]
+
+
+def _expected(entry):
+    return {
+        field: entry.get(field, "")
+        for field in ("group", "title", "username", "password", "url", "notes")
+    }
+
+
+@pytest.mark.parametrize(
+    "filename,expected",
+    [
+        ("entries.csv", FileFormat.csv),
+        ("entries.JSON", FileFormat.json),
+        ("entries.ndjson", FileFormat.ndjson),
+        ("entries.jsonl", FileFormat.ndjson),
+        ("entries.txt", None),
+        ("<stdin>", None),
+    ],
+)
+def test_guess_format(filename, expected):
+    assert guess_format(filename) == expected
+
+
+def test_read_csv():
+    infile = io.StringIO(
+        "Group,Title,Username,Password,URL,Notes,Last Modified\n"
+        'internet/email,gmail,me,pw,,,2021-01-01\n,bank,,,https://bank.example.com,"a\nb",\n'
+    )
+    assert list(read_entries(infile, FileFormat.csv)) == [_expected(e) for e in ENTRIES]
+
+
+def test_read_ndjson():
+    infile = io.StringIO("\n".join(json.dumps(entry) for entry in ENTRIES) + "\n\n")
+    assert list(read_entries(infile, FileFormat.ndjson)) == [_expected(e) for e in ENTRIES]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64 * 1024])
+def test_read_json_in_chunks(chunk_size):
+    infile = io.StringIO(json.dumps(ENTRIES, indent=2))
+    with patch("kpcli.importer.JSON_CHUNK_SIZE", chunk_size):
+        assert list(read_entries(infile, FileFormat.json)) == [
+            _expected(e) for e in ENTRIES
+        ]
+
+
+@pytest.mark.parametrize(
+    "content,file_format,error",
+    [
+        ('{"title": "a"}', FileFormat.json, "Expected a JSON array"),
+        ('[{"title": "a"}', FileFormat.json, "unexpected end of file"),
+        ('[{"title": "a"', FileFormat.json, "Invalid JSON"),
+        ('[{"title": "a"}, 3]', FileFormat.json, "Entry 2: expected an object"),
+        ('{"title": "a"}\n{"title": }', FileFormat.ndjson, "Line 2: invalid JSON"),
+        ("title,url\n,a.com", FileFormat.csv, "Entry 1: no title"),
+    ],
+)
+def test_read_invalid(content, file_format, error):
+    with pytest.raises(ImportFileError, match=error):
+        list(read_entries(io.StringIO(content), file_format))
+
+
+def test_import_entries(temp_db_path):
+    connector = KpDatabaseConnector(KpConfig(filename=temp_db_path, password="test"))
+    entries = [
+        {**_expected(entry), "group": "Root/internet/email"} for entry in ENTRIES
+    ]
+    entries += [
+        # duplicates of an existing entry and of an imported entry
+        _expected({"group": "MyGroup", "title": "GMAIL"}),
+        _expected({"group": "internet/email", "title": "bank"}),
+    ]
+    with patch("kpcli.connector.save_database", wraps=save_database) as mock_save:
+        assert connector.import_entries(iter(entries)) == (2, 2)
+    mock_save.assert_called_once()
+
+    connector = KpDatabaseConnector(KpConfig(filename=temp_db_path, password="test"))
+    group = connector.find_group("internet/email")
+    assert connector.index.group_paths[group.uuid] == "internet/email"
+    assert connector.list_group_entries("internet/email") == ["bank", "gmail"]
+    bank = connector.find_entry("bank", group)
+    assert bank.url == "https://bank.example.com"
+    assert bank.notes == "a\nb"
+
+
+def test_import_entries_keeps_no_changes_without_journal(temp_db_path):
+    connector = KpDatabaseConnector(KpConfig(filename=temp_db_path, password="test"))
+
+    def entries():
+        for number in range(100):
+            yield _expected({"title": f"entry {number}", "password": "secret"})
+            # the imported fields aren't held until the save
+            assert connector._changes == []
+
+    with patch("kpcli.connector.save_database"):
+        assert connector.import_entries(entries()) == (100, 0)
+
+
+def test_import_entries_error_discards_all(temp_db_path):
+    connector = KpDatabaseConnector(KpConfig(filename=temp_db_path, password="test"))
+
+    def entries():
+        yield _expected({"group": "new", "title": "first"})
+        raise ImportFileError("Entry 2: no title")
+
+    with pytest.raises(ImportFileError):
+        connector.import_entries(entries())
+    assert connector.find_entries("first") == []
+    assert connector.index.find_group_by_path("new") is None
+
+
+@patch.dict(environ, get_env_vars("temp_db"))
+def test_import_command(temp_db_path, tmp_path):
+    import_file = tmp_path / "entries.ndjson"
+    import_file.write_text("\n".join(json.dumps(entry) for entry in ENTRIES))
+    result = runner.invoke(app, ["import", str(import_file)])
+    assert result.exit_code == 0
+    assert "2 entries imported, 0 existing entries skipped" in result.stdout
+
+    result = runner.invoke(app, ["import", "-", "--format", "json"], input="[{}]")
+    assert result.exit_code == 1
+    assert "Entry 1: no title; no entries imported" in result.stdout
+
+    result = runner.invoke(app, ["import", "-"], input="")
+    assert result.exit_code == 1
+    assert "Unknown file format" in result.stdout
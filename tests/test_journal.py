@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+from os import environ
+from unittest.mock import patch
+
+import pytest
+from typer.testing import CliRunner
+
+from kpcli.cli import app
+from kpcli.comparator import KpDatabaseComparator
+from kpcli.connector import KpDatabaseConnector
+from kpcli.datastructures import KpConfig
+
+from .test_cli import get_env_vars
+
+runner = CliRunner()
+
+
+def get_connector(db_path, **kwargs):
+    return KpDatabaseConnector(KpConfig(filename=db_path, password="test"), **kwargs)
+
+
+def make_changes(connector):
+    group = connector.find_group("mygroup")
+    connector.add_new_entry(group, "new entry", "user", "pass", "", "")
+    connector.edit_entry(connector.find_entries("gmail")[0], "url", "foo.com")
+    connector.change_password(connector.find_entries("new entry")[0], "new pass")
+    connector.delete_entry(connector.find_entries("Entry with no password")[0])
+    connector.add_group("new group", group)
+
+
+def assert_changes(connector):
+    assert connector.find_entries("new entry")[0].password == "new pass"
+    assert connector.find_entries("gmail")[0].url == "foo.com"
+    assert connector.find_entries("Entry with no password") == []
+    assert connector.find_group("mygroup/new group") is not None
+
+
+def test_journal_mode_appends_changes(temp_db_path):
+    original = temp_db_path.read_bytes()
+    connector = get_connector(temp_db_path, journal=True)
+    make_changes(connector)
+    # the database file isn't rewritten
+    assert temp_db_path.read_bytes() == original
+    assert connector.journal.exists()
+    assert len(connector.save_timings) == 5
+
+    # changes are replayed when the database is opened
+    assert_changes(get_connector(temp_db_path))
+
+
+def test_compact(temp_db_path):
+    connector = get_connector(temp_db_path, journal=True)
+    make_changes(connector)
+    connector.compact()
+    assert not connector.journal.exists()
+    assert_changes(get_connector(temp_db_path))
+
+
+def test_save_without_journal_mode_compacts(temp_db_path):
+    make_changes(get_connector(temp_db_path, journal=True))
+    connector = get_connector(temp_db_path)
+    connector.add_group("another group")
+    assert not connector.journal.exists()
+    assert_changes(get_connector(temp_db_path))
+
+
+def test_journal_compacted_at_max_size(temp_db_path):
+    original = temp_db_path.read_bytes()
+    connector = get_connector(temp_db_path, journal=True, journal_max_size=1000)
+    connector.add_group("another group")
+    assert temp_db_path.read_bytes() == original
+    make_changes(connector)
+    assert temp_db_path.read_bytes() != original
+    assert connector.journal.size() < 1000
+    assert_changes(get_connector(temp_db_path))
+
+
+def test_incomplete_journal_record_ignored(temp_db_path):
+    connector = get_connector(temp_db_path, journal=True)
+    connector.add_group("new group")
+    connector.add_group("another group")
+    # simulate a crash while the last record was written
+    data = connector.journal.filename.read_bytes()
+    connector.journal.filename.write_bytes(data[:-20])
+
+    connector = get_connector(temp_db_path)
+    assert connector.find_group("new group") is not None
+    assert connector.find_group("another group") is None
+
+
+def test_stale_journal_moved_aside(temp_db_path):
+    connector = get_connector(temp_db_path, journal=True)
+    connector.add_group("new group")
+    # the database is changed without the journal
+    with patch.object(connector.journal, "exists", return_value=False):
+        connector.compact()
+
+    connector = get_connector(temp_db_path)
+    assert not connector.journal.exists()
+    assert connector.journal.filename.with_name(
+        f"{temp_db_path.name}.journal.stale"
+    ).exists()
+
+
+def test_transaction_rollback_replays_journal(temp_db_path):
+    connector = get_connector(temp_db_path, journal=True)
+    connector.add_group("new group")
+    with pytest.raises(ValueError):
+        with connector.transaction():
+            connector.add_group("another group")
+            raise ValueError()
+    assert connector.find_group("new group") is not None
+    assert connector.find_group("another group") is None
+
+
+def test_compare_includes_journal(temp_db_path):
+    connector = get_connector(temp_db_path, journal=True)
+    connector.add_new_entry(connector.find_group("root"), "new entry", "u", "p", "", "")
+    comparator = KpDatabaseComparator(KpConfig(filename=temp_db_path, password="test"))
+    assert len(comparator.db.find_entries(title="new entry")) == 1
+
+
+@patch.dict(environ, {**get_env_vars("temp_db"), "KEEPASSDB_JOURNAL": "true"})
+def test_cli_compact(temp_db_path):
+    result = runner.invoke(app, ["compact"])
+    assert "No journal to compact" in result.stdout
+
+    original = temp_db_path.read_bytes()
+    runner.invoke(app, ["edit", "gmail", "--field", "url", "--value", "foo.com"])
+    assert temp_db_path.read_bytes() == original
+    result = runner.invoke(app, ["get", "gmail"])
+    assert "foo.com" in result.stdout
+
+    result = runner.invoke(app, ["compact"])
+    assert result.exit_code == 0
+    assert "Journal compacted into the database" in result.stdout
+    assert temp_db_path.read_bytes() != original
+    assert not temp_db_path.with_name(f"{temp_db_path.name}.journal").exists()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+import base64
+from datetime import datetime, timedelta, timezone
+from os import environ
+from unittest.mock import patch
+
+from pykeepass import PyKeePass
+from pykeepass.exceptions import CredentialsError
+import pytest
+from typer.testing import CliRunner
+
+from kpcli.cli import app
+from kpcli.connector import KpDatabaseConnector
+from kpcli.datastructures import KpConfig
+from kpcli.merger import KpMergeResult
+
+from .test_cli import get_env_vars
+
+runner = CliRunner()
+
+
+def _entries(filename):
+    db = PyKeePass(str(filename), "test")
+    return {
+        f"{entry.group.name}/{entry.title}": (entry.username, entry.password)
+        for entry in db.entries
+    }
+
+
+def _connector(comparison_dir):
+    return KpDatabaseConnector(
+        KpConfig(filename=comparison_dir / "test_compare.kdbx", password="test")
+    )
+
+
+def test_merge_copy(comparison_dir):
+    copy_path = comparison_dir / "test_compare_conflicting.kdbx"
+    connector = _connector(comparison_dir)
+    with patch.object(connector, "compact", wraps=connector.compact) as mock_compact:
+        result = connector.merge_database(copy_path)
+    mock_compact.assert_called_once()
+    assert result == KpMergeResult(added=1, updated=2, unchanged=1, changed=True)
+    expected = {
+        "red/test1": ("redtest", "pass1"),
+        "green/test2": ("test2", "test2"),
+        "blue/test3": ("testblue", "test3"),
+        "blue/test4": ("test4", "test4"),
+    }
+    assert _entries(comparison_dir / "test_compare.kdbx") == expected
+    # the index is rebuilt with the added entry
+    assert connector.list_group_entries("blue") == ["test3", "test4"]
+
+    # the replaced main version is kept in the history
+    db = PyKeePass(str(comparison_dir / "test_compare.kdbx"), "test")
+    red = db.find_entries(title="test1", first=True)
+    assert ("test1", "test1") in [
+        (version.username, version.password) for version in red.history
+    ]
+    mtimes = [version.mtime for version in red.history]
+    assert mtimes == sorted(mtimes)
+
+    # merging the same copy again changes nothing
+    with patch.object(connector, "compact") as mock_compact:
+        result = connector.merge_database(copy_path)
+    mock_compact.assert_not_called()
+    assert result == KpMergeResult(unchanged=4)
+
+
+def test_merge_keeps_newer_main_version(comparison_dir):
+    db = PyKeePass(str(comparison_dir / "test_compare.kdbx"), "test")
+    red = db.find_entries(title="test1", first=True)
+    red.password = "newer"
+    red.mtime = datetime.now(timezone.utc)
+    db.save()
+
+    connector = _connector(comparison_dir)
+    result = connector.merge_database(comparison_dir / "test_compare_conflicting.kdbx")
+    assert (result.updated, result.kept) == (1, 1)
+    red_fields = _entries(comparison_dir / "test_compare.kdbx")["red/test1"]
+    assert red_fields == ("test1", "newer")
+    red = connector.find_entry("test1", connector.find_group("red"))
+    assert ("redtest", "pass1") in [
+        (version.username, version.password) for version in red.history
+    ]
+
+
+def test_merge_skips_entries_deleted_from_main(comparison_dir):
+    copy_path = comparison_dir / "test_compare_conflicting.kdbx"
+    copy_db = PyKeePass(str(copy_path), "test")
+    copy_uuid = copy_db.find_entries(title="test4", first=True).uuid
+
+    db = PyKeePass(str(comparison_dir / "test_compare.kdbx"), "test")
+    root = db.tree.getroot().find("Root")
+    deleted_objects = root.find("DeletedObjects")
+    if deleted_objects is None:
+        deleted_objects = root.makeelement("DeletedObjects")
+        root.append(deleted_objects)
+    deleted = deleted_objects.makeelement("DeletedObject")
+    for tag, text in (
+        ("UUID", base64.b64encode(copy_uuid.bytes).decode()),
+        ("DeletionTime", db._encode_time(datetime.now(timezone.utc) + timedelta(1))),
+    ):
+        element = deleted.makeelement(tag)
+        element.text = text
+        deleted.append(element)
+    deleted_objects.append(deleted)
+    db.save()
+
+    connector = _connector(comparison_dir)
+    result = connector.merge_database(copy_path)
+    assert (result.added, result.deleted) == (0, 1)
+    assert "blue/test4" not in _entries(comparison_dir / "test_compare.kdbx")
+
+
+def test_merge_with_other_credentials(comparison_dir):
+    connector = _connector(comparison_dir)
+    with pytest.raises(CredentialsError):
+        connector.merge_database(comparison_dir / "test_compare_locked.kdbx")
+
+
+def test_merge_command(comparison_dir):
+    env_vars = get_env_vars("test_compare")
+    env_vars.update(
+        {
+            "HOME": str(comparison_dir),
+            "KEEPASSDB": str(comparison_dir / "test_compare.kdbx"),
+        }
+    )
+    with patch.dict(environ, env_vars):
+        result = runner.invoke(
+            app, ["merge", str(comparison_dir / "test_compare_conflicting.kdbx")]
+        )
+        assert result.exit_code == 0
+        assert "1 entries added, 2 updated from the copy" in result.stdout
+        assert _entries(comparison_dir / "test_compare.kdbx")["blue/test4"] == (
+            "test4",
+            "test4",
+        )
+
+        result = runner.invoke(
+            app, ["merge", str(comparison_dir / "test_compare_locked.kdbx")]
+        )
+        assert result.exit_code == 1
+        assert "Database could not be accessed" in result.stdout
+
+        # a file that isn't a database
+        not_a_database = comparison_dir / "bogus.kdbx"
+        not_a_database.write_text("not a database")
+        result = runner.invoke(app, ["merge", str(not_a_database)])
+        assert result.exit_code == 1
+        assert f"{not_a_database}: Database could not be accessed" in result.stdout
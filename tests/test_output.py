@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+import json
+from os import environ
+from unittest.mock import patch
+
+import pytest
+from typer.testing import CliRunner
+
+from kpcli.cli import app
+from kpcli.output import RecordWriter
+
+from .test_cli import get_env_vars
+
+# keep stderr separate, so stdout can be parsed
+runner = CliRunner(mix_stderr=False)
+
+
+@pytest.mark.parametrize("count", [0, 1, 2, 3, 5])
+@pytest.mark.parametrize("batch_size", [1, 2, 1000])
+def test_json_writer(capsys, count, batch_size):
+    with RecordWriter("json", ["a", "b"], batch_size=batch_size) as writer:
+        writer.write_all({"a": i, "b": "x"} for i in range(count))
+    assert json.loads(capsys.readouterr().out) == [{"a": i, "b": "x"} for i in range(count)]
+
+
+def test_ndjson_writer(capsys):
+    with RecordWriter("ndjson", ["a"], batch_size=2) as writer:
+        writer.write_all({"a": i, "ignored": True} for i in range(3))
+    assert capsys.readouterr().out == '{"a": 0}\n{"a": 1}\n{"a": 2}\n'
+
+
+def test_tsv_writer(capsys):
+    with RecordWriter("tsv", ["a", "b"]) as writer:
+        writer.write({"a": "tab\there", "b": "line 1\nline 2"})
+        writer.write({"a": None, "b": "back\\slash"})
+    assert capsys.readouterr().out == (
+        "a\tb\ntab\\there\tline 1\\nline 2\n\tback\\\\slash\n"
+    )
+
+
+def test_writer_flushes_per_batch():
+    with patch("kpcli.output.typer.echo") as mock_echo:
+        with RecordWriter("ndjson", ["a"], batch_size=100) as writer:
+            writer.write_all({"a": i} for i in range(250))
+    assert mock_echo.call_count == 3
+
+
+@patch.dict(environ, get_env_vars("test_db"))
+def test_ls_output():
+    result = runner.invoke(app, ["--output", "json", "ls"])
+    assert result.exit_code == 0
+    assert json.loads(result.stdout) == [
+        {"group": "MyGroup"},
+        {"group": "Root"},
+        {"group": "Test"},
+    ]
+    assert "UNLOCKING" in result.stderr
+
+    result = runner.invoke(app, ["-o", "ndjson", "ls", "--entries", "--group", "test"])
+    assert [json.loads(line) for line in result.stdout.splitlines()] == [
+        {"group": "Test", "title": "Multi1"},
+        {"group": "Test", "title": "Multi2"},
+        {"group": "Test", "title": "Multi3"},
+    ]
+
+
+@patch.dict(environ, get_env_vars("test_db"))
+def test_password_prompt_on_stderr():
+    # without a stored password, the prompt isn't written into the records
+    del environ["KEEPASSDB_PASSWORD"]
+    result = runner.invoke(app, ["-o", "ndjson", "ls"], input="test\n")
+    assert result.exit_code == 0
+    assert "Database password" in result.stderr
+    # the test runner echoes the hidden input to stdout, where getpass would use the tty
+    records = [json.loads(line) for line in result.stdout.splitlines() if line.strip()]
+    assert records == [
+        {"group": "MyGroup"},
+        {"group": "Root"},
+        {"group": "Test"},
+    ]
+
+
+@patch.dict(environ, get_env_vars("test_db"))
+def test_get_output():
+    result = runner.invoke(app, ["-o", "tsv", "get", "gmail", "--show-password"])
+    assert result.exit_code == 0
+    assert result.stdout == (
+        "name\tusername\tpassword\turl\tnotes\n"
+        "MyGroup/gmail\ttest@test.com\ttestpass\tgmail.com\t\n"
+    )
+
+    result = runner.invoke(app, ["-o", "json", "get", "gmial"])
+    assert json.loads(result.stdout) == []
+    assert "Did you mean:" in result.stderr
+
+
+def test_compare_output(comparison_dir):
+    env_vars = get_env_vars("test_compare")
+    env_vars.update(
+        {
+            "HOME": str(comparison_dir),
+            "KEEPASSDB": str(comparison_dir / "test_compare.kdbx"),
+        }
+    )
+    with patch.dict(environ, env_vars):
+        result = runner.invoke(app, ["-o", "ndjson", "compare", "--no-cache"])
+    assert result.exit_code == 0
+    records = [json.loads(line) for line in result.stdout.splitlines()]
+    assert {
+        "database": str(comparison_dir / "test_compare_conflicting.kdbx"),
+        "main": "-",
+        "conflicting": "blue/test4",
+        "conflicting_fields": "",
+    } in records
+    assert "test_compare_locked.kdbx: Database could not be accessed" in result.stderr
+
+
+def test_compare_matrix_output(comparison_dir):
+    env_vars = get_env_vars("test_compare")
+    env_vars.update(
+        {
+            "HOME": str(comparison_dir),
+            "KEEPASSDB": str(comparison_dir / "test_compare.kdbx"),
+        }
+    )
+    copy_path = str(comparison_dir / "test_compare_conflicting.kdbx")
+    with patch.dict(environ, env_vars):
+        result = runner.invoke(
+            app, ["-o", "ndjson", "compare", "--paths", copy_path, "--no-cache"]
+        )
+    assert result.exit_code == 0
+    assert [json.loads(line) for line in result.stdout.splitlines()] == [
+        {
+            "database": str(comparison_dir / "test_compare.kdbx"),
+            "other": copy_path,
+            "only_in_database": 0,
+            "only_in_other": 1,
+            "conflicting": 2,
+        }
+    ]
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+from os import environ
+from unittest.mock import patch
+import uuid
+
+import attr
+import pytest
+from typer.testing import CliRunner
+
+from kpcli.cli import app
+from kpcli.connector import KpDatabaseConnector
+from kpcli.datastructures import KpConfig
+from kpcli.search import (
+    EXACT_MATCH,
+    FULL_NAME_PENALTY,
+    FUZZY_MATCH,
+    PREFIX_MATCH,
+    SUBSTRING_MATCH,
+    WORD_MATCH,
+    KpSearchIndex,
+    match_score,
+    parse_query,
+)
+
+from .test_cli import get_env_vars
+
+runner = CliRunner()
+
+
+@attr.s
+class Entry:
+    title = attr.ib()
+    username = attr.ib(default=None)
+    url = attr.ib(default=None)
+    uuid = attr.ib(factory=uuid.uuid4)
+
+
+@pytest.fixture
+def search_index():
+    search_index = KpSearchIndex()
+    for title, username, url, group_path in [
+        ("gmail", "me@gmail.com", "https://mail.google.com", "internet/email"),
+        ("github", "me", "https://github.com", "internet/code"),
+        ("bank", "account 1234", "https://bank.example.com", "finance"),
+        ("work email", "me@work.example.com", None, "work"),
+    ]:
+        search_index.add(Entry(title, username, url), group_path)
+    yield search_index
+
+
+@pytest.mark.parametrize(
+    "query,expected_score",
+    [
+        ("gmail", EXACT_MATCH),
+        ("internet/email/gmail", EXACT_MATCH - FULL_NAME_PENALTY),
+        ("gma", PREFIX_MATCH),
+        ("internet/em", PREFIX_MATCH - FULL_NAME_PENALTY),
+        ("ema", WORD_MATCH - FULL_NAME_PENALTY),
+        ("mai", SUBSTRING_MATCH),
+        ("foo", 0),
+    ],
+)
+def test_match_score(query, expected_score):
+    assert match_score(query, "gmail", "internet/email/gmail") == expected_score
+
+
+@pytest.mark.parametrize(
+    "query,expected_titles",
+    [
+        # typos
+        ("gmial", ["gmail"]),
+        ("githb", ["github"]),
+        # usernames, urls and group paths are searched too
+        ("finance", ["bank"]),
+        ("acount 1243", ["bank"]),
+        ("mail.google", ["gmail"]),
+        ("foo", []),
+    ],
+)
+def test_search(search_index, query, expected_titles):
+    assert [entry.title for _, entry in search_index.search(query)] == expected_titles
+
+
+def test_search_ranking(search_index):
+    results = search_index.search("email")
+    # the title word match ranks above the group path match
+    assert [entry.title for _, entry in results] == ["work email", "gmail"]
+    assert results[0][0] == WORD_MATCH
+
+
+def test_search_index_remove(search_index):
+    entry = search_index.search("gmail")[0][1]
+    search_index.remove(entry)
+    assert "gmail" not in [entry.title for _, entry in search_index.search("gmail")]
+    assert "gmail" not in search_index.word_entries
+
+
+def test_connector_search_entries(test_db_path):
+    connector = KpDatabaseConnector(
+        KpConfig(filename=test_db_path("test_db"), password="test")
+    )
+    results = connector.search_entries("multi")
+    assert [entry.title for _, entry in results] == ["Multi1", "Multi2", "Multi3"]
+    assert all(score >= 1 for score, _ in results)
+    # matches are scored without building the search index
+    assert connector.index._search_index is None
+    # no matches, so suggestions are returned
+    score, entry = connector.search_entries("gmial")[0]
+    assert entry.title == "gmail"
+    assert score <= FUZZY_MATCH
+
+
+def test_connector_search_updated_after_edit(temp_db_path):
+    connector = KpDatabaseConnector(KpConfig(filename=temp_db_path, password="test"))
+    assert connector.search_entries("hotmial") == []
+    entry = connector.find_entries("gmail")[0]
+    connector.edit_entry(entry, "url", "hotmail.com")
+    assert connector.search_entries("hotmial")[0][1].title == "gmail"
+    connector.delete_entry(entry)
+    assert connector.search_entries("hotmial") == []
+
+
+def test_find_entries_with_regex_characters(temp_db_path):
+    connector = KpDatabaseConnector(KpConfig(filename=temp_db_path, password="test"))
+    connector.add_new_entry(connector.find_group("root"), "c++ (old)", "u", "p", "", "")
+    assert [entry.title for entry in connector.find_entries("c++ (old")] == ["c++ (old)"]
+
+
+@patch.dict(environ, get_env_vars("test_db"))
+def test_get_suggests_similar_entries():
+    result = runner.invoke(app, ["get", "gmial"])
+    assert "No matching entry found" in result.stdout
+    assert "Did you mean:\n  MyGroup/gmail" in result.stdout
+
+
+@patch.dict(environ, get_env_vars("test_db"))
+@patch("kpcli.cli.typer.prompt")
+def test_edit_selects_from_suggestions(mock_prompt):
+    mock_prompt.side_effect = ["1"]
+    with patch("kpcli.connector.KpDatabaseConnector.edit_entry") as mock_edit:
+        result = runner.invoke(app, ["edit", "gmial", "--field", "url", "--value", "a.com"])
+    assert "1: MyGroup/gmail" in result.stdout
+    assert "Entry: MyGroup/gmail" in result.stdout
+    mock_edit.assert_called_once()
+
+
+@patch.dict(environ, get_env_vars("temp_db"))
+@patch("kpcli.cli.typer.prompt")
+def test_exact_match_selected(mock_prompt, temp_db_path):
+    connector = KpDatabaseConnector(KpConfig(filename=temp_db_path, password="test"))
+    connector.add_new_entry(connector.find_group("root"), "gmail old", "u", "p", "", "")
+    result = runner.invoke(app, ["edit", "gmail", "--field", "url", "--value", "a.com"])
+    # no prompt to choose between gmail and gmail old
+    mock_prompt.assert_not_called()
+    assert "MyGroup/gmail: url updated to a.com" in result.stdout
+
+
+@pytest.mark.parametrize(
+    "query,expected",
+    [
+        ("admin", [[(None, "admin")]]),
+        ("url:example.com admin", [[("url", "example.com"), (None, "admin")]]),
+        ("a AND b OR URL:c", [[(None, "a"), (None, "b")], [("url", "c")]]),
+        ('notes:"two words"', [[("notes", "two words")]]),
+        (["notes:two words", "OR"], [[("notes", "two words")]]),
+        ("http://", [[(None, "http://")]]),
+    ],
+)
+def test_parse_query(query, expected):
+    assert parse_query(query) == expected
+
+
+@pytest.fixture
+def text_search_connector(temp_db_path):
+    connector = KpDatabaseConnector(KpConfig(filename=temp_db_path, password="test"))
+    entry = connector.find_entries("gmail")[0]
+    entry.set_custom_property("Server", "mail.example.com")
+    connector.edit_entry(entry, "notes", "Recovery codes\nin the safe")
+    yield connector
+
+
+@pytest.mark.parametrize(
+    "query,expected",
+    [
+        (
+            "test",
+            ["Test Root Entry", "gmail", "Entry with no password", "Multi1", "Multi2", "Multi3"],
+        ),
+        ("test.com", [("gmail", {"username": "test@test.com"})]),
+        ("username:testuser", ["Entry with no password"]),
+        ("url:gmail.com", [("gmail", {"url": "gmail.com"})]),
+        ("server:example", [("gmail", {"Server": "mail.example.com"})]),
+        ("safe", [("gmail", {"notes": "Recovery codes\nin the safe"})]),
+        ("group:test multi1", [("Multi1", {"group": "Test", "title": "Multi1"})]),
+        ("multi1 OR multi3", ["Multi1", "Multi3"]),
+        ("multi1 multi3", []),
+        # words are matched by their start
+        ("username:user", []),
+        # passwords aren't searched
+        ("testpass", []),
+    ],
+)
+def test_search_text(text_search_connector, query, expected):
+    results = list(text_search_connector.search_text(query))
+    if expected and isinstance(expected[0], tuple):
+        assert [(entry.title, fields) for entry, fields in results] == expected
+    else:
+        assert [entry.title for entry, _ in results] == expected
+
+
+def test_search_text_updated_after_changes(text_search_connector):
+    connector = text_search_connector
+    assert list(connector.search_text("hotmail")) == []
+    entry = connector.find_entries("gmail")[0]
+    connector.edit_entry(entry, "url", "hotmail.com")
+    assert [entry.title for entry, _ in connector.search_text("hotmail")] == ["gmail"]
+    connector.add_new_entry(connector.find_group("root"), "new", "u", "p", "hotmail.org", "")
+    assert [entry.title for entry, _ in connector.search_text("url:hotmail")] == [
+        "gmail",
+        "new",
+    ]
+    connector.delete_group(connector.find_group("MyGroup"))
+    assert [entry.title for entry, _ in connector.search_text("hotmail")] == ["new"]
+    assert ("title", "gmail") not in connector.index.text_index.postings
+
+
+@patch.dict(environ, get_env_vars("test_db"))
+def test_search_command():
+    result = runner.invoke(app, ["search", "url:gmail", "OR", "username:testuser"])
+    assert result.exit_code == 0
+    assert "MyGroup/gmail\n  url: gmail.com" in result.stdout
+    assert "MyGroup/Entry with no password\n  username: testuser" in result.stdout
+
+    result = runner.invoke(app, ["search", "nothing"])
+    assert result.exit_code == 1
+    assert "No matching entries found" in result.stdout
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+from os import environ
+from unittest.mock import patch
+
+from typer.testing import CliRunner
+
+from kpcli.cli import app
+from kpcli.connector import KpDatabaseConnector
+from kpcli.datastructures import KpConfig, KpContext
+from kpcli.kdbx import save_database
+from kpcli.shell import KpShell
+
+from .test_cli import get_env_vars
+
+runner = CliRunner()
+
+
+@patch.dict(environ, get_env_vars("test_db"))
+def test_shell_runs_commands():
+    result = runner.invoke(app, ["shell"], input="ls\nget gmail\nfoo\nexit\n")
+    assert result.exit_code == 0
+    assert result.stdout.count("UNLOCKING") == 1
+    assert "MyGroup" in result.stdout
+    assert "MyGroup/gmail" in result.stdout
+    assert "Unknown command: foo" in result.stdout
+
+
+@patch.dict(environ, get_env_vars("test_db"))
+def test_shell_command_errors():
+    result = runner.invoke(app, ["shell"], input="ls -g foo\nget\ncompare\nexit\n")
+    assert result.exit_code == 0
+    assert "No group matching 'foo' found" in result.stdout
+    assert "Missing argument" in result.stdout
+    assert "Unknown command: compare" in result.stdout
+
+
+@patch.dict(environ, get_env_vars("temp_db"))
+def test_shell_saves_once(temp_db_path):
+    commands = [
+        "edit gmail --field url --value foo.com",
+        "edit gmail --field notes --value 'some notes'",
+        "add --group mygroup --title new --username u --password p --url '' --notes ''",
+        "exit",
+    ]
+    with patch("kpcli.connector.save_database", wraps=save_database) as mock_save:
+        result = runner.invoke(app, ["shell"], input="\n".join(commands) + "\n")
+    assert result.exit_code == 0
+    assert mock_save.call_count == 1
+
+    connector = KpDatabaseConnector(KpConfig(filename=temp_db_path, password="test"))
+    entry = connector.find_entries("gmail")[0]
+    assert (entry.url, entry.notes) == ("foo.com", "some notes")
+    assert len(connector.find_entries("mygroup/new")) == 1
+
+
+@patch.dict(environ, get_env_vars("temp_db"))
+def test_shell_save_command(temp_db_path):
+    with patch("kpcli.connector.save_database", wraps=save_database) as mock_save:
+        result = runner.invoke(
+            app, ["shell"], input="save\nedit gmail -v foo.com --field url\nsave\nexit\n"
+        )
+    assert "No changes to save" in result.stdout
+    assert "Saved" in result.stdout
+    # nothing left to save on exit
+    assert mock_save.call_count == 1
+
+
+def test_shell_completion(test_db_path):
+    connector = KpDatabaseConnector(KpConfig(filename=test_db_path("test_db"), password="test"))
+    shell = KpShell(None, {"obj": KpContext(connector=connector)})
+    assert shell.completedefault("gm", "get gm", 4, 6) == ["gmail"]
+    # names with spaces are completed from the start of the argument
+    assert shell.completedefault("no", "get Entry with no", 15, 17) == [
+        "no password",
+        "no username",
+    ]
+    assert shell.completedefault("MyGroup/g", "cp MyGroup/g", 3, 12) == ["MyGroup/gmail"]
+
+
+@patch.dict(environ, get_env_vars("temp_db"))
+def test_shell_keeps_running_after_error(temp_db_path):
+    commands = [
+        "add --group mygroup --title keepme --username u --password p --url '' --notes ''",
+        "edit gmail --field bogus --value x",
+        "exit",
+    ]
+    result = runner.invoke(app, ["shell"], input="\n".join(commands) + "\n")
+    assert result.exit_code == 0
+    assert "Entry has no attribute bogus" in result.stdout
+
+    connector = KpDatabaseConnector(KpConfig(filename=temp_db_path, password="test"))
+    assert len(connector.find_entries("mygroup/keepme")) == 1
+
+
+@patch.dict(environ, get_env_vars("temp_db"))
+def test_shell_saves_on_unexpected_error(temp_db_path):
+    commands = [
+        "add --group mygroup --title keepme --username u --password p --url '' --notes ''",
+        "ls",
+    ]
+    with patch("kpcli.shell.KpShell.do_EOF", side_effect=RuntimeError("broken")):
+        result = runner.invoke(app, ["shell"], input="\n".join(commands) + "\n")
+    assert isinstance(result.exception, RuntimeError)
+
+    connector = KpDatabaseConnector(KpConfig(filename=temp_db_path, password="test"))
+    assert len(connector.find_entries("mygroup/keepme")) == 1
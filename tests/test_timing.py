@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+import json
+from os import environ
+from unittest.mock import patch
+
+import pytest
+from typer.testing import CliRunner
+
+from kpcli import timing
+from kpcli.cli import app
+
+from .test_cli import get_env_vars
+
+# keep stderr separate, so the timings can be checked
+runner = CliRunner(mix_stderr=False)
+
+
+def test_phases_nest_and_add_up():
+    recorder = timing.PhaseRecorder("test")
+    with recorder.phase("outer"):
+        for _ in range(3):
+            with recorder.phase("inner"):
+                pass
+    items = recorder.timed_generator("items", iter(range(2)))
+    assert list(items) == [0, 1]
+    assert list(recorder.phases) == [("outer",), ("outer", "inner"), ("items",)]
+    assert recorder.phases[("outer", "inner")][1] == 3
+    # one call per item, and one for the end of the iteration
+    assert recorder.phases[("items",)][1] == 3
+
+
+def test_timing_off():
+    assert timing.timed_iteration("items", [1, 2]) == [1, 2]
+    with timing.phase("ignored"):
+        pass
+    assert timing.timed(lambda: 1, "function")() == 1
+
+
+@patch.dict(environ, get_env_vars("test_db"))
+def test_timings_option():
+    result = runner.invoke(app, ["--timings", "get", "gmail"])
+    assert result.exit_code == 0
+    assert "Timings for get:" in result.stderr
+    for phase in ["setup_db", "unlock", "open", "kdf", "xml_parse", "search_entries", "total"]:
+        assert phase in result.stderr
+    assert "Timings" not in result.stdout
+
+    # timing is off for the next command
+    result = runner.invoke(app, ["get", "gmail"])
+    assert "Timings" not in result.stderr
+
+
+def test_trace_file(tmp_path):
+    trace_file = tmp_path / "trace.jsonl"
+    env_vars = get_env_vars("test_db")
+    env_vars["KPCLI_TRACE"] = str(trace_file)
+    with patch.dict(environ, env_vars):
+        for _ in range(2):
+            result = runner.invoke(app, ["ls"])
+            assert result.exit_code == 0
+    records = [json.loads(line) for line in trace_file.read_text().splitlines()]
+    assert len(records) == 2
+    assert records[0]["command"] == "ls"
+    phases = {phase["phase"]: phase for phase in records[0]["phases"]}
+    assert "setup_db/unlock/open/kdf" in phases
+    assert phases["list_group_names"]["calls"] == 1
+
+
+@pytest.mark.parametrize("trace", ["0", "false", "No", "off"])
+def test_trace_off(tmp_path, monkeypatch, trace):
+    monkeypatch.chdir(tmp_path)
+    env_vars = get_env_vars("test_db")
+    env_vars["KPCLI_TRACE"] = trace
+    with patch.dict(environ, env_vars):
+        result = runner.invoke(app, ["ls"])
+    assert result.exit_code == 0
+    assert "Timings" not in result.stderr
+    # not taken as the name of a trace file
+    assert list(tmp_path.iterdir()) == []